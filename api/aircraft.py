@@ -0,0 +1,115 @@
+import json
+from os.path import abspath, dirname, isfile, join
+from utils import constrain_map
+
+# Where the API server stores the design values of every aircraft it has
+# flown, next to this file, rather than wherever it happens to be started from.
+AIRCRAFT_PROFILES = join(dirname(abspath(__file__)), 'aircraft.json')
+
+# The (effectively) constant values we need to know about a plane,
+# which we only need to read from MSFS once per aircraft.
+DESIGN_VARIABLES = {
+    'climb_speed': 'DESIGN_SPEED_CLIMB',
+    'min_rotation': 'DESIGN_SPEED_MIN_ROTATION',
+    'engine_count': 'NUMBER_OF_ENGINES',
+    'is_tail_dragger': 'IS_TAIL_DRAGGER',
+}
+
+# Values that depend on fuel and payload, which we read from MSFS every
+# time we build a profile, rather than storing them with the aircraft.
+LOADING_VARIABLES = {
+    'total_weight': 'TOTAL_WEIGHT',
+}
+
+
+class AircraftProfile:
+    """
+    Everything we know about the current aircraft that doesn't change
+    from tick to tick: its design constants, and the values we derive
+    from them, so the autopilot doesn't need to recompute those every
+    tick either.
+    """
+
+    def __init__(self, title, total_weight, climb_speed, min_rotation, engine_count, is_tail_dragger):
+        self.title = title
+        self.total_weight = total_weight
+        self.climb_speed = climb_speed
+        self.min_rotation = min_rotation
+        self.engine_count = int(engine_count)
+        self.is_tail_dragger = is_tail_dragger == 1
+
+        # derived values for auto-takeoff
+        self.specific_constant = (total_weight * climb_speed) / 1000
+        self.rotate_speed = 1.1 * min_rotation
+        self.takeoff_factor = constrain_map(total_weight, 3000, 6500, 0.001, 0.1)
+        self.pull_back = constrain_map(total_weight, 3000, 6500, 0.005, 0.5)
+        self.initial_trim = constrain_map(total_weight, 3000, 6500, 0, 0.1)
+        self.level_out_VS = constrain_map(total_weight, 3000, 6500, 300, 1000)
+
+    @property
+    def aircraft_class(self):
+        """
+        The tuner's aircraft class that is the closest match for this plane.
+        """
+        if self.total_weight < 3500:
+            return 'light'
+        if self.total_weight < 5500:
+            return 'medium'
+        return 'heavy'
+
+    def __dict__(self):
+        return {
+            'climb_speed': self.climb_speed,
+            'min_rotation': self.min_rotation,
+            'engine_count': self.engine_count,
+            'is_tail_dragger': 1 if self.is_tail_dragger else 0,
+        }
+
+
+def get_title(api):
+    title = api.get('TITLE')
+    if isinstance(title, bytes):
+        title = title.decode('utf-8', errors='ignore')
+    return title
+
+
+def load_profiles(path):
+    if path is None or not isfile(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def get_aircraft_profile(api, path=None):
+    """
+    Build the profile for whatever aircraft we're flying. If we're given
+    a {path}, we use the design values stored there if we've seen this
+    aircraft before, and read (and then store) them from MSFS if we haven't.
+    Without one, we always read them from MSFS. Its current weight always
+    comes from MSFS. Returns None if MSFS can't tell us what we need to
+    know yet.
+    """
+    title = get_title(api)
+    if title is None:
+        return None
+
+    loading = {name: api.get(variable) for name, variable in LOADING_VARIABLES.items()}
+    if None in loading.values():
+        return None
+
+    profiles = load_profiles(path)
+    if title in profiles:
+        return AircraftProfile(title, **profiles[title], **loading)
+
+    values = {name: api.get(variable) for name, variable in DESIGN_VARIABLES.items()}
+    if None in values.values():
+        return None
+
+    profile = AircraftProfile(title, **values, **loading)
+    if path is None:
+        return profile
+    profiles[title] = profile.__dict__()
+    with open(path, 'w') as file:
+        json.dump(profiles, file, indent=2)
+    print(f'Stored aircraft profile for {title}')
+    return profile
@@ -1,14 +1,24 @@
 import time
+from functools import partial
 from typing import Dict, Union
-from threading import Timer
-from simconnection import SimConnection
-from auto_takeoff import auto_takeoff
-from fly_level import fly_level
-from vertical_hold import vertical_hold
-from state import State
-from utils import test, get_distance_between_points
+from threading import Lock, Condition
+from simconnection import SimConnection, FRAME_RATE, PAUSED_INTERVAL
+from auto_takeoff import auto_takeoff, TakeoffState, FIELDS as TAKEOFF_FIELDS
+from fly_level import fly_level, follow_waypoint, FIELDS as LEVEL_FIELDS
+from vertical_hold import vertical_hold, FIELDS as VERTICAL_FIELDS
+from terrain import TerrainFollow, DEFAULT_CLEARANCE, get_local_lookup, FIELDS as TERRAIN_FIELDS
+from state import State, FIELD_VARIABLES, build_state, get_variables
+from waypoints import WayPoints, FIELDS as WAYPOINT_FIELDS
+from flightplan import get_format, parse as parse_flight_plan, write as write_flight_plan
 from vector import Vector
-from math import pi
+from parameters import DEFAULT_PARAMETERS, PROFILES, load_parameters
+from aircraft import get_aircraft_profile
+from metrics import TickMetrics
+from scheduler import get_scheduler
+from clock import WallClock
+from loops import LoopSchedule, AdaptiveRate
+from controllers import ControllerBank, ROLL, PITCH, WEIGHT_RANGE
+from math import pi, radians
 
 from constants import (
     AUTO_TAKEOFF,
@@ -17,44 +27,82 @@ from constants import (
     VERTICAL_SPEED_HOLD,
     ALTITUDE_HOLD,
     ACROBATIC,
-    INVERTED_FLIGHT
+    INVERTED_FLIGHT,
+    PID_CONTROL,
+    TERRAIN_FOLLOW
 )
 
-crashed = False
+# Every variable the autopilot could need from MSFS on a tick.
+TICK_VARIABLES = get_variables(FIELD_VARIABLES)
+
+# The State fields that each mode's handler needs.
+MODE_FIELDS = {
+    AUTO_TAKEOFF: TAKEOFF_FIELDS,
+    LEVEL_FLIGHT: LEVEL_FIELDS,
+    VERTICAL_SPEED_HOLD: VERTICAL_FIELDS,
+    TERRAIN_FOLLOW: TERRAIN_FIELDS,
+}
+
+# How often (in Hz) each control loop runs. The trim-nudging control laws
+# are tuned to run twice a second, while navigation and terrain targets
+# change slowly enough that they only need updating every second or two.
+LOOP_RATES = {
+    'navigation': 1,
+    'auto_takeoff': 2,
+    'fly_level': 2,
+    'terrain_follow': 0.5,
+    'vertical_hold': 2,
+}
+
+# The PID control laws take the time between updates into account,
+# so they can (and should) run a lot faster than the trim nudging.
+PID_LOOP_RATES = {
+    'fly_level': 10,
+    'vertical_hold': 10,
+}
 
 def gps_distance(lat1, long1, lat2, long2):
     pass
 
 
-class Waypoint:
-    def __init__(self, lat, long, alt=None):
-        self.lat = lat
-        self.long = long
-        self.alt = alt
-
-    def __str__(self):
-        return f'{self.lat},{self.long},{self.alt}'
-
-    def __eq__(self, other):
-        if not hasattr(other, 'lat'):
-            return False
-        if not hasattr(other, 'long'):
-            return False
-        return self.lat == other.lat and self.long == other.long
-
-    def __dict__(self):
-        return {
-            'lat': self.lat,
-            'long': self.long,
-            'alt': self.alt
-        }
-
-
 class AutoPilot():
-    def __init__(self, api: SimConnection, old_instance=None):
+    def __init__(self, api: SimConnection, old_instance=None, tick_frames=None, scheduler=None):
         self.api: SimConnection = api
         api.set_auto_pilot(self)
         self.auto_pilot_enabled: bool = False
+        self.crashed = False
+        # Goes up every time the modes, waypoints or AP state change, so
+        # clients can ask whether (or wait until) anything changed.
+        self.version = 0
+        self.version_changed = Condition()
+        # Timer-driven ticks for every autopilot in this process run off
+        # of one shared scheduler, unless we're given our own.
+        self.scheduler = scheduler or get_scheduler()
+        self.tick_lock = Lock()
+        # Where our time comes from (see clock.py). States get timestamped,
+        # PIDs get updated, and ticks get scheduled, in this clock's time.
+        self.clock = WallClock()
+        self.tick_time = self.clock.now()
+        # If set, run off of a data subscription that delivers a fresh
+        # sample every {tick_frames} sim frames, rather than off a timer.
+        self.tick_frames = tick_frames
+        self.metrics = TickMetrics()
+        self.tick_variables = {}
+        self.subscribed = None
+        self.subscribed_rate = 1
+        # When running off of a subscription, our base tick is fixed by how
+        # often we get samples. Otherwise it's the fastest loop's rate.
+        self.loops = LoopSchedule(FRAME_RATE / tick_frames if tick_frames else None)
+        self.loops.register('navigation', self.navigate, LOOP_RATES['navigation'])
+        self.loops.register('auto_takeoff', partial(auto_takeoff, self), LOOP_RATES['auto_takeoff'], AUTO_TAKEOFF)
+        self.loops.register('fly_level', partial(fly_level, self), LOOP_RATES['fly_level'], LEVEL_FLIGHT)
+        self.loops.register('terrain_follow', self.follow_terrain, LOOP_RATES['terrain_follow'], TERRAIN_FOLLOW)
+        self.loops.register('vertical_hold', partial(vertical_hold, self), LOOP_RATES['vertical_hold'], VERTICAL_SPEED_HOLD)
+        self.adaptive = AdaptiveRate()
+        self.paused = False
+        # An optional state estimator (see estimator.py) that filters the
+        # sampled state, and lets us run ticks off of predicted states.
+        self.estimator = None
         if old_instance is not None:
             self.modes = old_instance.modes
         else:
@@ -66,8 +114,11 @@ class AutoPilot():
                 ALTITUDE_HOLD: False,
                 ACROBATIC: False,  # use the special acrobatic code instead?
                 INVERTED_FLIGHT: False,  # fly upside down?
+                PID_CONTROL: False,  # use the PID controllers instead?
+                TERRAIN_FOLLOW: False,  # set our altitude based on the terrain ahead?
             }
         self.bootstrap()
+        self.update_loop_rates()
 
     def bootstrap(self):
         """
@@ -77,16 +128,159 @@ class AutoPilot():
         self.anchor = Vector()
         self.acrobatic = True
         self.inverted = False
-        self.waypoints = []
+        self.parameters = dict(DEFAULT_PARAMETERS)
+        self.waypoints = WayPoints(self.parameters)
+        self.controllers = ControllerBank(time_fn=self.get_tick_time)
+        self.terrain = TerrainFollow()
+        self.aircraft = None
+        # Where we remember aircraft design values, if anywhere (see aircraft.py).
+        self.aircraft_profiles = None
+        # Where we load tuned parameters for the aircraft's class from.
+        self.profiles = PROFILES
+        self.takeoff = TakeoffState()
+
+    def get_aircraft(self):
+        """
+        Get the profile for the aircraft we're flying, building it (and
+        loading any tuned parameters for its class) the first time we
+        need it. Returns None if MSFS can't tell us enough yet.
+        """
+        if self.aircraft is None:
+            self.aircraft = get_aircraft_profile(self.api, self.aircraft_profiles)
+            if self.aircraft is not None:
+                print(f'Flying {self.aircraft.title} ({self.aircraft.aircraft_class})')
+                self.load_parameters(self.profiles, self.aircraft.aircraft_class)
+        return self.aircraft
+
+    def load_parameters(self, path, aircraft_class):
+        """
+        Load tuned fly_level/vertical_hold parameters for an aircraft class.
+        """
+        self.parameters.update(load_parameters(path, aircraft_class))
+        self.waypoints.leg = None
+
+    def use_elevation_data(self, tiles_folder):
+        """
+        Look terrain up directly in a local copy of the ALOS dataset,
+        instead of going through the elevation server.
+        """
+        self.terrain = TerrainFollow(get_local_lookup(tiles_folder))
+
+    def use_clock(self, clock):
+        """
+        Run off of a different clock, e.g. one that follows the sim's
+        simulation rate, so that everything keeps working when MSFS
+        runs faster (or slower) than real time.
+        """
+        self.clock = clock
+        self.tick_time = clock.now()
+        self.tick_variables = {}
+        self.prev_state = State(call_time=self.tick_time)
+        if self.estimator is not None:
+            self.estimator.reset()
+        self.update_subscription()
+
+    def use_estimator(self, estimator):
+        """
+        Filter our sampled states through a state estimator (see estimator.py),
+        or stop doing so if {estimator} is None.
+        """
+        self.estimator = estimator
+        if estimator is not None:
+            estimator.reset()
+
+    def restart_timing(self, call_time):
+        """
+        Time jumped (e.g. the user changed the sim's time of day), so
+        anything that works off of how much time passed since the last
+        tick needs to forget about that last tick.
+        """
+        print('Sim time jumped, restarting the autopilot timing')
+        self.tick_time = call_time
+        self.prev_state = State(call_time=call_time)
+        self.adaptive.steady_since = None
+        if self.estimator is not None:
+            self.estimator.reset()
+        if self.takeoff.pid is not None:
+            self.takeoff.pid.reset()
+        if self.modes[PID_CONTROL]:
+            self.engage_controllers()
+
+    def get_tick_time(self):
+        """
+        The time of the tick we're running, so that anything that needs
+        to know how much time passed (like our PIDs) agrees with the State.
+        """
+        return self.tick_time
+
+    def engage_controllers(self):
+        """
+        (Re)start our PID controllers from the current trim values.
+        """
+        aircraft = self.get_aircraft()
+        self.controllers.weight = aircraft.total_weight if aircraft else WEIGHT_RANGE[0]
+        a_trim = self.get('AILERON_TRIM_PCT') or 0
+        self.controllers.engage(ROLL, -a_trim, (-1, 1), 0.001)
+        trim = self.get('ELEVATOR_TRIM_POSITION') or 0
+        limit_up = radians(abs(self.get('ELEVATOR_TRIM_UP_LIMIT') or 10))
+        limit_down = radians(abs(self.get('ELEVATOR_TRIM_DOWN_LIMIT') or 10))
+        self.controllers.engage(PITCH, trim, (-limit_down, limit_up), radians(0.001))
+
+    def state_changed(self):
+        with self.version_changed:
+            self.version += 1
+            self.version_changed.notify_all()
+
+    def wait_for_change(self, since, timeout):
+        """
+        Wait (for at most {timeout} seconds) until our version is no longer
+        {since}, and return whatever our version is by then. A {since} that's
+        ahead of us comes from before a restart, so it doesn't wait at all.
+        """
+        with self.version_changed:
+            self.version_changed.wait_for(lambda: self.version != since, timeout)
+            return self.version
 
     def add_waypoint(self, lat, long, alt=None):
-        self.waypoints.append(Waypoint(lat, long, alt))
+        self.waypoints.add(lat, long, alt)
+        self.state_changed()
+        self.update_subscription()
 
     def remove_waypoint(self, lat, long):
-        self.waypoints.remove(Waypoint(lat, long))
+        self.waypoints.remove(lat, long)
+        self.state_changed()
+        self.update_subscription()
+
+    def import_flight_plan(self, source, format=None, replace=True):
+        """
+        Load a GPX, PLN or GeoJSON route, either from a file path or from
+        a binary stream. Returns the number of waypoints we now have.
+        """
+        if isinstance(source, str):
+            format = format or get_format(source)
+            with open(source, 'rb') as stream:
+                return self.import_flight_plan(stream, format, replace)
+        if format is None:
+            raise ValueError('unknown flight plan format')
+        self.waypoints.extend(parse_flight_plan(source, format), replace)
+        print(f'Loaded {format} flight plan, {len(self.waypoints)} waypoints')
+        self.state_changed()
+        self.update_subscription()
+        return len(self.waypoints)
+
+    def export_flight_plan(self, out, format):
+        write_flight_plan(self.waypoints, out, format)
+
+    def update_loop_rates(self):
+        rates = dict(LOOP_RATES)
+        if self.modes[PID_CONTROL]:
+            rates.update(PID_LOOP_RATES)
+        self.loops.set_rates(rates)
 
     def schedule_ap_call(self):
-        Timer(0.5, self.try_run_auto_pilot, [], {}).start()
+        # Our loop rates are in sim time, but timers run in real time.
+        interval = PAUSED_INTERVAL if self.paused else self.loops.interval / self.clock.rate
+        self.scheduler.call_later(interval, self.try_run_auto_pilot)
 
     def get(self, name):
         return self.api.get_standard_property_value(name)
@@ -110,7 +304,10 @@ class AutoPilot():
         if ap_type not in self.modes:
             return None
         self.modes[ap_type] = not self.modes[ap_type]
+        self.state_changed()
         if self.modes[ap_type]:
+            if ap_type == AUTO_TAKEOFF:
+                self.takeoff = TakeoffState()
             if ap_type == VERTICAL_SPEED_HOLD:
                 print(f'Engaging vertical speed hold')
                 self.anchor.y = self.get('ELEVATOR_TRIM_POSITION')
@@ -125,37 +322,135 @@ class AutoPilot():
             self.anchor.y = 0
             self.api.set('ELEVATOR_TRIM_POSITION', -
                          0.07 if self.inverted else 0)
+        if ap_type == PID_CONTROL:
+            self.update_loop_rates()
+        if self.modes[PID_CONTROL] and ap_type in [PID_CONTROL, LEVEL_FLIGHT, VERTICAL_SPEED_HOLD]:
+            self.engage_controllers()
+        self.update_subscription()
         return self.modes[ap_type]
 
     def set_target(self, ap_type, value):
         if ap_type in self.modes:
-            self.modes[ap_type] = value if value != None else False
+            mode = value if value != None else False
+            if mode != self.modes[ap_type]:
+                self.modes[ap_type] = mode
+                self.state_changed()
             if ap_type == ALTITUDE_HOLD:
                 print(f'Engaging altitude hold at {value} feet')
                 self.prev_alt = self.get('INDICATED_ALTITUDE')
             if ap_type == HEADING_MODE:
                 print(f'Engaging heading hold at {value} degrees')
                 self.set('AUTOPILOT_HEADING_LOCK_DIR', value)
+            if ap_type == TERRAIN_FOLLOW:
+                print(f'Engaging terrain follow at {value} feet above the terrain')
+            self.update_subscription()
             return value
         return None
 
+    def steer(self, heading):
+        """
+        Set our heading target from our own navigation, which does so every
+        time it runs, with a slightly different heading each time. Clients
+        only get told about that (by a new version) once the heading changes
+        by at least a degree, and we don't announce it on the tick path.
+        """
+        current = self.modes[HEADING_MODE]
+        self.modes[HEADING_MODE] = heading
+        self.set('AUTOPILOT_HEADING_LOCK_DIR', heading)
+        if current is False or round(current) != round(heading):
+            self.state_changed()
+        if current is False:
+            self.update_subscription()
+
+    def navigate(self, state):
+        """
+        If we're close enough to a waypoint that we should be turning onto
+        the next leg, remove it, and then make sure that we're heading for
+        whichever waypoint is next.
+        """
+        if state.has(*WAYPOINT_FIELDS):
+            if self.waypoints.invalidate(state.latitude, state.longitude, state.ground_speed):
+                self.state_changed()
+        if self.modes[LEVEL_FLIGHT] and not self.modes[ACROBATIC]:
+            follow_waypoint(self, state)
+
+    def follow_terrain(self, state):
+        """
+        Set our target altitude to whatever clears the terrain ahead of
+        us. The terrain follow mode is either a clearance in feet, or
+        True to use the default clearance.
+        """
+        clearance = self.modes[TERRAIN_FOLLOW]
+        if clearance is True:
+            clearance = DEFAULT_CLEARANCE
+        altitude = self.terrain.get_target_altitude(state, clearance, self.modes[ALTITUDE_HOLD])
+        if altitude is not None and altitude != self.modes[ALTITUDE_HOLD]:
+            print(f'Terrain ahead: setting altitude to {altitude} feet')
+            self.modes[ALTITUDE_HOLD] = altitude
+            self.state_changed()
+
     def toggle_auto_pilot(self):
         print("toggling autopilot")
         self.auto_pilot_enabled = not self.auto_pilot_enabled
+        self.state_changed()
         if self.auto_pilot_enabled:
             self.prev_call_time = time.perf_counter()
-            self.schedule_ap_call()
+            if self.estimator is not None:
+                self.estimator.reset()
+            # We may be flying a different plane than last time, which
+            # may well have its own tuned parameters.
+            self.aircraft = None
+            self.get_aircraft()
+            if self.tick_frames is not None:
+                self.update_subscription()
+            else:
+                self.schedule_ap_call()
+        elif self.tick_frames is not None:
+            self.api.unsubscribe()
+            self.subscribed = None
         return self.auto_pilot_enabled
 
+    def get_tick_variables(self):
+        """
+        The variables we need to fetch this tick: only the ones that
+        the currently active modes (and waypoint sequencing) look at.
+        """
+        key = (tuple(bool(self.modes[mode]) for mode in MODE_FIELDS), len(self.waypoints) > 0)
+        if key not in self.tick_variables:
+            fields = set(WAYPOINT_FIELDS) if key[1] else set()
+            for mode, mode_fields in MODE_FIELDS.items():
+                if self.modes[mode]:
+                    fields.update(mode_fields)
+            self.tick_variables[key] = get_variables(fields) + self.clock.VARIABLES
+        return self.tick_variables[key]
+
+    def update_subscription(self):
+        """
+        If we're running off of a data subscription, make sure it's
+        for the variables that our active modes need, at our current rate.
+        """
+        if self.tick_frames is None or not self.auto_pilot_enabled:
+            return
+        variables = self.get_tick_variables()
+        frames = max(1, round(FRAME_RATE / (self.loops.base_rate * self.clock.rate)))
+        self.subscribed_rate = self.clock.rate
+        if (variables, frames) != self.subscribed:
+            self.subscribed = (variables, frames)
+            self.api.subscribe(variables, self.on_sample, frames)
+
     def try_run_auto_pilot(self):
+        # If our last tick is somehow still running, skip this one.
+        if not self.tick_lock.acquire(blocking=False):
+            return self.schedule_ap_call()
         try:
             self.run_auto_pilot()
         except OSError:
-            global crashed
-            crashed = True
+            self.crashed = True
             print("OSError encountered, halting autopilot.")
             import traceback
             traceback.print_exc()
+        finally:
+            self.tick_lock.release()
 
     def run_auto_pilot(self):
         """
@@ -163,7 +458,7 @@ class AutoPilot():
         grabbing the current state from MSFS, and
         forwarding it to the relevant AP handlers.
         """
-        if crashed:
+        if self.crashed:
             return
 
         if not self.auto_pilot_enabled:
@@ -176,78 +471,116 @@ class AutoPilot():
 
         self.schedule_ap_call()
 
-        # Are we flying, or paused/in menu/etc?
+        # Are we flying, or paused/in menu/etc? If we're not,
+        # there's no need to check back all that often.
         running = self.get_special('SIM_RUNNING')
-        if running is None or running < 3:
+        self.paused = running is None or running < 3
+        if self.paused:
             return
 
-        on_ground = self.get('SIM_ON_GROUND')
-        speed = self.get('AIRSPEED_TRUE')
-        bank = self.get('PLANE_BANK_DEGREES')
-        turn_rate = self.get('TURN_INDICATOR_RATE')
-        lat = self.get('PLANE_LATITUDE')
-        long = self.get('PLANE_LONGITUDE')
-        heading = self.get('PLANE_HEADING_DEGREES_MAGNETIC')
-        true_heading = self.get('PLANE_HEADING_DEGREES_TRUE')
-        alt = self.get('INDICATED_ALTITUDE')
-        vspeed = self.get('VERTICAL_SPEED')
-        trim = self.get('ELEVATOR_TRIM_POSITION')
-        a_trim = self.get('AILERON_TRIM_PCT')
-        # Why are these two tuples instead of floats?
-        (trim_limit_up,) = self.get('ELEVATOR_TRIM_UP_LIMIT'),
-        (trim_limit_down,) = self.get('ELEVATOR_TRIM_DOWN_LIMIT'),
-
-        if (speed and bank and turn_rate and lat and long and heading and true_heading and alt and vspeed and trim and a_trim and trim_limit_up and trim_limit_down) is None:
-            return print(', '.join([
-                f'speed: {test(speed)}',
-                f'bank: {test(bank)}',
-                f'turn rate: {test(turn_rate)}',
-                f'lat: {test(lat)}',
-                f'long: {test(long)}',
-                f'heading: {test(heading)}',
-                f'true_heading: {test(true_heading)}',
-                f'alt: {test(alt)}',
-                f'vspeed: {test(vspeed)}',
-                f'trim: {test(trim)}',
-                f'limit: {test(trim_limit_up)}, {test(trim_limit_down)}',
-            ]))
-
-        state = State(
-            on_ground=(on_ground == 1),
-            altitude=alt,
-            speed=speed,
-            latitude=lat,
-            longitude=long,
-            heading=heading,
-            true_heading=true_heading,
-            bank_angle=bank,
-            turn_rate=turn_rate,
-            vertical_speed=vspeed,
-            pitch_trim=trim,
-            pitch_trim_limit=[trim_limit_up, trim_limit_down],
-            aileron_trim=a_trim,
-            prev_state=self.prev_state,
-        )
-
-        # If we're close a waypoint, remove it.
-        if len(self.waypoints) > 0:
-            waypoint = self.waypoints[0]
-            if get_distance_between_points(lat, long, waypoint.lat, waypoint.long) < 0.2:
-                self.waypoints.remove(waypoint)
-
-        # Are we in auto-takeoff?
-        if self.modes[AUTO_TAKEOFF]:
-            auto_takeoff(self, state)
-
-        # Do we need to level the wings / fly a specific heading?
-        if self.modes[LEVEL_FLIGHT]:
-            fly_level(self, state)
-
-        # Do we need to hold our altitude / fly a specific altitude?
-        if self.modes[VERTICAL_SPEED_HOLD]:
-            vertical_hold(self, state)
+        # If our estimator can tell us what's going on without
+        # asking MSFS, run this tick off of its prediction.
+        if self.estimator is not None and not self.estimator.needs_sample(self.clock.now()):
+            return self.process_prediction()
+
+        # If MSFS couldn't tell us what we're flying when we got turned on, ask again.
+        if self.aircraft is None:
+            self.get_aircraft()
+
+        mark = self.metrics.mark()
+        values = {name: self.get(name) for name in self.get_tick_variables()}
+        self.metrics.record('read', mark)
+        self.process_sample(values)
+
+    def on_sample(self, values, read_time=None):
+        """
+        Subscription-driven entry point: the sim connection calls this
+        with a fresh sample whenever new data arrives, and only while
+        the sim is actually running, along with how long reading it took.
+        """
+        if self.crashed or not self.auto_pilot_enabled:
+            return
+        if read_time is not None:
+            self.metrics.record('read', self.metrics.mark() - read_time)
+        # Resubscribing starts a new reader thread, which may deliver its
+        # first sample while the old one is still running a tick: if so,
+        # skip this sample, as there'll be another one along in a moment.
+        if not self.tick_lock.acquire(blocking=False):
+            return
+        try:
+            if self.aircraft is None:
+                self.get_aircraft()
+            self.process_sample(values)
+        except OSError:
+            self.crashed = True
+            print("OSError encountered, halting autopilot.")
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.tick_lock.release()
+
+    def process_sample(self, values, call_time=None):
+        """
+        Turn a sample of our tick variables into a State, and
+        forward that to the relevant AP handlers. If no call time
+        is given, the State will be timestamped with our clock's "now".
+        """
+        metrics = self.metrics
+        start = mark = metrics.mark()
+
+        self.clock.update(values)
+        if call_time is None:
+            call_time = self.clock.now()
+        if self.clock.jumped:
+            self.clock.jumped = False
+            self.restart_timing(call_time)
+        state = build_state(values, self.prev_state, call_time)
+        if state is None:
+            return
+        if self.estimator is not None:
+            state = self.estimator.update(state)
+        mark = metrics.record('state', mark)
+        self.run_loops(state, start, mark)
+
+    def process_prediction(self, call_time=None):
+        """
+        Run a tick without sampling MSFS, off of the state that our
+        estimator predicts for "now" (or for {call_time}, if given).
+        """
+        metrics = self.metrics
+        start = mark = metrics.mark()
+        state = self.estimator.predict(self.clock.now() if call_time is None else call_time)
+        mark = metrics.record('state', mark)
+        self.run_loops(state, start, mark)
+
+    def run_loops(self, state, start, mark):
+        metrics = self.metrics
+        self.tick_time = state.call_time
+
+        # Stage everything the AP handlers want to change, so that
+        # it all gets sent to MSFS in one go at the end of this tick.
+        self.api.start_batch()
+        try:
+            # Run whichever control loops are due this tick.
+            for loop in self.loops.due():
+                if loop.mode is None or self.modes[loop.mode]:
+                    loop.handler(state)
+                    mark = metrics.record(loop.name, mark)
+        finally:
+            self.api.flush()
+            metrics.record('write', mark)
+            metrics.record('tick', start)
 
         self.prev_state = state
 
+        # Speed up or slow down, depending on how much is going on.
+        scale = self.adaptive.get_scale(self, state)
+        if scale != self.loops.scale:
+            self.loops.set_scale(scale)
+            self.update_subscription()
+        elif self.subscribed is not None and self.clock.rate != self.subscribed_rate:
+            # The sim rate changed, so we need samples more (or less) often.
+            self.update_subscription()
+
 
 48.97532966243437, -123.70450624063572
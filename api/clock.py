@@ -0,0 +1,100 @@
+from time import perf_counter
+
+# If sim time jumps by more than this many seconds between samples (or goes
+# backwards at all) the user changed the time of day or loaded another flight.
+MAX_TIME_JUMP = 10
+
+
+class WallClock:
+    """
+    Real time, which is only sim time if the sim runs at 1x.
+    """
+
+    # The MSFS variables this clock needs to see every tick.
+    VARIABLES = []
+
+    def __init__(self):
+        self.rate = 1
+        # Set when time jumped, rather than flowed, since the last sample.
+        self.jumped = False
+
+    def update(self, values):
+        pass
+
+    def now(self):
+        return perf_counter()
+
+
+class SimRateClock:
+    """
+    Real time, sped up (or slowed down) by the sim's SIMULATION_RATE,
+    which we pick up from every tick's sample. Good enough for the sim's
+    2x/4x acceleration, but it keeps running while the sim is paused.
+    """
+
+    VARIABLES = ['SIMULATION_RATE']
+
+    def __init__(self):
+        self.rate = 1
+        self.jumped = False
+        self.time = 0
+        self.mark = perf_counter()
+
+    def update(self, values):
+        rate = values.get('SIMULATION_RATE')
+        if rate is not None and rate > 0 and rate != self.rate:
+            # Bank the time that passed at the old rate first.
+            self.now()
+            self.rate = rate
+
+    def now(self):
+        mark = perf_counter()
+        self.time += (mark - self.mark) * self.rate
+        self.mark = mark
+        return self.time
+
+
+class SimTimeClock:
+    """
+    The sim's own clock (ABSOLUTE_TIME, in seconds), which stops while the
+    sim is paused. Between samples we extrapolate using SIMULATION_RATE,
+    but never let time go backwards when the next sample comes in, unless
+    the sim's clock itself jumped, in which case we start over from there.
+    """
+
+    VARIABLES = ['ABSOLUTE_TIME', 'SIMULATION_RATE']
+
+    def __init__(self):
+        self.rate = 1
+        self.time = None
+        self.mark = perf_counter()
+        self.last = 0
+        self.jumped = False
+
+    def update(self, values):
+        rate = values.get('SIMULATION_RATE')
+        if rate is not None and rate > 0:
+            self.rate = rate
+        time = values.get('ABSOLUTE_TIME')
+        if time is not None:
+            # Until now we've been running on real time, which has nothing to
+            # do with the sim's clock, so the first sample is a jump, too.
+            if self.time is None or not 0 <= time - self.time <= MAX_TIME_JUMP * self.rate:
+                self.jumped = True
+                self.last = time
+            self.time = time
+            self.mark = perf_counter()
+
+    def now(self):
+        if self.time is None:
+            # We haven't heard from the sim yet, so all we have is real time.
+            return perf_counter()
+        self.last = max(self.last, self.time + (perf_counter() - self.mark) * self.rate)
+        return self.last
+
+
+CLOCKS = {
+    'wall': WallClock,
+    'sim-rate': SimRateClock,
+    'sim-time': SimTimeClock,
+}
@@ -8,3 +8,5 @@ VERTICAL_SPEED_HOLD = 'VSH'
 ALTITUDE_HOLD = 'ALT'
 ACROBATIC = 'ACR'
 INVERTED_FLIGHT = 'INV'
+PID_CONTROL = 'PID'
+TERRAIN_FOLLOW = 'TER'
@@ -0,0 +1,133 @@
+from math import radians
+from simple_pid import PID
+from utils import constrain, constrain_map
+
+ROLL = 'roll'
+PITCH = 'pitch'
+
+SPEED_RANGE = (50, 200)
+WEIGHT_RANGE = (3000, 6500)
+TABLE_STEPS = 16
+
+
+class GainSchedule:
+    """
+    A precomputed (Kp, Ki, Kd) table over airspeed and aircraft weight.
+    Gains get computed once, for a grid of speeds and weights, and ticks
+    then only need a bilinear interpolation between the four nearest
+    table entries, rather than re-running every constrain_map.
+    """
+
+    def __init__(self, gains, speed_range=SPEED_RANGE, weight_range=WEIGHT_RANGE, steps=TABLE_STEPS):
+        self.speed_start, self.speed_end = speed_range
+        self.weight_start, self.weight_end = weight_range
+        self.steps = steps
+        self.speed_step = (self.speed_end - self.speed_start) / (steps - 1)
+        self.weight_step = (self.weight_end - self.weight_start) / (steps - 1)
+        self.table = [
+            [gains(self.speed_start + i * self.speed_step, self.weight_start + j * self.weight_step)
+             for j in range(steps)]
+            for i in range(steps)
+        ]
+
+    def get_index(self, value, start, step):
+        """
+        Find the table cell for this value, clamped to the table, as well
+        as how far into that cell we are.
+        """
+        position = constrain((value - start) / step, 0, self.steps - 1)
+        i = min(int(position), self.steps - 2)
+        return i, position - i
+
+    def lookup(self, speed, weight):
+        i, r = self.get_index(speed, self.speed_start, self.speed_step)
+        j, s = self.get_index(weight, self.weight_start, self.weight_step)
+        a, b = self.table[i][j], self.table[i][j + 1]
+        c, d = self.table[i + 1][j], self.table[i + 1][j + 1]
+        return tuple(
+            (1 - r) * ((1 - s) * a[k] + s * b[k]) + r * ((1 - s) * c[k] + s * d[k])
+            for k in range(3)
+        )
+
+
+def roll_gains(speed, weight):
+    """
+    bank error (in degrees) to aileron trim: faster planes need less
+    trim for the same roll rate, heavier planes need more.
+    """
+    factor = constrain_map(weight, 3000, 6500, 1, 1.5)
+    return (
+        factor * constrain_map(speed, 50, 200, 0.004, 0.002),
+        factor * constrain_map(speed, 50, 200, 0.0004, 0.0002),
+        0,
+    )
+
+
+def pitch_gains(speed, weight):
+    """
+    vertical speed error (in feet per minute) to elevator trim.
+    """
+    factor = constrain_map(weight, 3000, 6500, 1, 1.5)
+    return (
+        factor * constrain_map(speed, 50, 200, radians(0.0004), radians(0.0002)),
+        factor * constrain_map(speed, 50, 200, radians(0.0002), radians(0.0001)),
+        0,
+    )
+
+
+DEFAULT_SCHEDULES = {
+    ROLL: GainSchedule(roll_gains),
+    PITCH: GainSchedule(pitch_gains),
+}
+
+
+class ControllerBank:
+    """
+    A set of named PID controllers whose tunings are scheduled by airspeed
+    and weight. Outputs only get reported as changed if they moved by more
+    than the controller's deadband, so we don't write trim values to MSFS
+    that wouldn't make any difference anyway.
+
+    If a time_fn is given, the controllers use that, rather than real time,
+    to work out how much time passed between updates.
+    """
+
+    def __init__(self, schedules=DEFAULT_SCHEDULES, weight=WEIGHT_RANGE[0], time_fn=None):
+        self.schedules = schedules
+        self.weight = weight
+        self.controllers = {name: PID(sample_time=None) for name in schedules}
+        if time_fn is not None:
+            for pid in self.controllers.values():
+                pid.time_fn = time_fn
+        self.deadbands = {name: 0 for name in schedules}
+        self.outputs = {name: None for name in schedules}
+
+    def engage(self, name, output, limits=(None, None), deadband=0):
+        """
+        (Re)start a controller, picking up from the current control output
+        so that engaging it doesn't yank the controls.
+        """
+        pid = self.controllers[name]
+        pid.output_limits = limits
+        pid.set_auto_mode(False)
+        pid.set_auto_mode(True, last_output=output)
+        self.deadbands[name] = deadband
+        self.outputs[name] = output
+
+    def is_engaged(self, name):
+        return self.outputs[name] is not None
+
+    def update(self, name, setpoint, value, speed, dt=None):
+        """
+        Run a controller, returning its new output if that differs enough
+        from the last reported output to be worth sending, otherwise None.
+        """
+        pid = self.controllers[name]
+        pid.tunings = self.schedules[name].lookup(speed, self.weight)
+        pid.setpoint = setpoint
+        output = pid(value, dt)
+        last = self.outputs[name]
+        if last is not None and abs(output - last) < self.deadbands[name]:
+            return None
+        self.outputs[name] = output
+        return output
@@ -1,11 +1,145 @@
-from osgeo import gdal, osr
+import os
+import json
+import time
+import struct
+import numpy as np
 from os import listdir
-from os.path import isdir, isfile, join
+from os.path import abspath, basename, dirname, isdir, isfile, join
 from math import ceil, floor
+from threading import Lock, Thread, Event
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 
 SEA_LEVEL = 0
 ALOS_VOID_VALUE = -9999
 
+# Shared tiles start with a header: a "ready" flag, the grid's rows
+# and columns, and the tile's (forward) geotransform.
+TILE_HEADER = struct.Struct('<iii4x6d')
+TILE_READY = 1
+
+# Shared tile segments are named after their tile, with this prefix. On
+# Linux they show up as files in SHARED_MEMORY_FOLDER, so we can find
+# every one that got created, whether or not we know about its tile.
+SEGMENT_PREFIX = 'alos_'
+SHARED_MEMORY_FOLDER = '/dev/shm'
+
+# How long (in seconds) we wait for another process to finish publishing
+# a shared tile, before we assume it died halfway and load the tile ourselves.
+ATTACH_TIMEOUT = 10
+
+# Datasets converted by pack.py have an index with each tile's
+# grid file, grid size and geotransform.
+PACKED_INDEX = 'index.json'
+PACKED_DTYPE = '<i2'
+
+# The reduction factors of the overviews that pack.py makes for each
+# tile, used when we need a raster that's coarser than the tile itself.
+OVERVIEWS = [4, 16, 64]
+
+# Where we remember the last full index of a (GeoTIFF) tiles folder, so
+# that a restart doesn't have to wait on searching the whole folder again.
+INDEX_CACHE = join(dirname(abspath(__file__)), 'tile-index.json')
+
+# One dataset manager per tiles folder, so that everything running
+# in the same process shares the same tile index and tile cache.
+datasets = {}
+datasets_lock = Lock()
+
+
+def get_dataset(tiles_folder, background=False):
+    """
+    Get the (shared) dataset manager for a tiles folder, indexing
+    that folder the first time it gets asked for.
+    """
+    with datasets_lock:
+        if tiles_folder not in datasets:
+            datasets[tiles_folder] = ALOS30m(tiles_folder, background=background)
+        return datasets[tiles_folder]
+
+
+def get_tile_key(tile_name):
+    """
+    The short name for a tile, e.g. "N048W123" for ALPSMLC30_N048W123_DSM.tif
+    """
+    return tile_name.split('_')[1]
+
+
+def get_tile_name(tile_key):
+    return "ALPSMLC30_%s_DSM.tif" % tile_key
+
+
+def get_segment_name(tile_name):
+    """
+    The shared memory segment name for a tile, e.g. "alos_N048W123"
+    for tile ALPSMLC30_N048W123_DSM.tif.
+    """
+    return SEGMENT_PREFIX + get_tile_key(tile_name)
+
+
+def untrack(memory):
+    """
+    We manage the lifetime of our shared memory segments ourselves, so
+    make sure Python doesn't unlink them as soon as whichever process
+    created (or attached to) them exits.
+    """
+    if os.name == 'posix':
+        resource_tracker.unregister(memory._name, 'shared_memory')
+
+
+def get_shared_segments():
+    """
+    The names of all the shared tile segments that currently exist, as
+    far as we can tell: only Linux lets us list them.
+    """
+    if not isdir(SHARED_MEMORY_FOLDER):
+        return []
+    return [f for f in listdir(SHARED_MEMORY_FOLDER) if f.startswith(SEGMENT_PREFIX)]
+
+
+def release_shared_tiles(tile_names=()):
+    """
+    Free the shared memory for every shared tile segment we can find,
+    plus any of these tiles that got loaded, in case we can't list them.
+    This should only be called once all processes using them are done.
+    """
+    names = set(get_shared_segments())
+    names.update(get_segment_name(tile_name) for tile_name in tile_names)
+    for name in names:
+        try:
+            memory = SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        memory.close()
+        memory.unlink()
+
+
+def make_overview(grid, factor):
+    """
+    Reduce a grid by {factor} in each direction, keeping the highest
+    elevation in each block, so that an overview never hides a peak.
+    """
+    rows, cols = grid.shape
+    r, c = -(-rows // factor) * factor, -(-cols // factor) * factor
+    padded = np.pad(grid, ((0, r - rows), (0, c - cols)), mode='edge')
+    return padded.reshape(r // factor, factor, c // factor, factor).max(axis=(1, 3))
+
+
+def get_overview_path(tile_path, factor):
+    return tile_path[:-len('.bin')] + '.%d.bin' % factor
+
+
+def invert_geotransform(gt):
+    """
+    The same as gdal.InvGeoTransform, so that shared tiles can
+    do lookups without needing a GDAL dataset.
+    """
+    det = gt[1] * gt[5] - gt[2] * gt[4]
+    return (
+        (gt[2] * gt[3] - gt[0] * gt[5]) / det, gt[5] / det, -gt[2] / det,
+        (gt[0] * gt[4] - gt[1] * gt[3]) / det, -gt[4] / det, gt[1] / det,
+    )
+
 
 class ALOS30m():
     """
@@ -15,11 +149,47 @@ class ALOS30m():
     license: https://earth.jaxa.jp/en/data/policy/
     """
 
-    def __init__(self, tiles_folder):
+    def __init__(self, tiles_folder, files=None, shared=False, background=False):
+        """
+        If {files} is given, that list of tile paths is used instead of
+        searching the tiles folder. If {shared} is set, tiles are kept
+        in shared memory, so that every process using the same dataset
+        only needs one copy of each tile between them. If the tiles
+        folder has been packed with pack.py, tiles are memory mapped
+        instead, which the OS already shares between processes.
+
+        If {background} is set, the tiles folder gets searched on a
+        background thread, starting from the index we found last time.
+        If there is no such index, tiles get looked for on demand until
+        the search is done.
+        """
         self.tiles_folder = tiles_folder
+        self.shared = shared
         self.files = []
+        self.index = {}
+        self.packed = {}
         self.cache = {}
-        self.find_files()
+        self.resolved = {}
+        self.subfolders = None
+        self.on_demand = False
+        self.lock = Lock()
+        self.indexed = Event()
+        if isfile(join(tiles_folder, PACKED_INDEX)):
+            self.load_packed_index()
+        elif files is not None:
+            self.set_files(files)
+        elif background:
+            self.set_files(self.load_index_cache())
+            self.on_demand = len(self.files) == 0
+            Thread(target=self.build_index, daemon=True).start()
+            return
+        else:
+            self.set_files(self.find_files())
+        self.indexed.set()
+
+    def set_files(self, files):
+        self.files = list(files)
+        self.index = {basename(f): f for f in self.files}
 
     def find_files(self, dir=None):
         """
@@ -31,13 +201,98 @@ class ALOS30m():
         """
         if dir is None:
             dir = self.tiles_folder
+        files = []
         for f in listdir(dir):
             full_path = join(dir, f)
             if isfile(full_path):
                 if full_path.endswith(u'.tif'):
-                    self.files.append(full_path)
+                    files.append(full_path)
             if isdir(full_path):
-                self.find_files(full_path)
+                files.extend(self.find_files(full_path))
+        return files
+
+    def build_index(self):
+        """
+        Background indexing: search the tiles folder, then swap the result
+        in, and remember it for next time.
+        """
+        files = self.find_files()
+        self.set_files(files)
+        self.indexed.set()
+        self.on_demand = False
+        self.save_index_cache(files)
+
+    def load_index_cache(self):
+        if not isfile(INDEX_CACHE):
+            return []
+        try:
+            with open(INDEX_CACHE) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return cache['files'] if cache.get('folder') == self.tiles_folder else []
+
+    def save_index_cache(self, files):
+        path = '%s.%d.tmp' % (INDEX_CACHE, os.getpid())
+        try:
+            with open(path, 'w') as f:
+                json.dump({'folder': self.tiles_folder, 'files': files}, f)
+            os.replace(path, INDEX_CACHE)
+        except OSError:
+            pass
+
+    def resolve(self, tile_name):
+        """
+        Look for a tile that isn't in our index (yet) directly: either in the
+        tiles folder itself, or one folder down, which is how the ALOS
+        dataset is laid out. Only used until the full index is ready.
+        """
+        if tile_name in self.resolved:
+            return self.resolved[tile_name]
+        if self.subfolders is None:
+            folder = self.tiles_folder
+            self.subfolders = [folder] + [join(folder, d) for d in listdir(folder) if isdir(join(folder, d))]
+        full_path = next((join(d, tile_name) for d in self.subfolders if isfile(join(d, tile_name))), None)
+        self.resolved[tile_name] = full_path
+        return full_path
+
+    def load_packed_index(self):
+        """
+        Load the index that pack.py wrote, rather than searching
+        the tiles folder: packed tiles are looked up by the same
+        tile names as their original GeoTIFFs.
+        """
+        with open(join(self.tiles_folder, PACKED_INDEX)) as f:
+            tiles = json.load(f)['tiles']
+        for key, tile in tiles.items():
+            full_path = join(self.tiles_folder, tile['file'])
+            self.files.append(full_path)
+            self.index[get_tile_name(key)] = full_path
+            self.packed[full_path] = tile
+
+    def get_tile(self, lat, lng):
+        """
+        Find the tile that a coordinate is in, loading (and caching)
+        it if we haven't used it yet, or None if we have no such tile.
+        """
+        tile_name, tile_path = self.get_tile_for(lat, lng)
+
+        if tile_name is None:
+            return None
+
+        tile = self.cache.get(tile_path)
+        if tile is None:
+            with self.lock:
+                if tile_path not in self.cache:
+                    if tile_path in self.packed:
+                        tile = PackedTile(tile_path, **self.packed[tile_path])
+                    elif self.shared:
+                        tile = SharedTile(tile_path, get_segment_name(tile_name))
+                    else:
+                        tile = ALOSTile(tile_path)
+                    self.cache[tile_path] = tile
+                tile = self.cache[tile_path]
+        return tile
 
     def lookup(self, lat, lng):
         """
@@ -47,18 +302,52 @@ class ALOS30m():
         """
         lat = float(lat)
         lng = float(lng)
-        tile_name, tile_path = self.get_tile_for(lat, lng)
+        tile = self.get_tile(lat, lng)
 
-        if tile_name is None:
+        if tile is None:
             return None
 
-        if tile_path not in self.cache:
-            self.cache[tile_path] = ALOSTile(tile_path)
+        return tile.lookup(lat, lng)
+
+    def lookup_many(self, locations):
+        """
+        Find the elevations for a list of (lat, lng) coordinates,
+        with None for any coordinate that we have no data for.
+        """
+        return [self.lookup(lat, lng) for lat, lng in locations]
+
+    def get_grid(self, south, west, north, east, width, height):
+        """
+        Get a {height} x {width} raster of the elevations in a bounding box,
+        north row first, stitched together from every tile that it touches.
+        Each tile gets sampled from its coarsest overview that still has
+        (at least) the requested resolution. Anywhere we don't have data
+        for is ALOS_VOID_VALUE. This assumes north-up tiles, which all
+        ALOS tiles are.
+        """
+        grid = np.full((height, width), ALOS_VOID_VALUE, dtype=np.int16)
+        lats = north - (np.arange(height) + 0.5) * (north - south) / height
+        lngs = west + (np.arange(width) + 0.5) * (east - west) / width
+        spacing = min((north - south) / height, (east - west) / width)
+        tile_lats = np.floor(lats)
+        tile_lngs = np.floor(lngs)
 
-        v = self.cache[tile_path].lookup(lat, lng)
+        for tile_lat in np.unique(tile_lats):
+            rows = np.nonzero(tile_lats == tile_lat)[0]
+            for tile_lng in np.unique(tile_lngs):
+                tile = self.get_tile(tile_lat + 0.5, tile_lng + 0.5)
+                if tile is None:
+                    continue
+                cols = np.nonzero(tile_lngs == tile_lng)[0]
+                t = tile.reverse_transform
+                data, factor = tile.get_level(spacing * abs(t[5]))
+                y = np.floor((t[3] + t[5] * lats[rows]) / factor).astype(int)
+                x = np.floor((t[0] + t[1] * lngs[cols]) / factor).astype(int)
+                y = np.clip(y, 0, data.shape[0] - 1)
+                x = np.clip(x, 0, data.shape[1] - 1)
+                grid[np.ix_(rows, cols)] = data[np.ix_(y, x)]
 
-        # return a "real" int instead of an int16
-        return v
+        return grid
 
     def get_tile_for(self, lat, lng):
         """
@@ -73,17 +362,18 @@ class ALOS30m():
         lat = floor(lat) if lat_dir == "N" else ceil(-lat)
         lng = floor(lng) if lng_dir == "E" else ceil(-lng)
 
-        tile_name = "ALPSMLC30_%s%03d%s%03d_DSM.tif" % (
-            lat_dir, lat, lng_dir, lng)
+        tile_name = get_tile_name("%s%03d%s%03d" % (lat_dir, lat, lng_dir, lng))
 
-        # find the full path for this file in the list of
+        # find the full path for this file in the index of
         # known files we built in find_files().
-        full_path = [f for f in self.files if f.endswith(tile_name)]
+        full_path = self.index.get(tile_name)
+        if full_path is None and self.on_demand:
+            full_path = self.resolve(tile_name)
 
-        if len(full_path) == 0:
+        if full_path is None:
             return None, None
 
-        return tile_name, full_path[0]
+        return tile_name, full_path
 
 
 class ALOSTile():
@@ -93,6 +383,9 @@ class ALOSTile():
         small, so for performance we preload the entire tile's
         elevation data into RAM.
         """
+        # GDAL takes a while to import, so we only do so once we need it.
+        from osgeo import gdal, osr
+
         self.tile_path = tile_path
         self.dataset = gdal.Open(tile_path, gdal.GA_ReadOnly)
 
@@ -104,17 +397,123 @@ class ALOSTile():
         dest = osr.SpatialReference(self.dataset.GetProjection())
         self.ct = osr.CoordinateTransformation(src, dest)
         self.grid = self.dataset.GetRasterBand(1).ReadAsArray()
+        self.reverse_transform = gdal.InvGeoTransform(
+            self.dataset.GetGeoTransform())
+
+    def get_level(self, factor):
+        return self.grid, 1
 
     def lookup(self, lat, lon):
         """
         see https://gis.stackexchange.com/a/415337/219296
         """
         try:
-            forward_transform = self.dataset.GetGeoTransform()
-            reverse_transform = gdal.InvGeoTransform(forward_transform)
-            x, y = [int(v) for v in gdal.ApplyGeoTransform(
-                reverse_transform, lon, lat)]
+            t = self.reverse_transform
+            x = int(t[0] + t[1] * lon + t[2] * lat)
+            y = int(t[3] + t[4] * lon + t[5] * lat)
+            # return a "real" int instead of an int16
             return int(self.grid[y][x])
 
         except:
             return None
+
+
+class PackedTile():
+    overviews = []
+
+    def __init__(self, tile_path, file=None, rows=0, cols=0, transform=None, overviews=[]):
+        """
+        A tile that pack.py converted into a raw grid. Rather than loading
+        it, we memory map it, so only the parts we actually look at get
+        read in, and the OS shares those pages between processes.
+        """
+        self.tile_path = tile_path
+        self.grid = np.memmap(tile_path, dtype=PACKED_DTYPE, mode='r', shape=(rows, cols))
+        self.reverse_transform = invert_geotransform(transform)
+        self.overviews = overviews
+        self.levels = {}
+
+    def get_level(self, factor):
+        """
+        The coarsest version of this tile's grid, and its reduction factor,
+        that still has a sample at least every {factor} full grid pixels.
+        """
+        levels = [f for f in self.overviews if f <= factor]
+        if len(levels) == 0:
+            return self.grid, 1
+        f = max(levels)
+        if f not in self.levels:
+            rows, cols = self.grid.shape
+            shape = (-(-rows // f), -(-cols // f))
+            path = get_overview_path(self.tile_path, f)
+            self.levels[f] = np.memmap(path, dtype=PACKED_DTYPE, mode='r', shape=shape)
+        return self.levels[f], f
+
+    def lookup(self, lat, lon):
+        t = self.reverse_transform
+        x = int(t[0] + t[1] * lon + t[2] * lat)
+        y = int(t[3] + t[4] * lon + t[5] * lat)
+        rows, cols = self.grid.shape
+        if 0 <= x < cols and 0 <= y < rows:
+            # return a "real" int instead of an int16
+            return int(self.grid[y, x])
+        return None
+
+
+class SharedTile(PackedTile):
+    def __init__(self, tile_path, name):
+        """
+        A tile whose elevation grid lives in shared memory. The first
+        process that needs a tile loads it and publishes it, and every
+        other process simply attaches to that same copy.
+        """
+        self.tile_path = tile_path
+        try:
+            self.attach(name)
+        except FileNotFoundError:
+            tile = ALOSTile(tile_path)
+            size = TILE_HEADER.size + tile.grid.size * np.dtype(np.int16).itemsize
+            try:
+                self.memory = SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # Someone else loaded this tile at the same time we did.
+                return self.attach(name)
+            untrack(self.memory)
+            self.publish(tile)
+
+    def publish(self, tile):
+        """
+        Copy a loaded tile into our shared memory, or if it doesn't fit
+        (because someone else created the segment for a different grid),
+        just keep the tile's grid to ourselves.
+        """
+        grid = tile.grid
+        rows, cols = grid.shape
+        transform = tile.dataset.GetGeoTransform()
+        self.reverse_transform = invert_geotransform(transform)
+        if self.memory.size < TILE_HEADER.size + grid.size * np.dtype(np.int16).itemsize:
+            self.grid = grid
+            return
+        self.grid = np.ndarray((rows, cols), dtype=np.int16,
+                               buffer=self.memory.buf, offset=TILE_HEADER.size)
+        self.grid[:] = grid
+        # Only mark the tile as ready once all its data is in place.
+        TILE_HEADER.pack_into(self.memory.buf, 0, TILE_READY, rows, cols, *transform)
+
+    def attach(self, name):
+        self.memory = SharedMemory(name=name)
+        untrack(self.memory)
+        deadline = time.monotonic() + ATTACH_TIMEOUT
+        header = TILE_HEADER.unpack_from(self.memory.buf, 0)
+        while header[0] != TILE_READY:
+            if time.monotonic() > deadline:
+                # Whoever created the segment never finished filling it in,
+                # so take over: it's the same tile either way.
+                print(f'Gave up waiting for {name} to be loaded, loading it ourselves')
+                return self.publish(ALOSTile(self.tile_path))
+            time.sleep(0.01)
+            header = TILE_HEADER.unpack_from(self.memory.buf, 0)
+        ready, rows, cols, *transform = header
+        self.grid = np.ndarray((rows, cols), dtype=np.int16,
+                               buffer=self.memory.buf, offset=TILE_HEADER.size)
+        self.reverse_transform = invert_geotransform(transform)
@@ -0,0 +1,150 @@
+"""
+Convert the ALOS GeoTIFF tiles into raw int16 grids, plus an index with
+each tile's grid size and geotransform, so that the elevation server can
+memory map tiles instead of decoding them with GDAL. Each tile also gets
+a set of reduced overviews, for serving coarse rasters. Tiles are converted
+in parallel, and tiles that were already converted get skipped, so an
+interrupted run can simply be started again.
+
+usage: python pack.py [--source folder] [--target folder] [--workers N]
+       python pack.py --synthetic N --source folder  (make N small test tiles)
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from os import makedirs
+from os.path import basename, isfile, join
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from osgeo import gdal, osr
+from alos import (ALOS30m, ALOSTile, PACKED_INDEX, PACKED_DTYPE, OVERVIEWS,
+                  get_tile_key, get_tile_name, get_overview_path, make_overview)
+from server import DATA_FOLDER
+
+PACKED_FOLDER = join(DATA_FOLDER, '..', 'packed')
+
+# How often to report progress, in seconds.
+REPORT_INTERVAL = 5
+
+
+def pack_tile(tile_path, target):
+    """
+    Convert a single tile, returning its index entry and how many bytes
+    we wrote, which is zero if this tile had already been converted.
+    Every file is written under a temporary name first, and the tile's
+    metadata is written last, so a tile only counts as converted once
+    all of its data is on disk.
+    """
+    key = get_tile_key(basename(tile_path))
+    meta_path = join(target, key + '.json')
+    if isfile(meta_path):
+        with open(meta_path) as f:
+            entry = json.load(f)
+        # Tiles packed before we had (these) overviews need repacking.
+        if entry.get('overviews') == OVERVIEWS:
+            return key, entry, 0
+
+    tile = ALOSTile(tile_path)
+    grid = tile.grid.astype(PACKED_DTYPE)
+    rows, cols = grid.shape
+    entry = {
+        'file': key + '.bin',
+        'rows': rows,
+        'cols': cols,
+        'transform': list(tile.dataset.GetGeoTransform()),
+        'overviews': OVERVIEWS,
+    }
+
+    data_path = join(target, entry['file'])
+    grid.tofile(data_path + '.tmp')
+    os.replace(data_path + '.tmp', data_path)
+    size = grid.nbytes
+    for factor in OVERVIEWS:
+        overview = make_overview(grid, factor)
+        overview_path = get_overview_path(data_path, factor)
+        overview.tofile(overview_path + '.tmp')
+        os.replace(overview_path + '.tmp', overview_path)
+        size += overview.nbytes
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(entry, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return key, entry, size
+
+
+def write_index(target, tiles):
+    path = join(target, PACKED_INDEX)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'tiles': tiles}, f)
+    os.replace(path + '.tmp', path)
+
+
+def pack(source, target, workers=None):
+    mark = time.time()
+    files = ALOS30m(source).files
+    print("Found %d tiles in %.2fs" % (len(files), time.time() - mark))
+    makedirs(target, exist_ok=True)
+
+    tiles = {}
+    written = 0
+    skipped = 0
+    mark = report = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = [executor.submit(pack_tile, f, target) for f in files]
+        for job in as_completed(jobs):
+            key, entry, size = job.result()
+            tiles[key] = entry
+            written += size
+            skipped += size == 0
+            if time.time() - report > REPORT_INTERVAL:
+                report = time.time()
+                elapsed = report - mark
+                print("%d/%d tiles (%d already packed), %.1f tiles/s, %.1f MB/s" % (
+                    len(tiles), len(files), skipped, (len(tiles) - skipped) / elapsed,
+                    written / elapsed / 1e6))
+
+    write_index(target, tiles)
+    elapsed = time.time() - mark
+    print("Packed %d tiles (%d already packed) in %.1fs: %.1f tiles/s, %.1f MB/s" % (
+        len(tiles), skipped, elapsed, (len(tiles) - skipped) / elapsed,
+        written / elapsed / 1e6))
+
+
+def write_synthetic_tiles(folder, count, size=360):
+    """
+    Write {count} small GeoTIFF tiles, named and georeferenced the same way
+    as ALOS tiles, with a simple elevation pattern, for testing.
+    """
+    makedirs(folder, exist_ok=True)
+    driver = gdal.GetDriverByName('GTiff')
+    srs = osr.SpatialReference()
+    srs.SetWellKnownGeogCS('WGS84')
+    y, x = np.mgrid[0:size, 0:size]
+    for i in range(count):
+        lat, lng = 40 + i // 10, -120 + i % 10
+        name = get_tile_name("N%03dW%03d" % (lat, -lng))
+        dataset = driver.Create(join(folder, name), size, size, 1, gdal.GDT_Int16)
+        dataset.SetGeoTransform((lng, 1 / size, 0, lat + 1, 0, -1 / size))
+        dataset.SetProjection(srs.ExportToWkt())
+        dataset.GetRasterBand(1).WriteArray((x + y + i * 100).astype(np.int16))
+        dataset.FlushCache()
+        dataset = None
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Pack ALOS GeoTIFF tiles into memory mappable grids.')
+    parser.add_argument('--source', default=DATA_FOLDER)
+    parser.add_argument('--target', default=PACKED_FOLDER)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='write this many synthetic test tiles to the source folder first')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        write_synthetic_tiles(args.source, args.synthetic)
+    pack(args.source, args.target, args.workers)
+
+
+if __name__ == "__main__":
+    run()
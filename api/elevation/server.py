@@ -1,30 +1,56 @@
 import os
+import gzip
 import json
 import time
+import signal
+import socket
+import argparse
+from threading import Thread
+from multiprocessing import Process
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import parse_qs, urlparse
-from alos import ALOS30m
+from alos import ALOS30m, ALOS_VOID_VALUE, get_dataset, release_shared_tiles
 
 HOST = '127.0.0.1'
 PORT = 9000
 DATA_FOLDER = '\\\\192.168.1.5\\Storage\\General\\Games\\MSFS\\ALOS World 3D (30m)\\data'
 
-# make sure we know what data we have available
-mark = time.time()
-print("Indexing dataset...")
-interface = ALOS30m(DATA_FOLDER)
-print("Dataset indexed in %.2fs (%d tiles found)" %
-      (time.time() - mark, len(interface.files),))
+# The largest raster, in either direction, that /grid will make.
+MAX_GRID_SIZE = 2048
+
+interface = None
+
+
+def index_dataset():
+    """
+    Start finding out what data we have available. This happens in the
+    background, so we can start serving right away: until the index is
+    ready, tiles get looked up on demand.
+    """
+    global interface
+    mark = time.time()
+    print("Indexing dataset...")
+    interface = get_dataset(DATA_FOLDER, background=True)
+
+    def report():
+        interface.indexed.wait()
+        print("Dataset indexed in %.2fs (%d tiles found)" %
+              (time.time() - mark, len(interface.files),))
+
+    Thread(target=report, daemon=True).start()
 
 
 class OpenElevationServer(BaseHTTPRequestHandler):
-    def set_headers(self):
-        self.send_response(200)
+    def set_headers(self, status=200, content_type='application/json', headers={}):
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Headers','*')
         self.send_header('Access-Control-Allow-Methods','*')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', '*')
         self.send_header('Cache-Control', 'no-cache')
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', content_type)
+        for key, value in headers.items():
+            self.send_header(key, value)
         self.end_headers()
 
     def log_request(self, code='-', size='-'):
@@ -39,21 +65,25 @@ class OpenElevationServer(BaseHTTPRequestHandler):
         if self.path == '/favicon.ico':
             return self.send_response(404)
 
-        query = parse_qs(urlparse(self.path).query)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/grid':
+            return self.send_grid(query)
+
         if 'locations' not in query:
-            self.set_headers()
-            return self.send_response(400)
+            return self.set_headers(400)
 
         locations = [l.split(',') for l in query['locations'][0].split('|')]
 
         # mark = time.time()
+        elevations = interface.lookup_many(locations)
         data = {
             'results': [
                 {
                     'latitude': lat,
                     'longitude': lng,
-                    'elevation': interface.lookup(lat, lng)
-                } for lat, lng in locations
+                    'elevation': elevation
+                } for (lat, lng), elevation in zip(locations, elevations)
             ]
         }
         response = json.dumps(data).encode('utf-8')
@@ -61,12 +91,102 @@ class OpenElevationServer(BaseHTTPRequestHandler):
         self.set_headers()
         self.wfile.write(response)
 
+    def send_grid(self, query):
+        """
+        /grid?bbox=south,west,north,east&width=W&height=H
+
+        Sends a W x H raster of the elevations (in meters) in a bounding
+        box as little-endian int16 values, north row first, with
+        {ALOS_VOID_VALUE} wherever there is no data. The raster's size and
+        bounds are echoed in the X-Grid-Size and X-Grid-Bounds headers.
+        """
+        try:
+            south, west, north, east = [float(v) for v in query['bbox'][0].split(',')]
+            width = int(query.get('width', ['256'])[0])
+            height = int(query.get('height', ['256'])[0])
+        except (KeyError, ValueError):
+            return self.set_headers(400)
+        if south >= north or west >= east:
+            return self.set_headers(400)
+        if not (0 < width <= MAX_GRID_SIZE and 0 < height <= MAX_GRID_SIZE):
+            return self.set_headers(400)
+
+        grid = interface.get_grid(south, west, north, east, width, height)
+        response = grid.astype('<i2').tobytes()
+        headers = {
+            'X-Grid-Size': f'{width},{height}',
+            'X-Grid-Bounds': f'{south},{west},{north},{east}',
+            'X-Grid-Void': str(ALOS_VOID_VALUE),
+        }
+        # Terrain compresses really well, so if the client can handle it, compress.
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            response = gzip.compress(response, 6)
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(response))
+        self.set_headers(200, 'application/octet-stream', headers)
+        self.wfile.write(response)
+
+
+def serve(listener, files):
+    """
+    Worker process entry point: serve requests off of the shared listening
+    socket, with tiles kept in shared memory so that all workers use the
+    same copy of every tile.
+    """
+    global interface
+    interface = ALOS30m(DATA_FOLDER, files=files, shared=True, background=files is None)
+    webServer = HTTPServer((HOST, PORT), OpenElevationServer, bind_and_activate=False)
+    webServer.socket = listener
+    try:
+        webServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(count):
+    listener = socket.create_server((HOST, PORT))
+    # If we don't have a full index yet, every worker builds its own.
+    files = interface.files if interface.indexed.is_set() else None
+    workers = [Process(target=serve, args=(listener, files), daemon=True)
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    print(f'Elevation server started on http://{HOST}:{PORT} ({count} workers)')
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Don't let another ctrl-c stop us from cleaning up.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        # Our own index may not be done yet, or be out of date, so this
+        # also releases whatever else the workers loaded.
+        release_shared_tiles(interface.index.keys())
+        listener.close()
+        print('Server stopped')
+        os._exit(1)
+
 
 def run():
+    parser = argparse.ArgumentParser(description='Serve elevation data from the ALOS dataset.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of server processes, sharing one tile cache')
+    args = parser.parse_args()
+
+    print('API: /?locations=lat,long|lat,long|... (one pair required, subsequent pairs optional)')
+    print('     /grid?bbox=south,west,north,east&width=W&height=H (int16 raster)')
+
+    if args.workers > 1:
+        index_dataset()
+        return run_workers(args.workers)
+
     try:
+        # Bind first, so clients can connect while we index.
         webServer = HTTPServer((HOST, PORT), OpenElevationServer)
+        index_dataset()
         print(f'Elevation server started on http://{HOST}:{PORT}')
-        print('API: /?locations=lat,long|lat,long|... (one pair required, subsequent pairs optional)')
         webServer.serve_forever()
     except KeyboardInterrupt:
         webServer.server_close()
@@ -0,0 +1,90 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+FLOAT64 = 'application/x-float64'
+
+# Other names that clients use for the same encodings.
+ALIASES = {
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+}
+
+
+def get_encodings():
+    """
+    The encodings we can produce for structured data, in order of preference
+    when a client accepts any of them equally.
+    """
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def negotiate(accept, offered):
+    """
+    Pick the best of the {offered} content types for an Accept header,
+    falling back to JSON if the client doesn't accept anything we offer.
+    """
+    best, best_q = None, 0
+    for part in (accept or '').split(','):
+        media, *params = [p.strip() for p in part.split(';')]
+        media = ALIASES.get(media.lower(), media.lower())
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0
+        if media in ['*/*', 'application/*']:
+            candidates = offered[:1]
+        else:
+            candidates = [media] if media in offered else []
+        for candidate in candidates:
+            if q > best_q:
+                best, best_q = candidate, q
+    return best or JSON
+
+
+def pack_float64(values):
+    """
+    Little-endian float64s, in order. Anything that isn't a number
+    (including values we couldn't get) is sent as NaN.
+    """
+    numbers = [float(v) if isinstance(v, (int, float)) else float('nan') for v in values]
+    return struct.pack(f'<{len(numbers)}d', *numbers)
+
+
+def encode(data, content_type):
+    if content_type == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    if content_type == FLOAT64:
+        return pack_float64(data)
+    return json.dumps(data).encode('utf-8')
+
+
+class EncodedCache:
+    """
+    Remembers the last thing we encoded in each content type, so that
+    data which hasn't changed since the last request (like the autopilot
+    parameters, which clients poll constantly) doesn't get encoded again.
+    If the data comes with a version {key}, we compare that instead of
+    the data itself.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def encode(self, data, content_type, key=None):
+        check = data if key is None else key
+        entry = self.entries.get(content_type)
+        if entry is not None and entry[0] == check:
+            return entry[1]
+        encoded = encode(data, content_type)
+        self.entries[content_type] = (check, encoded)
+        return encoded
@@ -0,0 +1,97 @@
+import copy
+from math import pi
+
+# The State fields we filter, and the delta field that holds their rate of change.
+FILTERED_FIELDS = {
+    'altitude': None,
+    'speed': 'dV',
+    'heading': 'dHeading',
+    'bank_angle': 'dBank',
+    'turn_rate': 'dTurn',
+    'vertical_speed': 'dVS',
+}
+
+# Fields that are angles, and so need their residuals wrapped to [-pi, pi].
+ANGLE_FIELDS = ['heading']
+
+
+def wrap(angle):
+    return (angle + pi) % (2 * pi) - pi
+
+
+class AlphaBetaEstimator:
+    """
+    A per-field alpha-beta filter (the steady-state form of a constant
+    velocity Kalman filter) that sits between the sim reads and the control
+    laws. Each sample updates an estimate of every filtered field and its
+    rate of change, which replace the raw values and raw one-step deltas in
+    the State that the control laws get to see. Between samples, the
+    estimate can be extrapolated, so the control laws can run more often
+    than we poll MSFS.
+
+    alpha: how much of each residual goes into the value estimate.
+    beta: how much of each residual goes into the rate estimate.
+    poll_interval: how long (in seconds) we can go on predictions alone,
+        before we need a fresh sample from the sim.
+    """
+
+    def __init__(self, alpha=0.8, beta=0.5, poll_interval=0):
+        self.alpha = alpha
+        self.beta = beta
+        self.poll_interval = poll_interval
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.values = {}
+        self.rates = {}
+
+    def needs_sample(self, call_time):
+        return self.state is None or call_time - self.state.call_time >= self.poll_interval
+
+    def update(self, state):
+        """
+        Fold a freshly sampled State into our estimate, and return
+        the filtered version of that State.
+        """
+        prev = self.state
+        dt = state.call_time - prev.call_time if prev is not None else 0
+        estimate = copy.copy(state)
+
+        for field, delta in FILTERED_FIELDS.items():
+            if not state.has(field):
+                continue
+            measured = getattr(state, field)
+            if field not in self.values or dt <= 0:
+                self.values[field] = measured
+                self.rates[field] = getattr(state, delta) if delta else 0
+            else:
+                predicted = self.values[field] + self.rates[field] * dt
+                residual = measured - predicted
+                if field in ANGLE_FIELDS:
+                    residual = wrap(residual)
+                self.values[field] = predicted + self.alpha * residual
+                self.rates[field] += self.beta * residual / dt
+                if field in ANGLE_FIELDS:
+                    self.values[field] %= 2 * pi
+            setattr(estimate, field, self.values[field])
+            if delta:
+                setattr(estimate, delta, self.rates[field])
+
+        self.state = estimate
+        return estimate
+
+    def predict(self, call_time):
+        """
+        Our best guess at what the State is at {call_time}, based on
+        the last estimate and how fast everything was changing.
+        """
+        dt = call_time - self.state.call_time
+        prediction = copy.copy(self.state)
+        prediction.call_time = call_time
+        for field in self.values:
+            value = self.values[field] + self.rates[field] * dt
+            if field in ANGLE_FIELDS:
+                value %= 2 * pi
+            setattr(prediction, field, value)
+        return prediction
@@ -0,0 +1,268 @@
+"""
+Flight plan import/export for GPX, MSFS .PLN and GeoJSON routes.
+
+All parsers are generators that read their input in chunks and yield
+(lat, long, alt) tuples as they go, so even very long tracks never need
+to be loaded (or turned into a document tree) in their entirety. Altitudes
+are always in feet, and are None if the source didn't specify one.
+"""
+
+import re
+import json
+import codecs
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import quoteattr
+
+GPX = 'gpx'
+PLN = 'pln'
+GEOJSON = 'geojson'
+FORMATS = [GPX, PLN, GEOJSON]
+
+CONTENT_TYPES = {
+    GPX: 'application/gpx+xml',
+    PLN: 'application/xml',
+    GEOJSON: 'application/geo+json',
+}
+
+FEET_PER_METER = 3.28084
+CHUNK_SIZE = 64 * 1024
+
+PLN_POSITION = re.compile(
+    r'([NS])(\d+)°\s*(\d+)\'\s*([\d.]+)"\s*,\s*([EW])(\d+)°\s*(\d+)\'\s*([\d.]+)"\s*(?:,\s*([+-]?[\d.]+))?')
+
+NUMBER = r'\s*(-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)\s*'
+# Positions may have more values after the altitude (e.g. a timestamp), which we ignore.
+EXTRA_NUMBER = r'\s*-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?\s*'
+GEOJSON_COORDINATES = re.compile(r'"coordinates"\s*:\s*(?=\[)')
+GEOJSON_TOKEN = re.compile(
+    r'\[' + NUMBER + ',' + NUMBER + '(?:,' + NUMBER + ')?(?:,' + EXTRA_NUMBER + r')*\]|\[|\]')
+
+# How much unprocessed text we need to have buffered before we trust a
+# regex match not to have been cut off at the end of the current chunk.
+LOOKAHEAD = 256
+
+
+def get_format(name):
+    """
+    Determine the flight plan format based on a file name or format string.
+    """
+    if name is None:
+        return None
+    name = name.lower()
+    for format in FORMATS:
+        if name == format or name.endswith(f'.{format}'):
+            return format
+    if name == 'json' or name.endswith('.json'):
+        return GEOJSON
+    return None
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _iterparse(stream):
+    """
+    Yield every element, and its parent, once it has been fully read.
+    Parsers remove the elements they're done with from their parent,
+    because clearing them still leaves them in their parent's list of
+    children, which for long tracks would grow without end.
+    """
+    parents = []
+    for event, element in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+        else:
+            parents.pop()
+            yield element, parents[-1] if parents else None
+
+
+def _discard(element, parent):
+    element.clear()
+    if parent is not None:
+        parent.remove(element)
+
+
+def parse_gpx(stream):
+    """
+    Yield the route points, track points and waypoints from a GPX
+    document, in document order.
+    """
+    for element, parent in _iterparse(stream):
+        name = _local_name(element.tag)
+        if name in ('rtept', 'trkpt', 'wpt'):
+            alt = None
+            for child in element:
+                if _local_name(child.tag) == 'ele' and child.text:
+                    alt = float(child.text) * FEET_PER_METER
+            yield float(element.get('lat')), float(element.get('lon')), alt
+            _discard(element, parent)
+        elif name in ('rte', 'trkseg', 'trk'):
+            _discard(element, parent)
+
+
+def _dms(hemisphere, d, m, s):
+    value = float(d) + float(m) / 60 + float(s) / 3600
+    return -value if hemisphere in ('S', 'W') else value
+
+
+def parse_world_position(text):
+    """
+    MSFS flight plans encode positions as N47° 25' 54.12",W122° 18' 30.78",+000433.00
+    """
+    match = PLN_POSITION.search(text)
+    if match is None:
+        return None
+    lat_dir, lat_d, lat_m, lat_s, long_dir, long_d, long_m, long_s, alt = match.groups()
+    lat = _dms(lat_dir, lat_d, lat_m, lat_s)
+    long = _dms(long_dir, long_d, long_m, long_s)
+    return lat, long, float(alt) if alt is not None else None
+
+
+def parse_pln(stream):
+    """
+    Yield the ATC waypoints from an MSFS .PLN flight plan.
+    """
+    for element, parent in _iterparse(stream):
+        if element.tag == 'ATCWaypoint':
+            position = element.find('WorldPosition')
+            if position is not None and position.text:
+                point = parse_world_position(position.text)
+                if point is not None:
+                    yield point
+            _discard(element, parent)
+
+
+def parse_geojson(stream):
+    """
+    Yield every position found in any "coordinates" value in a GeoJSON
+    document, so this works for Point features as well as (multi)line
+    strings. Rather than decoding the document as a whole, we scan for
+    coordinate arrays chunk by chunk and track our bracket depth.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    inside = False
+    depth = 0
+    done = False
+
+    while not done:
+        chunk = stream.read(CHUNK_SIZE)
+        done = len(chunk) == 0
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk, final=done)
+        buffer += chunk
+        pos = 0
+
+        while True:
+            if not inside:
+                match = GEOJSON_COORDINATES.search(buffer, pos)
+                if match is None:
+                    pos = max(pos, len(buffer) - LOOKAHEAD)
+                    break
+                if not done and len(buffer) - match.end() < LOOKAHEAD:
+                    pos = match.start()
+                    break
+                inside = True
+                pos = match.end()
+                continue
+
+            match = GEOJSON_TOKEN.search(buffer, pos)
+            if match is None or (not done and len(buffer) - match.end() < LOOKAHEAD):
+                break
+            pos = match.end()
+            token = match.group(0)
+            if token == '[':
+                depth += 1
+            elif token == ']':
+                depth -= 1
+            else:
+                long, lat, alt = match.groups()
+                yield float(lat), float(long), float(alt) * FEET_PER_METER if alt is not None else None
+            inside = depth > 0
+
+        # Keep only what we haven't processed yet.
+        buffer = buffer[pos:]
+
+
+PARSERS = {
+    GPX: parse_gpx,
+    PLN: parse_pln,
+    GEOJSON: parse_geojson,
+}
+
+
+def parse(stream, format):
+    return PARSERS[format](stream)
+
+
+def _feet_to_meters(alt):
+    return alt / FEET_PER_METER
+
+
+def write_gpx(waypoints, out):
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<gpx version="1.1" creator="are-we-flying" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    out.write('<rte>\n')
+    for w in waypoints:
+        out.write(f'<rtept lat={quoteattr(str(w.lat))} lon={quoteattr(str(w.long))}>')
+        if w.alt is not None:
+            out.write(f'<ele>{_feet_to_meters(float(w.alt))}</ele>')
+        out.write('</rtept>\n')
+    out.write('</rte>\n</gpx>\n')
+
+
+def _to_dms(value, positive, negative):
+    hemisphere = positive if value >= 0 else negative
+    # Round to the hundredths of a second that we write first, so that
+    # rounding up carries into the minutes (and degrees), rather than
+    # giving us 60.00 seconds.
+    hundredths = round(abs(value) * 360000)
+    d, hundredths = divmod(hundredths, 360000)
+    m, hundredths = divmod(hundredths, 6000)
+    return f'{hemisphere}{d}° {m}\' {hundredths / 100:.2f}"'
+
+
+def get_world_position(lat, long, alt=None):
+    lat = _to_dms(float(lat), 'N', 'S')
+    long = _to_dms(float(long), 'E', 'W')
+    alt = float(alt) if alt is not None else 0
+    return f'{lat},{long},{alt:+010.2f}'
+
+
+def write_pln(waypoints, out):
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<SimBase.Document Type="AceXML" version="1,0">\n')
+    out.write('<Descr>AceXML Document</Descr>\n')
+    out.write('<FlightPlan.FlightPlan>\n')
+    out.write('<Title>are-we-flying route</Title>\n')
+    out.write('<FPType>VFR</FPType>\n')
+    out.write('<RouteType>Direct</RouteType>\n')
+    for i, w in enumerate(waypoints):
+        out.write(f'<ATCWaypoint id="WP{i + 1}">\n')
+        out.write('<ATCWaypointType>User</ATCWaypointType>\n')
+        out.write(f'<WorldPosition>{get_world_position(w.lat, w.long, w.alt)}</WorldPosition>\n')
+        out.write('</ATCWaypoint>\n')
+    out.write('</FlightPlan.FlightPlan>\n')
+    out.write('</SimBase.Document>\n')
+
+
+def write_geojson(waypoints, out):
+    out.write('{"type":"Feature","properties":{},"geometry":{"type":"LineString","coordinates":[')
+    for i, w in enumerate(waypoints):
+        position = [float(w.long), float(w.lat)]
+        if w.alt is not None:
+            position.append(_feet_to_meters(float(w.alt)))
+        out.write(('' if i == 0 else ',') + json.dumps(position))
+    out.write(']}}\n')
+
+
+WRITERS = {
+    GPX: write_gpx,
+    PLN: write_pln,
+    GEOJSON: write_geojson,
+}
+
+
+def write(waypoints, out, format):
+    WRITERS[format](waypoints, out)
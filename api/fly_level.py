@@ -1,6 +1,13 @@
 from math import degrees, radians, copysign, pi, sqrt, cos, sin, atan2
 from utils import constrain, constrain_map, get_compass_diff
-from constants import HEADING_MODE, ACROBATIC
+from constants import HEADING_MODE, ACROBATIC, PID_CONTROL
+from controllers import ROLL
+from parameters import DEFAULT_PARAMETERS
+from logs import log
+
+# The State fields that fly_level (in any of its variants) looks at.
+FIELDS = ['speed', 'latitude', 'longitude', 'heading', 'true_heading',
+          'bank_angle', 'turn_rate', 'aileron_trim']
 
 # TODO: we need to speed up more, and slow down faster for the 310R, this heading mode is pretty slow...
 
@@ -16,37 +23,51 @@ def get_heading_from_to(lat1, lon1, lat2, lon2):
     return degrees(atan2(y, x))
 
 
+def get_max_bank(speed, parameters=DEFAULT_PARAMETERS):
+    return constrain_map(speed, 50, 200, parameters['max_bank_min'], parameters['max_bank_max'])
+
+
+def follow_waypoint(auto_pilot, state):
+    """
+    If we have waypoints, set our heading target to the next one.
+    """
+    waypoint = auto_pilot.waypoints.next()
+    if waypoint is not None:
+        lat = state.latitude
+        long = state.longitude
+        log('follow_waypoint', 'flying waypoint: {lat},{long}', lat=lat, long=long)
+        lat2 = waypoint.lat
+        long2 = waypoint.long
+        heading = get_heading_from_to(lat, long, lat2, long2)
+        heading = (heading - degrees(state.true_heading -
+                    state.heading) + 360) % 360
+        auto_pilot.steer(heading)
+
+
 def fly_level(auto_pilot, state):
     if auto_pilot.modes[ACROBATIC]:
         return fly_acrobatic(auto_pilot, state)
 
+    if auto_pilot.modes[PID_CONTROL]:
+        return fly_level_pid(auto_pilot, state)
+
     anchor = auto_pilot.anchor
+    parameters = auto_pilot.parameters
 
     bank = degrees(state.bank_angle)
-    max_bank = constrain_map(state.speed, 50, 200, 10, 30)
+    max_bank = get_max_bank(state.speed, parameters)
 
     dBank = state.dBank
     max_dBank = radians(1)
 
-    step = constrain_map(state.speed, 50, 150, radians(1), radians(2))
+    step = constrain_map(state.speed, 50, 150, radians(
+        parameters['step_min']), radians(parameters['step_max']))
     target_bank = 0
 
     turn_rate = degrees(state.turn_rate)
-    max_turn_rate = 3
+    max_turn_rate = parameters['max_turn_rate']
 
     # Are we supposed to fly a specific compass heading?
-    if len(auto_pilot.waypoints) > 0:
-        waypoint = auto_pilot.waypoints[0]
-        lat = state.latitude
-        long = state.longitude
-        print(f"flying waypoint: {lat},{long}")
-        lat2 = waypoint.lat
-        long2 = waypoint.long
-        heading = get_heading_from_to(lat, long, lat2, long2)
-        heading = (heading - degrees(state.true_heading -
-                    state.heading) + 360) % 360
-        auto_pilot.set_target(HEADING_MODE, heading)
-
     flight_heading = auto_pilot.modes[HEADING_MODE]
     if flight_heading:
         heading = degrees(state.heading)
@@ -76,6 +97,32 @@ def fly_level(auto_pilot, state):
     auto_pilot.api.set('AILERON_TRIM_PCT', anchor.x)
 
 
+def fly_level_pid(auto_pilot, state):
+    """
+    Rather than nudging the trim anchor, run a gain-scheduled PID
+    controller that turns bank error into aileron trim.
+    """
+    controllers = auto_pilot.controllers
+    if not controllers.is_engaged(ROLL):
+        auto_pilot.engage_controllers()
+
+    bank = degrees(state.bank_angle)
+    max_bank = get_max_bank(state.speed, auto_pilot.parameters)
+    target_bank = 0
+
+    flight_heading = auto_pilot.modes[HEADING_MODE]
+    if flight_heading:
+        h_diff = get_compass_diff(degrees(state.heading), flight_heading)
+        target_bank = constrain_map(h_diff, -30, 30, max_bank, -max_bank)
+
+    # Positive aileron trim banks us right, which MSFS reports as
+    # a negative bank angle, so our trim is the inverse of the output.
+    output = controllers.update(ROLL, target_bank, bank, state.speed)
+    if output is not None:
+        auto_pilot.anchor.x = -output
+        auto_pilot.api.set('AILERON_TRIM_PCT', auto_pilot.anchor.x)
+
+
 def fly_acrobatic(auto_pilot, state):
     """
     Acrobatic flight is much snappier, but only really works if you're going fast enough.
@@ -0,0 +1,269 @@
+"""
+Load test the autopilot HTTP API: run the API server in its own process,
+wired to the stand-in sim with the autopilot flying, and throw N simulated
+browser clients at it, replaying the same request mix that the website
+generates. Reports throughput and latency percentiles per request type,
+and how much the load disturbs the autopilot's tick timing.
+
+usage: python loadtest.py [--clients N ...] [--duration S] [--baseline S] [--workers N]
+"""
+
+import os
+import time
+import random
+import argparse
+from http.client import HTTPConnection
+from threading import Thread
+from contextlib import redirect_stdout
+from multiprocessing import Process, Event, Queue
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import server
+from autopilot import AutoPilot
+from stand_in import StandInSimConnection
+from constants import LEVEL_FLIGHT, HEADING_MODE, VERTICAL_SPEED_HOLD, ALTITUDE_HOLD
+
+PORT = 8181
+
+# The values that the website's event monitor polls, and how often (in seconds).
+FLIGHT_PROPS = [
+    'AILERON_TRIM_PCT', 'AIRSPEED_TRUE', 'AUTOPILOT_MASTER', 'ELEVATOR_TRIM_POSITION',
+    'GPS_GROUND_TRUE_TRACK', 'GROUND_ALTITUDE', 'INDICATED_ALTITUDE', 'PLANE_ALT_ABOVE_GROUND',
+    'PLANE_BANK_DEGREES', 'PLANE_HEADING_DEGREES_MAGNETIC', 'PLANE_HEADING_DEGREES_TRUE',
+    'PLANE_LATITUDE', 'PLANE_LONGITUDE', 'PLANE_PITCH_DEGREES', 'SIM_ON_GROUND',
+    'TURN_INDICATOR_RATE', 'VERTICAL_SPEED',
+]
+SIM_PROPS = ['CAMERA_STATE', 'CRASH_FLAG', 'CRASH_SEQUENCE']
+ENGINE_PROPS = ['ENGINE_TYPE', 'ENG_COMBUSTION:1', 'ENG_COMBUSTION:2', 'ENG_COMBUSTION:3', 'ENG_COMBUSTION:4']
+MODEL_PROPS = ['TITLE', 'STATIC_CG_TO_GROUND']
+
+POLLS = [
+    ('flight values', 1, '/api/?get=' + ','.join(FLIGHT_PROPS)),
+    ('sim values', 1, '/api/?get=' + ','.join(SIM_PROPS)),
+    ('engine values', 2, '/api/?get=' + ','.join(ENGINE_PROPS)),
+    ('model values', 5, '/api/?get=' + ','.join(MODEL_PROPS)),
+    ('autopilot state', 1, '/autopilot'),
+]
+
+# How often (on average, in seconds) each client does something, like
+# changing the heading or altitude, or placing or removing a waypoint.
+ACTION_INTERVAL = 10
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run_server(port, baseline, ready, loaded, done, results):
+    """
+    Serve the API off of a stand-in sim, with the autopilot holding heading
+    and altitude, and report the autopilot's tick intervals from before
+    and during the load. We keep serving until every client is {done},
+    rather than for a fixed time, since clients start (and so finish) a
+    little after we tell them to.
+    """
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        sim = StandInSimConnection()
+        auto_pilot = AutoPilot(sim)
+        auto_pilot.adaptive.enabled = False
+        auto_pilot.toggle(LEVEL_FLIGHT)
+        auto_pilot.toggle(VERTICAL_SPEED_HOLD)
+        auto_pilot.set_target(HEADING_MODE, 90)
+        auto_pilot.set_target(ALTITUDE_HOLD, 2000)
+        server.sim_connection = sim
+        server.auto_pilot = auto_pilot
+
+        ticks = []
+        run_tick = auto_pilot.try_run_auto_pilot
+
+        def timed_tick():
+            ticks.append(perf_counter())
+            run_tick()
+
+        auto_pilot.try_run_auto_pilot = timed_tick
+
+        def fly():
+            while True:
+                sim.step(1)
+                time.sleep(1 / sim.frame_rate)
+
+        Thread(target=fly, daemon=True).start()
+        web_server = server.APIServer(('127.0.0.1', port), server.ProxyServer)
+        Thread(target=web_server.serve_forever, daemon=True).start()
+        auto_pilot.toggle_auto_pilot()
+        ready.set()
+
+        time.sleep(baseline)
+        split = len(ticks)
+        loaded.set()
+        done.wait()
+        auto_pilot.toggle_auto_pilot()
+        web_server.shutdown()
+
+    expected = auto_pilot.loops.interval / auto_pilot.clock.rate
+    jitter = [abs(b - a - expected) for a, b in zip(ticks, ticks[1:])]
+    results.put({
+        'expected': expected,
+        'baseline': jitter[:split - 1],
+        'load': jitter[split:],
+        'tick': auto_pilot.metrics.summary().get('tick'),
+    })
+
+
+def request(port, method, path):
+    connection = HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request(method, path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_client(port, duration, seed, latencies, errors):
+    """
+    A single simulated browser: poll everything the website polls, at the
+    same rates, and every so often change a target or edit the route.
+    """
+    rng = random.Random(seed)
+    start = perf_counter()
+    end = start + duration
+    # Browsers don't all start polling at the same moment.
+    due = [start + rng.random() for _ in POLLS]
+    next_action = start + rng.expovariate(1 / ACTION_INTERVAL)
+    placed = []
+
+    while True:
+        now = perf_counter()
+        if now >= end:
+            break
+        i = min(range(len(due)), key=due.__getitem__)
+        if next_action < due[i]:
+            wait, name = next_action - now, None
+        else:
+            wait, name = due[i] - now, i
+        if wait > 0:
+            time.sleep(min(wait, end - now))
+            continue
+
+        if name is not None:
+            kind, interval, path = POLLS[name]
+            method = 'GET'
+            due[name] += interval
+        else:
+            kind, method, path = get_action(rng, placed)
+            next_action += rng.expovariate(1 / ACTION_INTERVAL)
+
+        mark = perf_counter()
+        try:
+            status = request(port, method, path)
+            reason = str(status) if status >= 400 else None
+        except OSError as error:
+            reason = type(error).__name__
+        latencies.setdefault(kind, []).append(perf_counter() - mark)
+        if reason is not None:
+            # Count errors per request type and reason (status code or exception).
+            reasons = errors.setdefault(kind, {})
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+
+def get_action(rng, placed):
+    choice = rng.random()
+    if choice < 0.25:
+        return 'set heading', 'POST', f'/autopilot?type={HEADING_MODE}&target={rng.randint(0, 359)}'
+    if choice < 0.5:
+        return 'set altitude', 'POST', f'/autopilot?type={ALTITUDE_HOLD}&target={rng.randint(15, 30) * 100}'
+    if choice < 0.75 or len(placed) == 0:
+        # Far enough away that we won't fly past (and remove) it during the test.
+        location = f'{rng.uniform(10, 20):.6f},{rng.uniform(10, 20):.6f}'
+        placed.append(location)
+        return 'add waypoint', 'PUT', f'/api/?location={location}'
+    return 'remove waypoint', 'DELETE', f'/api/?location={placed.pop(rng.randrange(len(placed)))}'
+
+
+def add_errors(errors, more):
+    for kind, reasons in more.items():
+        for reason, count in reasons.items():
+            errors.setdefault(kind, {})[reason] = errors.get(kind, {}).get(reason, 0) + count
+
+
+def run_clients(task):
+    """
+    Run a batch of clients, each on its own thread, and gather their results.
+    """
+    port, count, duration, seed = task
+    results = [({}, {}) for _ in range(count)]
+    threads = [Thread(target=run_client, args=(port, duration, seed + i, *results[i]))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies, errors = {}, {}
+    for client_latencies, client_errors in results:
+        for kind, values in client_latencies.items():
+            latencies.setdefault(kind, []).extend(values)
+        add_errors(errors, client_errors)
+    return latencies, errors
+
+
+def load_test(clients, duration, baseline, workers, port=PORT):
+    ready, loaded, done, results = Event(), Event(), Event(), Queue()
+    server_process = Process(target=run_server, args=(port, baseline, ready, loaded, done, results))
+    server_process.start()
+    ready.wait()
+    loaded.wait()
+
+    workers = max(1, min(workers, clients))
+    tasks = [(port, clients // workers + (i < clients % workers), duration, i * clients)
+             for i in range(workers)]
+    latencies, errors = {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch_latencies, batch_errors in executor.map(run_clients, tasks):
+            for kind, values in batch_latencies.items():
+                latencies.setdefault(kind, []).extend(values)
+            add_errors(errors, batch_errors)
+    done.set()
+
+    ticks = results.get()
+    server_process.join()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f'{clients} clients: {total} requests in {duration}s, {total / duration:.1f} requests/s, '
+          f'{sum(sum(reasons.values()) for reasons in errors.values())} errors')
+    for kind, values in sorted(latencies.items()):
+        reasons = errors.get(kind, {})
+        print("  %-16s %6d requests, %4d errors, latency p50 %.1fms, p90 %.1fms, p99 %.1fms, max %.1fms" % (
+            kind, len(values), sum(reasons.values()), 1000 * percentile(values, 50),
+            1000 * percentile(values, 90), 1000 * percentile(values, 99), 1000 * max(values)))
+        if reasons:
+            print("  %-16s errors: %s" % ('', ', '.join(
+                f'{count}x {reason}' for reason, count in sorted(reasons.items(), key=lambda r: -r[1]))))
+    for phase in ['baseline', 'load']:
+        jitter = ticks[phase]
+        print("  tick jitter (%s, %d ticks every %.0fms): p50 %.1fms, p99 %.1fms, max %.1fms" % (
+            phase, len(jitter), 1000 * ticks['expected'], 1000 * percentile(jitter, 50),
+            1000 * percentile(jitter, 99), 1000 * max(jitter, default=0)))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Load test the autopilot HTTP API with simulated clients.')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50],
+                        help='how many clients to simulate, one test per value')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per test')
+    parser.add_argument('--baseline', type=float, default=5, help='seconds without load, before each test')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='client processes')
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        load_test(clients, args.duration, args.baseline, args.workers, args.port)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,101 @@
+import sys
+import time
+from collections import deque
+from itertools import count
+from threading import Thread
+
+# How many log entries we keep around for the /autopilot/log endpoint.
+LOG_SIZE = 1000
+
+# By default, each call site gets to log at most once every this many seconds.
+MIN_INTERVAL = 1
+
+# How often (in seconds) the background writer prints whatever got logged.
+WRITE_INTERVAL = 0.5
+
+# Our log, and the entries that still need writing. deque appends and
+# poplefts are atomic, so logging never has to wait on a lock.
+entries = deque(maxlen=LOG_SIZE)
+pending = deque(maxlen=LOG_SIZE)
+sequence = count(1)
+
+# Per call site: when it last logged, and how many calls we dropped since.
+last_logged = {}
+suppressed = {}
+
+writer = None
+
+
+def log(site, message, interval=MIN_INTERVAL, **fields):
+    """
+    Log a message, unless {site} already logged something in the last
+    {interval} seconds, in which case we just count it as suppressed.
+    The message is a format string for {fields}, and only gets formatted
+    when it's written, off of the tick path.
+    """
+    now = time.time()
+    if now - last_logged.get(site, -interval) < interval:
+        suppressed[site] = suppressed.get(site, 0) + 1
+        return
+    last_logged[site] = now
+    entry = (next(sequence), now, site, message, fields, suppressed.pop(site, 0))
+    entries.append(entry)
+    pending.append(entry)
+    if writer is None:
+        start_writer()
+
+
+def format_message(message, fields, dropped=0):
+    try:
+        text = message.format(**fields)
+    except (KeyError, IndexError, ValueError):
+        text = f'{message} {fields}'
+    return f'{text} ({dropped} suppressed)' if dropped else text
+
+
+def format_entry(entry):
+    _, when, site, message, fields, dropped = entry
+    stamp = time.strftime('%H:%M:%S', time.localtime(when))
+    return f'{stamp} [{site}] {format_message(message, fields, dropped)}'
+
+
+def write_pending(out=None):
+    lines = []
+    while pending:
+        lines.append(format_entry(pending.popleft()))
+    if lines:
+        out = out or sys.stdout
+        out.write('\n'.join(lines) + '\n')
+        out.flush()
+
+
+def run_writer():
+    while True:
+        time.sleep(WRITE_INTERVAL)
+        try:
+            write_pending()
+        except Exception as error:
+            print(f'Could not write log entries: {error}')
+
+
+def start_writer():
+    global writer
+    writer = Thread(target=run_writer, daemon=True)
+    writer.start()
+
+
+def get_entries(since=0, limit=LOG_SIZE):
+    """
+    The (at most {limit}) most recent log entries after sequence number {since}.
+    """
+    recent = [e for e in list(entries) if e[0] > since]
+    recent = recent[max(0, len(recent) - limit):]
+    return [{
+        'seq': seq,
+        'time': when,
+        'site': site,
+        'message': format_message(message, fields, dropped),
+        'fields': {k: v if isinstance(v, (int, float, str, bool, type(None))) else str(v)
+                   for k, v in fields.items()},
+        'suppressed': dropped,
+    } for seq, when, site, message, fields, dropped in recent]
@@ -0,0 +1,124 @@
+from math import degrees
+from utils import get_compass_diff
+from constants import AUTO_TAKEOFF, ACROBATIC, HEADING_MODE, ALTITUDE_HOLD
+
+# In steady flight we slow the base tick down by this much...
+CRUISE_SCALE = 0.25
+# ...but never to less than this many ticks per second.
+MIN_RATE = 1
+# How long (in seconds) we need to have been steady before slowing down.
+STEADY_TIME = 5
+
+# The largest errors and rates of change that still count as "steady".
+MAX_HEADING_ERROR = 5   # degrees
+MAX_ALTITUDE_ERROR = 100  # feet
+MAX_DBANK = 1  # degrees per second
+MAX_DVS = 100  # feet per minute, per second
+
+
+class ControlLoop:
+    """
+    A handler that should run {rate} times per second, which the loop
+    schedule turns into "every {divisor} base ticks". If the loop belongs
+    to a mode, it only runs while that mode is active.
+    """
+
+    def __init__(self, name, handler, rate, mode=None):
+        self.name = name
+        self.handler = handler
+        self.rate = rate
+        self.mode = mode
+        self.divisor = 1
+
+
+class LoopSchedule:
+    """
+    Runs control loops at different rates off of a single base tick: fast
+    inner loops (holding bank and pitch) run every tick, while slow outer
+    loops (navigation, terrain) only run every so many ticks, with the
+    inner loops working off of whatever the outer loops last decided.
+
+    If no base rate is given, the base tick runs as fast as the fastest
+    loop needs it to.
+    """
+
+    def __init__(self, base_rate=None):
+        self.fixed_rate = base_rate
+        self.base_rate = base_rate or 1
+        self.scale = 1
+        self.loops = []
+        self.tick = 0
+
+    def register(self, name, handler, rate, mode=None):
+        self.loops.append(ControlLoop(name, handler, rate, mode))
+        self.update()
+
+    def set_rates(self, rates):
+        """
+        Change the rates (in Hz) for any number of loops, by name.
+        """
+        for loop in self.loops:
+            if loop.name in rates:
+                loop.rate = rates[loop.name]
+        self.update()
+
+    def set_scale(self, scale):
+        """
+        Speed up or slow down the base tick. Loops that are slower than
+        the new base tick keep their own rate, faster ones run every tick.
+        """
+        self.scale = scale
+        self.update()
+
+    def update(self):
+        full_rate = self.fixed_rate or max(loop.rate for loop in self.loops)
+        self.base_rate = max(min(MIN_RATE, full_rate), full_rate * self.scale)
+        for loop in self.loops:
+            loop.divisor = max(1, round(self.base_rate / loop.rate))
+
+    @property
+    def interval(self):
+        return 1 / self.base_rate
+
+    def due(self):
+        """
+        The loops that should run this tick, in registration order.
+        """
+        tick = self.tick
+        self.tick += 1
+        return [loop for loop in self.loops if tick % loop.divisor == 0]
+
+
+class AdaptiveRate:
+    """
+    Decides how fast the base tick should run: at full rate while taking
+    off, or while we're far off target or the plane is still moving about,
+    but slowed down once we've been in steady flight for a while, so that
+    we're not polling MSFS (and burning CPU) for nothing during a long
+    cruise. Speeding up happens right away, slowing down only once we've
+    been steady for STEADY_TIME seconds.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.steady_since = None
+
+    def is_busy(self, auto_pilot, state):
+        modes = auto_pilot.modes
+        if modes[AUTO_TAKEOFF] or modes[ACROBATIC]:
+            return True
+        if modes[HEADING_MODE] and state.has('heading'):
+            if abs(get_compass_diff(degrees(state.heading), modes[HEADING_MODE])) > MAX_HEADING_ERROR:
+                return True
+        if modes[ALTITUDE_HOLD] and state.has('altitude'):
+            if abs(modes[ALTITUDE_HOLD] - state.altitude) > MAX_ALTITUDE_ERROR:
+                return True
+        return abs(degrees(state.dBank)) > MAX_DBANK or abs(state.dVS) > MAX_DVS
+
+    def get_scale(self, auto_pilot, state):
+        if not self.enabled or self.is_busy(auto_pilot, state):
+            self.steady_since = None
+            return 1
+        if self.steady_since is None:
+            self.steady_since = state.call_time
+        return CRUISE_SCALE if state.call_time - self.steady_since >= STEADY_TIME else 1
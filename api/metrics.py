@@ -0,0 +1,107 @@
+from bisect import bisect_left
+from time import perf_counter
+
+# Histogram bucket upper bounds, in seconds: 10µs up to ~1.3s, doubling each step.
+BUCKETS = [0.00001 * 2 ** i for i in range(18)]
+
+STAGES = ['read', 'state', 'navigation', 'auto_takeoff', 'fly_level', 'terrain_follow', 'vertical_hold', 'write', 'tick']
+
+
+class Histogram:
+    """
+    A fixed-bucket timing histogram. Only the autopilot thread ever writes
+    to it, and every update is a plain increment, so there are no locks:
+    readers may see a snapshot that's one observation out of date.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Estimate a percentile by interpolating within the bucket it falls in.
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        if total == 0:
+            return 0
+        target = p / 100 * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count > 0 and seen + count >= target:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class TickMetrics:
+    """
+    Per-stage timings for the autopilot tick. Stages are timed by passing
+    the previous mark in, and getting a new mark back:
+
+        mark = metrics.mark()
+        ...
+        mark = metrics.record('read', mark)
+    """
+
+    def __init__(self, stages=STAGES):
+        self.enabled = True
+        self.histograms = {stage: Histogram() for stage in stages}
+
+    def mark(self):
+        return perf_counter()
+
+    def record(self, stage, mark):
+        now = perf_counter()
+        if self.enabled:
+            self.histograms[stage].observe(now - mark)
+        return now
+
+    def summary(self):
+        """
+        Count, mean, percentiles and max (all in seconds) for each stage.
+        """
+        return {stage: h.summary() for stage, h in self.histograms.items()}
+
+    def to_prometheus(self):
+        """
+        The same data, in the Prometheus text exposition format.
+        """
+        name = 'autopilot_stage_seconds'
+        lines = [
+            f'# HELP {name} Time spent in each stage of the autopilot tick.',
+            f'# TYPE {name} histogram',
+        ]
+        for stage, h in self.histograms.items():
+            counts = list(h.counts)
+            cumulative = 0
+            for bound, count in zip(h.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {sum(counts)}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,61 @@
+import json
+from os.path import abspath, dirname, isfile, join
+
+# Where the tuner writes, and the autopilot reads, tuned parameters.
+PROFILES = join(dirname(abspath(__file__)), 'profiles.json')
+
+# The tunable constants used by fly_level and vertical_hold. Ranges that
+# get mapped over airspeed (or trim limit) have a _min and _max value.
+DEFAULT_PARAMETERS = {
+    # fly_level
+    'max_bank_min': 10,         # degrees, at 50kts
+    'max_bank_max': 30,         # degrees, at 200kts
+    'step_min': 1,              # degrees of aileron trim, at 50kts
+    'step_max': 2,              # degrees of aileron trim, at 150kts
+    'max_turn_rate': 3,         # degrees per second
+    # vertical_hold
+    'trim_step_min': 0.001,     # degrees of elevator trim, for small trim limits
+    'trim_step_max': 0.01,      # degrees of elevator trim, for large trim limits
+    'kick': 10,                 # multiple of the trim step
+    'max_dVS': 20,              # feet per minute per second
+}
+
+# The search space for the tuner.
+PARAMETER_RANGES = {
+    'max_bank_min': (5, 20),
+    'max_bank_max': (15, 35),
+    'step_min': (0.25, 3),
+    'step_max': (0.5, 5),
+    'max_turn_rate': (1, 6),
+    'trim_step_min': (0.0002, 0.005),
+    'trim_step_max': (0.002, 0.05),
+    'kick': (2, 30),
+    'max_dVS': (5, 60),
+}
+
+
+def load_parameters(path, aircraft_class):
+    """
+    Load the parameter set for an aircraft class from a profile file,
+    falling back to the default for anything it doesn't specify.
+    """
+    parameters = dict(DEFAULT_PARAMETERS)
+    if isfile(path):
+        with open(path) as file:
+            profiles = json.load(file)
+        parameters.update(profiles.get(aircraft_class, {}))
+    return parameters
+
+
+def save_parameters(path, aircraft_class, parameters):
+    """
+    Store the parameter set for an aircraft class in a profile file,
+    leaving the profiles for other aircraft classes untouched.
+    """
+    profiles = {}
+    if isfile(path):
+        with open(path) as file:
+            profiles = json.load(file)
+    profiles[aircraft_class] = parameters
+    with open(path, 'w') as file:
+        json.dump(profiles, file, indent=2)
@@ -0,0 +1,257 @@
+import time
+import numpy as np
+
+
+def _as_array(value, size, dtype=float):
+    return np.array(np.broadcast_to(np.asarray(value, dtype=dtype), (size,)))
+
+
+def _limit_array(limit, size, default):
+    if limit is None:
+        return np.full(size, default)
+    values = np.array(np.broadcast_to(np.asarray(limit, dtype=object), (size,)))
+    return np.array([default if v is None else v for v in values], dtype=float)
+
+
+class PIDArray(object):
+    """
+    N independent PID controllers, stepped all at once.
+
+    This mirrors simple_pid.PID, but every gain, setpoint, limit and internal
+    term is an array with one entry per controller, so that thousands of
+    controller configurations can be evaluated in a single call (e.g. when
+    tuning gains against simulated flights). Values that are "None" for the
+    scalar PID (no output yet, no limit) are represented as NaN and -inf/inf.
+    """
+
+    def __init__(
+        self,
+        size,
+        Kp=1.0,
+        Ki=0.0,
+        Kd=0.0,
+        setpoint=0,
+        sample_time=0.01,
+        output_limits=(None, None),
+        auto_mode=True,
+        proportional_on_measurement=False,
+        differetial_on_measurement=True,
+        error_map=None,
+    ):
+        """
+        Initialize N new PID controllers.
+
+        :param size: The number of controllers.
+        :param Kp: The proportional gain(s), either a single value or one per controller.
+        :param Ki: The integral gain(s), either a single value or one per controller.
+        :param Kd: The derivative gain(s), either a single value or one per controller.
+        :param setpoint: The initial setpoint(s) that the controllers will try to achieve.
+        :param sample_time: The time in seconds which each controller should wait before
+            generating a new output value, either a single value or one per controller.
+            If set to None, controllers compute a new output value every time they're called.
+        :param output_limits: The output limits as (lower, upper), where either can be a single
+            value, one value per controller, or None for no limit in that direction.
+        :param auto_mode: Whether the controllers should be enabled (auto mode) or not.
+        :param proportional_on_measurement: Whether the proportional term should be calculated
+            on the input directly rather than on the error, per controller.
+        :param differetial_on_measurement: Whether the differential term should be calculated
+            on the input directly rather than on the error, per controller.
+        :param error_map: Function to transform the error array into another array.
+        """
+        self.size = size
+        self.Kp = _as_array(Kp, size)
+        self.Ki = _as_array(Ki, size)
+        self.Kd = _as_array(Kd, size)
+        self.setpoint = _as_array(setpoint, size)
+        self.sample_time = sample_time
+        self.proportional_on_measurement = _as_array(proportional_on_measurement, size, bool)
+        self.differetial_on_measurement = _as_array(differetial_on_measurement, size, bool)
+        self.error_map = error_map
+        self._auto_mode = _as_array(auto_mode, size, bool)
+        self.time_fn = time.monotonic
+
+        self._min_output = np.full(size, -np.inf)
+        self._max_output = np.full(size, np.inf)
+        self._proportional = np.zeros(size)
+        self._integral = np.zeros(size)
+        self._derivative = np.zeros(size)
+        self._last_time = np.zeros(size)
+        self._last_output = np.full(size, np.nan)
+        self._last_error = np.full(size, np.nan)
+        self._last_input = np.full(size, np.nan)
+
+        self.output_limits = output_limits
+        self.reset()
+
+    @property
+    def sample_time(self):
+        return self._sample_time
+
+    @sample_time.setter
+    def sample_time(self, sample_time):
+        # None means "always update", which is the same as a sample time of zero.
+        self._sample_time = sample_time
+        self._sample_times = _limit_array(sample_time, self.size, 0)
+
+    def __call__(self, input_, dt=None):
+        """
+        Update all controllers, and return the array of control outputs.
+
+        Each controller only computes a new output if its sample_time has passed
+        since its last update, otherwise it reports its previous output (NaN if it
+        has not computed any output yet).
+
+        :param input_: The input value(s), either a single value or one per controller.
+        :param dt: If set, uses this value (or these per-controller values) for the
+            timestep instead of real time.
+        """
+        input_ = _as_array(input_, self.size)
+        now = self.time_fn()
+
+        if dt is None:
+            dt = now - self._last_time
+            dt = np.where(dt != 0, dt, 1e-16)
+        else:
+            dt = _as_array(dt, self.size)
+            if np.any(dt <= 0):
+                raise ValueError('dt has negative value {}, must be positive'.format(dt.min()))
+
+        has_output = ~np.isnan(self._last_output)
+        waiting = (dt < self._sample_times) & has_output
+        update = self._auto_mode & ~waiting
+
+        # Compute error terms
+        error = self.setpoint - input_
+        d_input = np.where(np.isnan(self._last_input), 0, input_ - self._last_input)
+        d_error = np.where(np.isnan(self._last_error), 0, error - self._last_error)
+
+        # Check if must map the error
+        if self.error_map is not None:
+            error = self.error_map(error)
+
+        # Compute the proportional term
+        proportional = np.where(
+            self.proportional_on_measurement,
+            self._proportional - self.Kp * d_input,
+            self.Kp * error,
+        )
+
+        # Compute integral and derivative terms, avoiding integral windup
+        integral = np.clip(self._integral + self.Ki * error * dt, self._min_output, self._max_output)
+        derivative = np.where(
+            self.differetial_on_measurement,
+            -self.Kd * d_input / dt,
+            self.Kd * d_error / dt,
+        )
+
+        # Compute final output
+        output = np.clip(proportional + integral + derivative, self._min_output, self._max_output)
+
+        # Keep track of state, but only for the controllers that actually updated
+        self._proportional = np.where(update, proportional, self._proportional)
+        self._integral = np.where(update, integral, self._integral)
+        self._derivative = np.where(update, derivative, self._derivative)
+        self._last_output = np.where(update, output, self._last_output)
+        self._last_input = np.where(update, input_, self._last_input)
+        self._last_error = np.where(update, error, self._last_error)
+        self._last_time = np.where(update, now, self._last_time)
+
+        return self._last_output.copy()
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '{self.__class__.__name__}(size={self.size!r})'.format(self=self)
+
+    @property
+    def components(self):
+        """
+        The P-, I- and D-term arrays from the last computation, as a tuple.
+        """
+        return self._proportional, self._integral, self._derivative
+
+    @property
+    def tunings(self):
+        """The tunings used by the controllers as a tuple of arrays: (Kp, Ki, Kd)."""
+        return self.Kp, self.Ki, self.Kd
+
+    @tunings.setter
+    def tunings(self, tunings):
+        """Set the PID tunings, either as single values or per controller."""
+        self.Kp, self.Ki, self.Kd = [_as_array(v, self.size) for v in tunings]
+
+    @property
+    def auto_mode(self):
+        """Whether each controller is currently enabled (in auto mode) or not."""
+        return self._auto_mode
+
+    @auto_mode.setter
+    def auto_mode(self, enabled):
+        """Enable or disable the PID controllers."""
+        self.set_auto_mode(enabled)
+
+    def set_auto_mode(self, enabled, last_output=None):
+        """
+        Enable or disable controllers, optionally setting the last output value for
+        controllers that go from manual to auto mode. See simple_pid.PID.set_auto_mode.
+
+        :param enabled: Whether auto mode should be enabled, either a single value or one
+            per controller.
+        :param last_output: The control variable(s) that controllers switching to auto
+            mode should start from. Has no effect on controllers already in auto mode.
+        """
+        enabled = _as_array(enabled, self.size, bool)
+        switching = enabled & ~self._auto_mode
+
+        if np.any(switching):
+            # Switching from manual mode to auto, reset
+            self.reset(switching)
+            start = np.zeros(self.size) if last_output is None else _as_array(last_output, self.size)
+            integral = np.clip(start, self._min_output, self._max_output)
+            self._integral = np.where(switching, integral, self._integral)
+
+        self._auto_mode = enabled
+
+    @property
+    def output_limits(self):
+        """
+        The current output limits as a 2-tuple of arrays: (lower, upper).
+        """
+        return self._min_output, self._max_output
+
+    @output_limits.setter
+    def output_limits(self, limits):
+        """Set the output limits."""
+        if limits is None:
+            limits = (None, None)
+
+        min_output, max_output = limits
+        min_output = _limit_array(min_output, self.size, -np.inf)
+        max_output = _limit_array(max_output, self.size, np.inf)
+
+        if np.any(max_output < min_output):
+            raise ValueError('lower limit must be less than upper limit')
+
+        self._min_output = min_output
+        self._max_output = max_output
+
+        self._integral = np.clip(self._integral, self._min_output, self._max_output)
+        self._last_output = np.clip(self._last_output, self._min_output, self._max_output)
+
+    def reset(self, mask=None):
+        """
+        Reset the controller internals, either for all controllers, or only for
+        those where {mask} is True.
+
+        This sets each term to 0 as well as clearing the integral, the last output and the last
+        input (derivative calculation).
+        """
+        mask = np.ones(self.size, dtype=bool) if mask is None else _as_array(mask, self.size, bool)
+        zero = np.clip(np.zeros(self.size), self._min_output, self._max_output)
+        self._proportional = np.where(mask, 0, self._proportional)
+        self._integral = np.where(mask, zero, self._integral)
+        self._derivative = np.where(mask, 0, self._derivative)
+        self._last_time = np.where(mask, self.time_fn(), self._last_time)
+        self._last_output = np.where(mask, np.nan, self._last_output)
+        self._last_input = np.where(mask, np.nan, self._last_input)
@@ -0,0 +1,61 @@
+import os
+import heapq
+import traceback
+from itertools import count
+from time import perf_counter
+from threading import Thread, Condition, Lock
+from concurrent.futures import ThreadPoolExecutor
+
+# How many threads run scheduled calls, across every autopilot in this process.
+POOL_SIZE = min(32, (os.cpu_count() or 1) + 4)
+
+shared = None
+shared_lock = Lock()
+
+
+def get_scheduler():
+    """
+    The scheduler that every autopilot in this process shares by default.
+    """
+    global shared
+    with shared_lock:
+        if shared is None:
+            shared = Scheduler()
+        return shared
+
+
+class Scheduler:
+    """
+    Runs calls after a delay, like threading.Timer, but with a single
+    timing thread and a fixed pool of worker threads, rather than a new
+    thread per call, so that one process can drive any number of
+    autopilots without ending up with thousands of threads.
+    """
+
+    def __init__(self, workers=POOL_SIZE):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='autopilot')
+        self.calls = []
+        self.sequence = count()
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay, fn, *args):
+        with self.condition:
+            heapq.heappush(self.calls, (perf_counter() + delay, next(self.sequence), fn, args))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.calls or self.calls[0][0] > perf_counter():
+                    timeout = self.calls[0][0] - perf_counter() if self.calls else None
+                    self.condition.wait(timeout)
+                _, _, fn, args = heapq.heappop(self.calls)
+            self.pool.submit(self.call, fn, args)
+
+    def call(self, fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            traceback.print_exc()
@@ -1,60 +1,219 @@
 import os
+import io
 import json
 from autopilot import AutoPilot
+from aircraft import AIRCRAFT_PROFILES
+from clock import CLOCKS
+from logs import LOG_SIZE, get_entries
+from encoding import JSON, FLOAT64, EncodedCache, encode, get_encodings, negotiate
+from flightplan import get_format, CONTENT_TYPES
 # from importlib import reload
 from threading import Timer
 from simconnection import APSimConnection
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import parse_qs, urlparse
 
 host_name = "localhost"
 server_port = 8080
+# If set to the ALOS dataset folder, terrain follow reads elevation
+# data in-process, rather than asking the elevation server for it.
+elevation_data = None
+# Where the autopilot gets its time from (see clock.py): following the
+# sim's own clock means it keeps flying properly at 2x/4x sim rate.
+time_source = 'sim-time'
+# An optional state estimator for the autopilot (see estimator.py), e.g.
+# AlphaBetaEstimator(poll_interval=0.1) to only poll MSFS every 100ms,
+# and run the ticks in between off of its predictions.
+estimator = None
+# Where we remember the design values of the aircraft we've flown, so we
+# only need to ask MSFS for them once per aircraft (None to always ask).
+aircraft_profiles = AIRCRAFT_PROFILES
 sim_connection: APSimConnection = None
 auto_pilot: AutoPilot = None
+# The autopilot parameters barely ever change, but get polled constantly.
+parameter_cache = EncodedCache()
+# How long (in seconds) a GET /autopilot?since=... waits for something to change.
+LONG_POLL_TIMEOUT = 25
+# How many connections can wait to be accepted. Every browser tab polls
+# several endpoints a second, each on a new connection, so the socket
+# module's default of 5 overflows as soon as a few clients poll at once,
+# and the OS then refuses or resets their connections.
+REQUEST_QUEUE_SIZE = 128
+
+
+class APIServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class RequestBody:
+    """
+    A file-like view of a request body that stops reading at Content-Length,
+    so parsers can stream from it without blocking on the open socket.
+    """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size)
+        self.remaining -= len(data)
+        return data
 
 
 class ProxyServer(BaseHTTPRequestHandler):
-    def set_headers(self):
-        self.send_response(200)
+    def set_headers(self, status=200, content_type='application/json', headers={}):
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', '*')
         self.send_header('Cache-Control', 'no-cache')
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
         self.end_headers()
 
+    def send_data(self, data, cache=None, values=None, key=None, headers={}):
+        """
+        Send data in whichever encoding the client's Accept header asks for:
+        JSON, MessagePack or, if we have a list of {values}, just those
+        values as packed float64s.
+        """
+        offered = get_encodings() + ([FLOAT64] if values is not None else [])
+        content_type = negotiate(self.headers.get('Accept'), offered)
+        if content_type == FLOAT64:
+            data = values
+        encoded = cache.encode(data, content_type, key) if cache else encode(data, content_type)
+        self.set_headers(content_type=content_type, headers={
+            'Vary': 'Accept',
+            'Content-Length': str(len(encoded)),
+            **headers,
+        })
+        self.wfile.write(encoded)
+
+    def send_parameters(self):
+        """
+        Send the autopilot parameters, tagged with the autopilot's state
+        version. Clients that send that tag back as If-None-Match get a
+        304 if nothing changed since, and clients that ask for ?since=<version>
+        don't get an answer until something changes (or we time out, which
+        is also a 304). Any version other than ours counts as a change,
+        including one from before the server restarted.
+        """
+        args = parse_qs(urlparse(self.path).query)
+        version = auto_pilot.version
+        if 'since' in args:
+            try:
+                since = int(args['since'][0])
+            except ValueError:
+                return self.send_bad_request()
+            version = auto_pilot.wait_for_change(since, LONG_POLL_TIMEOUT)
+            if version == since:
+                return self.send_not_modified(f'"{version}"')
+        etag = f'"{version}"'
+        tags = [t.strip().replace('W/', '', 1) for t in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or '*' in tags:
+            return self.send_not_modified(etag)
+        # Get the parameters after the version, so they're never older than their tag.
+        self.send_data(auto_pilot.get_auto_pilot_parameters(), parameter_cache, key=version, headers={
+            'ETag': etag,
+            'Access-Control-Expose-Headers': 'ETag',
+        })
+
+    def send_bad_request(self):
+        self.set_headers(400)
+        self.wfile.write(json.dumps(None).encode('utf-8'))
+
+    def send_not_modified(self, etag):
+        self.set_headers(304, headers={
+            'ETag': etag,
+            'Access-Control-Expose-Headers': 'ETag',
+            'Content-Length': '0',
+        })
+
+    def get_flight_plan_format(self, args):
+        if 'format' in args:
+            return get_format(args['format'][0])
+        content_type = self.headers.get('Content-Type', '')
+        for format, type in CONTENT_TYPES.items():
+            if content_type.startswith(type):
+                return format
+        return None
+
     def log_request(self, code='-', size='-'):
         return
 
     def do_GET(self):
         ### print('[GET]: ', self.path)
 
-        self.set_headers()
+        # Are we exporting our waypoints as a flight plan?
+        if '/autopilot/waypoints' in self.path:
+            return self.send_flight_plan()
+
+        # Are we being asked for autopilot tick timings?
+        if '/autopilot/metrics' in self.path:
+            return self.send_metrics()
+
+        # Are we being asked for recent log entries?
+        if '/autopilot/log' in self.path:
+            return self.send_log()
+
         if not sim_connection.connected:
-            return self.wfile.write(json.dumps(None).encode('utf-8'))
+            return self.send_data(None)
 
         # Is MSFS even running?
         if '/connected' in self.path:
-            data = True
+            return self.send_data(True)
 
         # Is our python-based autopilot running?
         if '/autopilot' in self.path:
-            data = json.dumps(auto_pilot.get_auto_pilot_parameters())
+            return self.send_parameters()
 
-        # Handle API calls
-        else:
-            data = self.get_api_response()
-
-        # make sure the response is never empty
-        if data != None:
-            data = json.dumps(data).encode('utf-8')
-        else:
-            data = json.dumps(dict()).encode('utf-8')
-        self.wfile.write(data)
+        # Handle API calls, making sure the response is never empty
+        data, values = self.get_api_response()
+        self.send_data(data or dict(), values=values)
 
     def do_OPTIONS(self):
         self.set_headers()
         self.wfile.write(b'okay')
 
+    def send_metrics(self):
+        args = parse_qs(urlparse(self.path).query)
+        prometheus = args.get('format', [''])[0] == 'prometheus' or \
+            'text/plain' in self.headers.get('Accept', '')
+        if prometheus:
+            self.set_headers(content_type='text/plain; version=0.0.4')
+            return self.wfile.write(auto_pilot.metrics.to_prometheus().encode('utf-8'))
+        self.set_headers()
+        self.wfile.write(json.dumps(auto_pilot.metrics.summary()).encode('utf-8'))
+
+    def send_log(self):
+        args = parse_qs(urlparse(self.path).query)
+        try:
+            since = int(args.get('since', ['0'])[0])
+            limit = int(args.get('limit', [str(LOG_SIZE)])[0])
+        except ValueError:
+            return self.send_bad_request()
+        if limit < 0:
+            return self.send_bad_request()
+        self.set_headers()
+        self.wfile.write(json.dumps(get_entries(since, limit)).encode('utf-8'))
+
+    def send_flight_plan(self):
+        args = parse_qs(urlparse(self.path).query)
+        format = self.get_flight_plan_format(args)
+        if format is None:
+            self.set_headers(400)
+            return self.wfile.write(json.dumps(None).encode('utf-8'))
+        self.set_headers(content_type=CONTENT_TYPES[format])
+        out = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        auto_pilot.export_flight_plan(out, format)
+        out.flush()
+        out.detach()
+
     def do_PUT(self):
         # for adding waypoints
         print(self.path)
@@ -63,6 +222,20 @@ class ProxyServer(BaseHTTPRequestHandler):
         if 'location' in args:
             values = args['location'][0].split(',')
             auto_pilot.add_waypoint(*values)
+
+        # for bulk-loading an entire flight plan in one request
+        length = int(self.headers.get('Content-Length', 0))
+        if length > 0:
+            format = self.get_flight_plan_format(args)
+            replace = args.get('replace', ['true'])[0] != 'false'
+            body = RequestBody(self.rfile, length)
+            try:
+                auto_pilot.import_flight_plan(body, format, replace)
+            except Exception as error:
+                print(f'Could not load flight plan: {error}')
+                self.set_headers(400)
+                return self.wfile.write(json.dumps(None).encode('utf-8'))
+
         self.set_headers()
         self.wfile.write(json.dumps(
             auto_pilot.get_auto_pilot_parameters()).encode('utf-8'))
@@ -111,15 +284,21 @@ class ProxyServer(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps(data).encode('utf-8'))
 
     def get_api_response(self):
+        """
+        The requested values, both by name and as a list in request order.
+        """
         key_values = dict()
+        values = None
         query = urlparse(self.path).query
         args = parse_qs(query)
         if 'get' in args:
+            values = []
             params = args['get'][0].split(",")
             props = [s.replace("%20", "_") for s in params]
             for prop in props:
-                key_values[prop] = sim_connection.get(prop)
-        return key_values
+                values.append(sim_connection.get(prop))
+                key_values[prop] = values[-1]
+        return key_values, values
 
 
 def run():
@@ -127,9 +306,15 @@ def run():
     sim_connection = APSimConnection()
     sim_connection.connect()
     auto_pilot = AutoPilot(sim_connection)
+    auto_pilot.aircraft_profiles = aircraft_profiles
+    auto_pilot.use_clock(CLOCKS[time_source]())
+    if elevation_data is not None:
+        auto_pilot.use_elevation_data(elevation_data)
+    if estimator is not None:
+        auto_pilot.use_estimator(estimator)
 
     try:
-        webServer = HTTPServer((host_name, server_port), ProxyServer)
+        webServer = APIServer((host_name, server_port), ProxyServer)
         print(f'Server started http://{host_name}:{server_port}')
         webServer.serve_forever()
     except KeyboardInterrupt:
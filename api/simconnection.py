@@ -1,9 +1,23 @@
+import traceback
+from time import perf_counter
+from threading import Thread, Event, local
 from SimConnect import SimConnection
 
+# What we consider "one sim frame" when pacing data subscriptions.
+FRAME_RATE = 30
+
+# How often (in seconds) to check whether the sim is still paused.
+PAUSED_INTERVAL = 1
+
 class APSimConnection(SimConnection):
     def __init__(self):
         super().__init__()
         self.auto_pilot = False
+        # Writes staged since start_batch(), kept per thread, so that only
+        # the thread running a tick batches its writes, while anything else
+        # (like the web server setting a value) still gets written right away.
+        self.batch = local()
+        self.subscription = None
 
     def set_auto_pilot(self, auto_pilot):
         self.auto_pilot = auto_pilot
@@ -16,4 +30,72 @@ class APSimConnection(SimConnection):
         if name == "TRIM_ANCHOR":
             return list(self.auto_pilot.anchor)
 
+        # If we've staged a new value, that's the value as far as we're concerned.
+        staged = self.get_staged()
+        if staged is not None and name in staged:
+            return staged[name]
+
         return super().get(name)
+
+    def get_staged(self):
+        return getattr(self.batch, 'staged', None)
+
+    def start_batch(self):
+        """
+        Start staging this thread's writes rather than sending them to MSFS
+        immediately. If the same variable gets set more than once, only the
+        last value gets written when we flush.
+        """
+        self.batch.staged = {}
+
+    def set(self, name, value):
+        staged = self.get_staged()
+        if staged is not None:
+            staged[name] = value
+            return True
+        return super().set(name, value)
+
+    def flush(self):
+        """
+        Write everything this thread staged since start_batch() in one go,
+        and go back to writing values immediately.
+        """
+        staged = self.get_staged() or {}
+        self.batch.staged = None
+        for name, value in staged.items():
+            super().set(name, value)
+
+    def subscribe(self, names, callback, frames=1):
+        """
+        Deliver a fresh sample of {names} to {callback} every {frames} sim
+        frames, but only while the sim is actually running, along with how
+        long (in seconds) reading that sample took. The SimConnect
+        wrapper doesn't expose periodic data requests, so a single reader
+        thread does the pacing, and only checks SIM_RUNNING while paused.
+        """
+        self.unsubscribe()
+        stop = Event()
+        thread = Thread(target=self.run_subscription, args=(
+            names, callback, frames / FRAME_RATE, stop), daemon=True)
+        self.subscription = stop
+        thread.start()
+
+    def unsubscribe(self):
+        if self.subscription is not None:
+            self.subscription.set()
+            self.subscription = None
+
+    def run_subscription(self, names, callback, interval, stop):
+        while not stop.is_set():
+            start = perf_counter()
+            running = self.get('SIM_RUNNING')
+            if running is None or running < 3:
+                stop.wait(max(interval, PAUSED_INTERVAL))
+                continue
+            try:
+                mark = perf_counter()
+                values = {name: self.get(name) for name in names}
+                callback(values, perf_counter() - mark)
+            except Exception:
+                traceback.print_exc()
+            stop.wait(max(0, interval - (perf_counter() - start)))
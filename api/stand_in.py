@@ -0,0 +1,168 @@
+from math import radians, degrees, tan
+from threading import local
+from time import perf_counter
+from utils import get_point_at_distance, constrain
+
+KNOTS_TO_MPS = 0.514444
+KM_PER_NM = 1.852
+GRAVITY = 9.81
+
+
+class StandInSimConnection():
+    """
+    A stand-in for APSimConnection that runs a very simple flight model
+    instead of talking to MSFS, so we can run the autopilot without the
+    sim. This is not a flight simulator: aileron trim sets a roll rate,
+    elevator trim sets a target vertical speed, and the plane turns the
+    way a coordinated turn at its current bank would make it turn.
+
+    Time only moves forward when step() gets called, one sim frame at a
+    time, which also drives any data subscription.
+    """
+
+    def __init__(self, lat=48.975, long=-123.705, altitude=1500, speed=120, heading=0, weight=3000, frame_rate=30):
+        self.connected = True
+        self.auto_pilot = None
+        self.frame_rate = frame_rate
+        self.frame = 0
+        self.time = 0
+        self.paused = False
+        self.batch = local()
+        self.subscription = None
+        self.events = []
+        self.values = {
+            'TITLE': 'Stand-in aircraft',
+            'ABSOLUTE_TIME': 0,
+            'SIMULATION_RATE': 1,
+            'SIM_ON_GROUND': 0,
+            'AIRSPEED_TRUE': speed,
+            'GROUND_VELOCITY': speed,
+            'PLANE_BANK_DEGREES': 0,
+            'TURN_INDICATOR_RATE': 0,
+            'PLANE_LATITUDE': lat,
+            'PLANE_LONGITUDE': long,
+            'PLANE_HEADING_DEGREES_MAGNETIC': radians(heading),
+            'PLANE_HEADING_DEGREES_TRUE': radians(heading),
+            'INDICATED_ALTITUDE': altitude,
+            'VERTICAL_SPEED': 0,
+            'ELEVATOR_TRIM_POSITION': 0,
+            'AILERON_TRIM_PCT': 0,
+            'ELEVATOR_TRIM_UP_LIMIT': 10,
+            'ELEVATOR_TRIM_DOWN_LIMIT': 10,
+            'ELEVATOR_POSITION': 0,
+            'RUDDER_POSITION': 0,
+            'TOTAL_WEIGHT': weight,
+            'NUMBER_OF_ENGINES': 1,
+            'IS_TAIL_DRAGGER': 0,
+            'DESIGN_SPEED_CLIMB': 80,
+            'DESIGN_SPEED_MIN_ROTATION': 55,
+            'GENERAL_ENG_THROTTLE_LEVER_POSITION:1': 100,
+            'FLAPS_HANDLE_INDEX:1': 0,
+            'BRAKE_PARKING_POSITION': 0,
+            'TAILWHEEL_LOCK_ON': 1,
+        }
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def set_auto_pilot(self, auto_pilot):
+        self.auto_pilot = auto_pilot
+
+    def check_connection(self):
+        pass
+
+    def get(self, name):
+        if name == "TRIM_ANCHOR":
+            return list(self.auto_pilot.anchor)
+        if name == 'SIM_RUNNING':
+            return 1 if self.paused else 3
+        staged = self.get_staged()
+        if staged is not None and name in staged:
+            return staged[name]
+        return self.values.get(name)
+
+    def get_standard_property_value(self, name):
+        return self.get(name)
+
+    def set(self, name, value):
+        staged = self.get_staged()
+        if staged is not None:
+            staged[name] = value
+        else:
+            self.values[name] = float(value)
+        return True
+
+    def trigger(self, event):
+        self.events.append(event)
+
+    def get_staged(self):
+        return getattr(self.batch, 'staged', None)
+
+    def start_batch(self):
+        self.batch.staged = {}
+
+    def flush(self):
+        staged = self.get_staged() or {}
+        self.batch.staged = None
+        for name, value in staged.items():
+            self.set(name, value)
+
+    def subscribe(self, names, callback, frames=1):
+        self.subscription = (names, callback, frames)
+
+    def unsubscribe(self):
+        self.subscription = None
+
+    def step(self, frames=1):
+        """
+        Advance the flight model by one or more sim frames, delivering
+        subscription samples at the subscribed frame cadence.
+        """
+        for _ in range(frames):
+            if self.paused:
+                continue
+            self.update(1 / self.frame_rate)
+            self.frame += 1
+            if self.subscription is not None:
+                names, callback, every = self.subscription
+                if self.frame % every == 0:
+                    mark = perf_counter()
+                    values = {name: self.get(name) for name in names}
+                    callback(values, perf_counter() - mark)
+
+    def update(self, dt):
+        v = self.values
+        self.time += dt
+        v['ABSOLUTE_TIME'] = self.time
+
+        # Heavier planes respond more sluggishly to the same trim input.
+        authority = 3000 / v['TOTAL_WEIGHT']
+
+        # Aileron trim rolls us (positive trim banks us right, which MSFS
+        # reports as a negative bank), with a little roll damping.
+        bank = degrees(v['PLANE_BANK_DEGREES'])
+        bank += (-100 * authority * v['AILERON_TRIM_PCT'] - 0.1 * bank) * dt
+        bank = constrain(bank, -80, 80)
+        v['PLANE_BANK_DEGREES'] = radians(bank)
+
+        # Coordinated turn: turn rate follows from bank and speed.
+        speed = max(v['AIRSPEED_TRUE'], 1) * KNOTS_TO_MPS
+        turn_rate = -GRAVITY * tan(radians(bank)) / speed
+        v['TURN_INDICATOR_RATE'] = turn_rate
+        heading = (v['PLANE_HEADING_DEGREES_TRUE'] + turn_rate * dt) % radians(360)
+        v['PLANE_HEADING_DEGREES_TRUE'] = heading
+        v['PLANE_HEADING_DEGREES_MAGNETIC'] = heading
+
+        # Elevator trim sets a vertical speed that we ease into.
+        target_VS = 100000 * authority * v['ELEVATOR_TRIM_POSITION']
+        v['VERTICAL_SPEED'] += (target_VS - v['VERTICAL_SPEED']) * min(1, dt / 2)
+        v['INDICATED_ALTITUDE'] += v['VERTICAL_SPEED'] / 60 * dt
+
+        distance = v['GROUND_VELOCITY'] * KM_PER_NM * dt / 3600
+        lat, long = get_point_at_distance(
+            v['PLANE_LATITUDE'], v['PLANE_LONGITUDE'], distance, degrees(heading))
+        v['PLANE_LATITUDE'] = lat
+        v['PLANE_LONGITUDE'] = long
@@ -7,12 +7,88 @@ def printc(terms):
     return print(', '.join(terms))
 
 
+# The MSFS variables that each State field is built from.
+FIELD_VARIABLES = {
+    'on_ground': ['SIM_ON_GROUND'],
+    'altitude': ['INDICATED_ALTITUDE'],
+    'speed': ['AIRSPEED_TRUE'],
+    'ground_speed': ['GROUND_VELOCITY'],
+    'latitude': ['PLANE_LATITUDE'],
+    'longitude': ['PLANE_LONGITUDE'],
+    'heading': ['PLANE_HEADING_DEGREES_MAGNETIC'],
+    'true_heading': ['PLANE_HEADING_DEGREES_TRUE'],
+    'bank_angle': ['PLANE_BANK_DEGREES'],
+    'turn_rate': ['TURN_INDICATOR_RATE'],
+    'vertical_speed': ['VERTICAL_SPEED'],
+    'pitch_trim': ['ELEVATOR_TRIM_POSITION'],
+    'pitch_trim_limit': ['ELEVATOR_TRIM_UP_LIMIT', 'ELEVATOR_TRIM_DOWN_LIMIT'],
+    'aileron_trim': ['AILERON_TRIM_PCT'],
+}
+
+# Fields we can still build a State without, if MSFS doesn't give us a value.
+OPTIONAL_FIELDS = ['on_ground', 'ground_speed']
+
+# The field that each delta is derived from.
+DELTA_FIELDS = {
+    'dBank': 'bank_angle',
+    'dTurn': 'turn_rate',
+    'dHeading': 'heading',
+    'dV': 'speed',
+    'dVS': 'vertical_speed',
+}
+
+
+def get_variables(fields):
+    """
+    The (unique, ordered) list of MSFS variables needed for a set of fields.
+    """
+    variables = []
+    for field in FIELD_VARIABLES:
+        if field in fields:
+            variables.extend(FIELD_VARIABLES[field])
+    return variables
+
+
+def get_fields(values):
+    """
+    The fields that we can build from a sample of MSFS variables.
+    """
+    return [field for field, variables in FIELD_VARIABLES.items()
+            if all(v in values for v in variables)]
+
+
+def build_state(values, prev_state=None, call_time=None):
+    """
+    Build a State from whichever fields a sample has the variables for.
+    Returns None (and reports what went wrong) if any required value is
+    missing from the sample.
+    """
+    fields = {}
+    for field in get_fields(values):
+        field_values = [values[v] for v in FIELD_VARIABLES[field]]
+        if None in field_values:
+            if field in OPTIONAL_FIELDS:
+                continue
+            printc([f'{v}: {"bad" if values[v] is None else "good"}'
+                    for v in FIELD_VARIABLES[field]])
+            return None
+        fields[field] = field_values if len(field_values) > 1 else field_values[0]
+
+    if 'on_ground' in fields:
+        fields['on_ground'] = fields['on_ground'] == 1
+    if 'ground_speed' not in fields and 'speed' in fields:
+        fields['ground_speed'] = fields['speed']
+
+    return State(prev_state=prev_state, call_time=call_time, **fields)
+
+
 @struct
 class State:
     # Basic flight data
     on_ground = True
     altitude = 0
     speed = 0
+    ground_speed = 0
 
     # Basic nagivation data
     latitude = 0
@@ -28,34 +104,45 @@ class State:
     pitch_trim_limit = [10, -10]
     aileron_trim = 0
 
-    # Value deltas ("per second"). These are automatically
-    # set if there is a previous state.
+    # Value deltas ("per second"). These are automatically set if
+    # there is a previous state, and both states have that value.
     dBank = 0
     dTurn = 0
     dHeading = 0
     dV = 0
     dVS = 0
 
-    # Timestamp for this state. This value is automatically set.
+    # Timestamp for this state. This value is automatically
+    # set, unless explicitly passed in.
     call_time = 0
 
     # derived values if there is a previous state
     def constructor(self, **kwargs):
-        self.call_time = perf_counter()
+        if kwargs.get('call_time') is None:
+            self.call_time = perf_counter()
+        # Remember which fields were actually set, rather than defaulted.
+        self._fields = set(kwargs) & set(FIELD_VARIABLES)
         if 'prev_state' in kwargs:
             prev_state = kwargs.get('prev_state')
             if prev_state is not None:
                 interval = self.call_time - prev_state.call_time
-                # Derive all our deltas "per second"
-                self.dBank = (self.bank_angle -
-                              prev_state.bank_angle) / interval
-                self.dTurn = (self.turn_rate - prev_state.turn_rate) / interval
-                self.dHeading = (self.heading - prev_state.heading) / interval
-                self.dV = (self.speed - prev_state.speed) / interval
-                self.dVS = (self.vertical_speed -
-                            prev_state.vertical_speed) / interval
+                # Derive all our deltas "per second", as long as time
+                # actually moved forward between the two states.
+                for delta, field in DELTA_FIELDS.items():
+                    if interval <= 0:
+                        break
+                    if field in self._fields and field in prev_state._fields:
+                        value = (getattr(self, field) -
+                                 getattr(prev_state, field)) / interval
+                        setattr(self, delta, value)
         # print(self)
 
+    def has(self, *fields):
+        """
+        Whether this state was built with (rather than defaulted) these fields.
+        """
+        return all(field in self._fields for field in fields)
+
     def __str__(self):
         return '\n'.join([
             '',
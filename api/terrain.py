@@ -0,0 +1,171 @@
+import json
+import time
+from queue import Queue
+from threading import Thread, Lock
+from urllib.request import urlopen
+from math import ceil, floor, degrees
+from utils import get_point_at_distance
+
+# The State fields that terrain follow looks at.
+FIELDS = ['latitude', 'longitude', 'true_heading', 'speed', 'ground_speed']
+
+ELEVATION_SERVER = 'http://127.0.0.1:9000'
+FEET_PER_METER = 1 / 0.3048
+KNOTS_TO_KMPS = 1.852 / 3600
+
+# How far above the terrain we want to be, in feet, if the
+# terrain follow mode doesn't specify its own clearance.
+DEFAULT_CLEARANCE = 500
+
+# We look ahead as far as we'll fly in this many seconds, but
+# never less than 12NM (roughly what the old JS code used).
+LOOK_AHEAD_TIME = 120
+MIN_LOOK_AHEAD = 22
+
+# How wide a corridor (in km either side of our track) to check,
+# so that a small heading change doesn't fly us into a hillside.
+TRACK_WIDTH = 0.5
+
+# Elevation data is cached per grid cell of CELL_SIZE degrees
+# (roughly a km), holding the highest of CELL_SAMPLES x CELL_SAMPLES
+# elevations sampled across that cell.
+CELL_SIZE = 0.01
+CELL_SAMPLES = 4
+
+# How many cells to ask the elevation server about per request.
+CELLS_PER_REQUEST = 16
+
+# Targets are rounded up to this many feet, so that we don't
+# keep changing altitude for every little bump in the terrain.
+ALTITUDE_STEP = 100
+
+
+def get_cell(lat, long):
+    return (floor(lat / CELL_SIZE), floor(long / CELL_SIZE))
+
+
+def get_cell_locations(cell):
+    """
+    The lat/long coordinates that we sample a cell's elevation at.
+    """
+    step = CELL_SIZE / CELL_SAMPLES
+    lat, long = cell[0] * CELL_SIZE + step / 2, cell[1] * CELL_SIZE + step / 2
+    return [(lat + i * step, long + j * step)
+            for i in range(CELL_SAMPLES) for j in range(CELL_SAMPLES)]
+
+
+def lookup_elevations(locations):
+    """
+    Get the elevations, in meters, for a list of lat/long coordinates
+    from the elevation server. Locations without data come back as None.
+    """
+    query = '|'.join(f'{lat:.6f},{long:.6f}' for lat, long in locations)
+    with urlopen(f'{ELEVATION_SERVER}/?locations={query}', timeout=5) as response:
+        data = json.loads(response.read())
+    return [r['elevation'] for r in data['results']]
+
+
+def get_local_lookup(tiles_folder):
+    """
+    Get a lookup function that reads elevations straight from the ALOS
+    dataset in this process, rather than asking the elevation server,
+    sharing its tile cache with anything else in this process that uses
+    the same dataset.
+    """
+    from elevation.alos import get_dataset
+    return get_dataset(tiles_folder, background=True).lookup_many
+
+
+def get_track_cells(lat, long, heading, distance):
+    """
+    The grid cells we'll be flying over for the next {distance} km,
+    flying a (true) heading in degrees, in the order we'll reach them.
+    """
+    cells = []
+    step = CELL_SIZE * 111 / 2
+    steps = int(distance / step) + 1
+    for i in range(steps + 1):
+        centre = get_point_at_distance(lat, long, i * step, heading)
+        # Check either side of the track by going perpendicular to our
+        # heading, rather than by offsetting lat/long directly, which
+        # gets distorted the further we are from the equator.
+        left = get_point_at_distance(*centre, TRACK_WIDTH, heading - 90)
+        right = get_point_at_distance(*centre, TRACK_WIDTH, heading + 90)
+        for point in [centre, left, right]:
+            cell = get_cell(*point)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+class TerrainFollow:
+    """
+    Works out the altitude we need to fly at to clear the terrain
+    along our projected track. Elevation lookups happen on a background
+    worker, with the results cached per grid cell, so that asking for a
+    target altitude never waits on elevation data: cells we don't have
+    data for yet simply get queued up, and picked up on a later tick.
+    """
+
+    def __init__(self, lookup=lookup_elevations):
+        self.lookup = lookup
+        self.cells = {}
+        self.pending = set()
+        self.lock = Lock()
+        self.queue = Queue()
+        self.worker = None
+
+    def request(self, cells):
+        with self.lock:
+            cells = [c for c in cells if c not in self.cells and c not in self.pending]
+            self.pending.update(cells)
+        for cell in cells:
+            self.queue.put(cell)
+        if cells and self.worker is None:
+            self.worker = Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+
+    def run_worker(self):
+        while True:
+            cells = [self.queue.get()]
+            while len(cells) < CELLS_PER_REQUEST and not self.queue.empty():
+                cells.append(self.queue.get())
+            locations = [l for cell in cells for l in get_cell_locations(cell)]
+            try:
+                elevations = self.lookup(locations)
+            except Exception as e:
+                # Leave these cells unknown, so they get requested again.
+                print(f'Could not get elevation data: {e}')
+                with self.lock:
+                    self.pending.difference_update(cells)
+                time.sleep(1)
+                continue
+            n = CELL_SAMPLES * CELL_SAMPLES
+            with self.lock:
+                for i, cell in enumerate(cells):
+                    # No data means we're over the sea (or outside the dataset)
+                    known = [e for e in elevations[i * n:(i + 1) * n] if e is not None]
+                    self.cells[cell] = max(known, default=0) * FEET_PER_METER
+                    self.pending.discard(cell)
+
+    def get_target_altitude(self, state, clearance=DEFAULT_CLEARANCE, current=None):
+        """
+        The altitude, in feet, that clears everything along our projected
+        track by {clearance} feet, or None if we don't have the elevation
+        data for that track yet. While some of the track is still unknown,
+        we only ever climb above the {current} target: the cells we're
+        missing could be the highest ones, so partial data is never a
+        reason to descend.
+        """
+        speed = state.ground_speed or state.speed
+        distance = max(MIN_LOOK_AHEAD, speed * KNOTS_TO_KMPS * LOOK_AHEAD_TIME)
+        cells = get_track_cells(state.latitude, state.longitude, degrees(state.true_heading), distance)
+        self.request(cells)
+        known = [self.cells[c] for c in cells if c in self.cells]
+        if len(known) == 0:
+            return None
+        target = ALTITUDE_STEP * ceil((max(known) + clearance) / ALTITUDE_STEP)
+        if len(known) < len(cells):
+            if current is None or current is False or target <= current:
+                return None
+        return target
@@ -0,0 +1,255 @@
+"""
+Tune the fly_level and vertical_hold parameters by flying simulated
+scenarios on the stand-in sim, spread across all CPU cores, and write
+the best parameter set for each aircraft class to a profile file that
+AutoPilot.load_parameters() can read.
+
+usage: python tuner.py [--search grid|random|es] [--budget N] [--classes ...] [--profiles file]
+       python tuner.py --benchmark-estimators [--classes ...]
+"""
+
+import os
+import time
+import random
+import argparse
+from itertools import product
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from math import degrees, radians
+from autopilot import AutoPilot, TICK_VARIABLES
+from stand_in import StandInSimConnection
+from estimator import AlphaBetaEstimator
+from parameters import DEFAULT_PARAMETERS, PARAMETER_RANGES, PROFILES, save_parameters
+from state import State
+from utils import constrain, get_compass_diff
+from constants import LEVEL_FLIGHT, HEADING_MODE, VERTICAL_SPEED_HOLD, ALTITUDE_HOLD
+
+# Run the autopilot every 15 sim frames, i.e. twice a second.
+TICK_FRAMES = 15
+
+# How noisy our sim readings are, when benchmarking state estimators.
+NOISE = {
+    'INDICATED_ALTITUDE': 10,
+    'AIRSPEED_TRUE': 1,
+    'PLANE_HEADING_DEGREES_MAGNETIC': radians(0.2),
+    'PLANE_BANK_DEGREES': radians(0.5),
+    'TURN_INDICATOR_RATE': radians(0.2),
+    'VERTICAL_SPEED': 50,
+}
+
+AIRCRAFT_CLASSES = {
+    'light': {'speed': 100, 'weight': 2500},
+    'medium': {'speed': 150, 'weight': 4500},
+    'heavy': {'speed': 220, 'weight': 6500},
+}
+
+SCENARIOS = [
+    # hold heading and altitude
+    {'heading': 0, 'target_heading': 0, 'altitude': 1500, 'target_altitude': 1500, 'duration': 60},
+    # turn right, and left
+    {'heading': 0, 'target_heading': 90, 'altitude': 1500, 'target_altitude': 1500, 'duration': 120},
+    {'heading': 90, 'target_heading': 315, 'altitude': 1500, 'target_altitude': 1500, 'duration': 150},
+    # climb, and descend while turning
+    {'heading': 0, 'target_heading': 0, 'altitude': 1500, 'target_altitude': 2500, 'duration': 150},
+    {'heading': 180, 'target_heading': 225, 'altitude': 3000, 'target_altitude': 2500, 'duration': 120},
+]
+
+
+def read_values(sim, noise=None):
+    values = {name: sim.values.get(name) for name in TICK_VARIABLES}
+    for name, sigma in (noise or {}).items():
+        values[name] += random.gauss(0, sigma)
+    return values
+
+
+def fly_scenario(parameters, aircraft, scenario, estimator=None, noise=None):
+    """
+    Fly a single scenario with the given parameters, and return its cost:
+    how far off target we were, for how long, and how hard we worked
+    the trim to get there. If an estimator is given, the autopilot only
+    reads from the sim when the estimator needs a new sample.
+    """
+    sim = StandInSimConnection(
+        altitude=scenario['altitude'],
+        speed=aircraft['speed'],
+        heading=scenario['heading'],
+        weight=aircraft['weight'],
+    )
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        auto_pilot = AutoPilot(sim)
+        auto_pilot.parameters.update(parameters)
+        auto_pilot.prev_state = State(call_time=sim.time)
+        auto_pilot.toggle(LEVEL_FLIGHT)
+        auto_pilot.toggle(VERTICAL_SPEED_HOLD)
+        auto_pilot.set_target(HEADING_MODE, scenario['target_heading'])
+        auto_pilot.set_target(ALTITUDE_HOLD, scenario['target_altitude'])
+        auto_pilot.use_estimator(estimator)
+
+        values = sim.values
+        dt = TICK_FRAMES / sim.frame_rate
+        a_trim = values['AILERON_TRIM_PCT']
+        trim = values['ELEVATOR_TRIM_POSITION']
+        cost = 0
+
+        for _ in range(int(scenario['duration'] / dt)):
+            sim.step(TICK_FRAMES)
+            if estimator is None or estimator.needs_sample(sim.time):
+                auto_pilot.process_sample(read_values(sim, noise), sim.time)
+            else:
+                auto_pilot.process_prediction(sim.time)
+            heading = degrees(values['PLANE_HEADING_DEGREES_TRUE'])
+            heading_error = get_compass_diff(heading, scenario['target_heading'])
+            altitude_error = scenario['target_altitude'] - values['INDICATED_ALTITUDE']
+            effort = abs(values['AILERON_TRIM_PCT'] - a_trim) / radians(1) + \
+                abs(values['ELEVATOR_TRIM_POSITION'] - trim) / radians(0.01)
+            a_trim = values['AILERON_TRIM_PCT']
+            trim = values['ELEVATOR_TRIM_POSITION']
+            cost += dt * (abs(heading_error) / 10 + abs(altitude_error) / 100) + effort / 10
+            if abs(degrees(values['PLANE_BANK_DEGREES'])) > 60 or values['INDICATED_ALTITUDE'] < 0:
+                return float('inf')
+
+    return cost
+
+
+def evaluate(task):
+    parameters, aircraft, scenario = task
+    return fly_scenario(parameters, aircraft, scenario)
+
+
+class Tuner:
+    """
+    Evaluates candidate parameter sets against all scenarios for an
+    aircraft class, farming every (candidate, scenario) flight out to
+    a process pool so that we scale with both candidate and scenario
+    count.
+    """
+
+    def __init__(self, executor, aircraft, scenarios=SCENARIOS):
+        self.executor = executor
+        self.aircraft = aircraft
+        self.scenarios = scenarios
+        self.flights = 0
+        self.best = (float('inf'), dict(DEFAULT_PARAMETERS))
+
+    def score(self, candidates):
+        tasks = [(c, self.aircraft, s) for c in candidates for s in self.scenarios]
+        chunksize = max(1, len(tasks) // (4 * (os.cpu_count() or 1)))
+        costs = list(self.executor.map(evaluate, tasks, chunksize=chunksize))
+        self.flights += len(tasks)
+        n = len(self.scenarios)
+        scores = [sum(costs[i * n:(i + 1) * n]) for i in range(len(candidates))]
+        for score, candidate in zip(scores, candidates):
+            if score < self.best[0]:
+                self.best = (score, candidate)
+        return scores
+
+    def grid(self, budget):
+        """
+        Try every combination of evenly spaced values for each parameter,
+        with as many values per parameter as the budget allows. If the
+        budget doesn't even cover two values per parameter, we try a
+        random sample of that grid instead, because any slice of it in
+        order would only ever vary the last few parameters.
+        """
+        names = list(PARAMETER_RANGES)
+        levels = 2
+        while (levels + 1) ** len(names) <= budget:
+            levels += 1
+        axes = [[lo + (hi - lo) * i / (levels - 1) for i in range(levels)]
+                for lo, hi in PARAMETER_RANGES.values()]
+        candidates = [dict(zip(names, values)) for values in product(*axes)]
+        if len(candidates) > budget:
+            print(f'A grid over {len(names)} parameters needs {len(candidates)} runs, '
+                  f'sampling {budget} of them instead (use --budget {len(candidates)} '
+                  f'for the full grid, or --search random or es)')
+            candidates = random.Random(0).sample(candidates, budget)
+        self.score([dict(DEFAULT_PARAMETERS)] + candidates)
+
+    def random(self, budget):
+        candidates = [dict(DEFAULT_PARAMETERS)] + [
+            {name: random.uniform(lo, hi) for name, (lo, hi) in PARAMETER_RANGES.items()}
+            for _ in range(budget - 1)
+        ]
+        self.score(candidates)
+
+    def es(self, budget, population=None):
+        """
+        A simple evolution strategy in the spirit of CMA-ES, with a diagonal
+        covariance: sample around the current mean, then move the mean to the
+        best candidates and adapt each parameter's spread to theirs.
+        """
+        names = list(PARAMETER_RANGES)
+        population = population or max(8, 2 * (os.cpu_count() or 1))
+        elite = max(2, population // 4)
+        mean = dict(DEFAULT_PARAMETERS)
+        sigma = {name: (hi - lo) / 4 for name, (lo, hi) in PARAMETER_RANGES.items()}
+        self.score([dict(mean)])
+
+        for _ in range(max(1, (budget - 1) // population)):
+            candidates = [{
+                name: constrain(random.gauss(mean[name], sigma[name]), *PARAMETER_RANGES[name])
+                for name in names
+            } for _ in range(population)]
+            scores = self.score(candidates)
+            ranked = [c for _, c in sorted(zip(scores, range(population)))][:elite]
+            selected = [candidates[i] for i in ranked]
+            for name in names:
+                values = [c[name] for c in selected]
+                mean[name] = sum(values) / elite
+                spread = (sum((v - mean[name]) ** 2 for v in values) / elite) ** 0.5
+                lo, hi = PARAMETER_RANGES[name]
+                sigma[name] = max(spread, (hi - lo) / 100)
+
+
+def benchmark_estimators(aircraft_classes):
+    """
+    Fly every scenario with noisy sim readings, with and without a state
+    estimator, and with the estimator standing in for every other sim read.
+    """
+    dt = TICK_FRAMES / 30
+    configurations = {
+        'raw state, sampled every tick': lambda: None,
+        'alpha-beta, sampled every tick': lambda: AlphaBetaEstimator(),
+        'alpha-beta, sampled every other tick': lambda: AlphaBetaEstimator(poll_interval=1.5 * dt),
+    }
+    for aircraft_class in aircraft_classes:
+        aircraft = AIRCRAFT_CLASSES[aircraft_class]
+        for name, make_estimator in configurations.items():
+            random.seed(1)
+            mark = time.time()
+            cost = sum(fly_scenario(DEFAULT_PARAMETERS, aircraft, scenario, make_estimator(), NOISE)
+                       for scenario in SCENARIOS)
+            print("%s, %s: cost %.1f (%.2fs)" % (aircraft_class, name, cost, time.time() - mark))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Tune autopilot parameters on simulated flights.')
+    parser.add_argument('--search', choices=['grid', 'random', 'es'], default='es')
+    parser.add_argument('--budget', type=int, default=200, help='candidate parameter sets per class')
+    parser.add_argument('--classes', nargs='+', default=list(AIRCRAFT_CLASSES), choices=list(AIRCRAFT_CLASSES))
+    parser.add_argument('--profiles', default=PROFILES)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--benchmark-estimators', action='store_true',
+                        help='compare state estimators on noisy sim readings instead of tuning')
+    args = parser.parse_args()
+
+    if args.benchmark_estimators:
+        return benchmark_estimators(args.classes)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for aircraft_class in args.classes:
+            mark = time.time()
+            tuner = Tuner(executor, AIRCRAFT_CLASSES[aircraft_class])
+            getattr(tuner, args.search)(args.budget)
+            elapsed = time.time() - mark
+            score, parameters = tuner.best
+            print("%s: best cost %.1f, %d flights in %.1fs (%.1f flights/s)" % (
+                aircraft_class, score, tuner.flights, elapsed, tuner.flights / elapsed))
+            save_parameters(args.profiles, aircraft_class, parameters)
+
+    print(f'Profiles written to {args.profiles}')
+
+
+if __name__ == "__main__":
+    run()
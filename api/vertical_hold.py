@@ -1,26 +1,36 @@
 from utils import constrain, constrain_map
 from math import copysign, radians, degrees
-from constants import ALTITUDE_HOLD, MSFS_RADIAN, ACROBATIC
+from constants import ALTITUDE_HOLD, MSFS_RADIAN, ACROBATIC, PID_CONTROL
+from controllers import PITCH
+from logs import log
+
+# The State fields that vertical_hold (in any of its variants) looks at.
+FIELDS = ['altitude', 'speed', 'vertical_speed', 'pitch_trim', 'pitch_trim_limit']
 
 
 def vertical_hold(auto_pilot, state):
     if auto_pilot.modes[ACROBATIC]:
         return fly_acrobatic(auto_pilot, state)
 
+    if auto_pilot.modes[PID_CONTROL]:
+        return vertical_hold_pid(auto_pilot, state)
+
     # anchor adjustments: positive numbers raise the nose, negative numbers drop it down.
     anchor = auto_pilot.anchor
+    parameters = auto_pilot.parameters
 
     # How much should we trim by?
     trim_limit = state.pitch_trim_limit[0]
     trim_limit = 10 if trim_limit == 0 else trim_limit
-    trim_step = constrain_map(trim_limit, 5, 20, radians(0.001), radians(0.01))
-    kick = 10 * trim_step
+    trim_step = constrain_map(trim_limit, 5, 20, radians(
+        parameters['trim_step_min']), radians(parameters['trim_step_max']))
+    kick = parameters['kick'] * trim_step
 
     VS = state.vertical_speed
     max_VS = 1000
 
     dVS = state.dVS
-    max_dVS = 20
+    max_dVS = parameters['max_dVS']
 
     target_VS = 0
 
@@ -54,6 +64,29 @@ def vertical_hold(auto_pilot, state):
     auto_pilot.set('ELEVATOR_TRIM_POSITION', anchor.y)
 
 
+def vertical_hold_pid(auto_pilot, state):
+    """
+    Rather than nudging the trim anchor, run a gain-scheduled PID
+    controller that turns vertical speed error into elevator trim.
+    """
+    controllers = auto_pilot.controllers
+    if not controllers.is_engaged(PITCH):
+        auto_pilot.engage_controllers()
+
+    max_VS = 1000
+    target_VS = 0
+
+    target_altitude = auto_pilot.modes[ALTITUDE_HOLD]
+    if target_altitude:
+        alt_diff = target_altitude - state.altitude
+        target_VS = constrain_map(alt_diff, -200, 200, -max_VS, max_VS)
+
+    output = controllers.update(PITCH, target_VS, state.vertical_speed, state.speed)
+    if output is not None:
+        auto_pilot.anchor.y = output
+        auto_pilot.set('ELEVATOR_TRIM_POSITION', auto_pilot.anchor.y)
+
+
 def fly_acrobatic(auto_pilot, state):
     """
     Acrobatic flight is much snappier, but only really works if you're going fast enough.
@@ -100,13 +133,14 @@ def fly_acrobatic(auto_pilot, state):
     if (vs_target > 5 and vspeed < 0 and vspeed > -100):
         correct += constrain_map(vspeed, -100, 100, step/10, -step/10)
 
-    print(vs_target, vs_diff, vspeed, dvs, vs_max, dvs_max, vstep, dvstep)
+    log('fly_acrobatic', 'target {vs_target}, diff {vs_diff}, VS {vspeed}, dVS {dvs}, max {vs_max}, max dVS {dvs_max}, step {vstep}, dVS step {dvstep}',
+        vs_target=vs_target, vs_diff=vs_diff, vspeed=vspeed, dvs=dvs, vs_max=vs_max, dvs_max=dvs_max, vstep=vstep, dvstep=dvstep)
 
     # "omg wtf?" protection
     protection_steps = [2, 4, 6]
     for i in protection_steps:
         if (vspeed > i * vs_max and dvs > 0) or (vspeed < -i * vs_max and dvs < 0):
-            print(f'wtf, {vspeed} exceeds {vs_max} by {i}x')
+            log('fly_acrobatic.protection', 'wtf, {vspeed} exceeds {vs_max} by {i}x', vspeed=vspeed, vs_max=vs_max, i=i)
             correct += constrain_map(vspeed, -1, 1, step / 4, -step / 4)
 
     trim = state.pitch_trim
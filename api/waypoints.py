@@ -0,0 +1,167 @@
+from math import radians, tan
+from utils import get_distance_between_points
+from fly_level import get_heading_from_to, get_max_bank
+from parameters import DEFAULT_PARAMETERS
+
+KNOTS_TO_MPS = 0.514444
+GRAVITY = 9.81
+
+# The distance (in km) at which we consider a waypoint "reached",
+# even if we didn't need to start our turn before then.
+MIN_SWITCH_DISTANCE = 0.2
+
+# How much our speed (in knots) needs to change before we bother
+# recomputing the turn geometry for the current leg.
+SPEED_TOLERANCE = 5
+
+# Very sharp turns don't benefit from turning (much) earlier,
+# and tan() runs off to infinity as we approach 180 degrees.
+MAX_ANTICIPATED_TURN = 120
+
+
+# The State fields needed to sequence waypoint legs.
+FIELDS = ['latitude', 'longitude', 'ground_speed']
+
+
+class Waypoint:
+    def __init__(self, lat, long, alt=None):
+        self.lat = lat
+        self.long = long
+        self.alt = alt
+
+    def __str__(self):
+        return f'{self.lat},{self.long},{self.alt}'
+
+    def __eq__(self, other):
+        if not hasattr(other, 'lat'):
+            return False
+        if not hasattr(other, 'long'):
+            return False
+        return self.lat == other.lat and self.long == other.long
+
+    def __dict__(self):
+        return {
+            'lat': self.lat,
+            'long': self.long,
+            'alt': self.alt
+        }
+
+
+def get_turn_radius(speed, bank):
+    """
+    speed: ground speed, in knots
+    bank: bank angle, in degrees
+
+    Returns the radius (in km) of a coordinated turn at that speed and bank.
+    """
+    v = speed * KNOTS_TO_MPS
+    return (v * v) / (GRAVITY * tan(radians(bank))) / 1000
+
+
+def get_turn_lead(speed, turn_angle, parameters=DEFAULT_PARAMETERS):
+    """
+    speed: ground speed, in knots
+    turn_angle: the heading change at the waypoint, in degrees
+    parameters: the autopilot parameters, for fly_level's max bank
+
+    Returns the distance (in km) before the waypoint at which we should
+    start turning, so that we roll out on the next leg rather than
+    overshooting it and having to turn back.
+    """
+    if turn_angle == 0:
+        return 0
+    angle = min(turn_angle, MAX_ANTICIPATED_TURN)
+    return get_turn_radius(speed, get_max_bank(speed, parameters)) * tan(radians(angle / 2))
+
+
+class Leg:
+    """
+    The geometry for flying from some start point to a waypoint, and then
+    turning onto the next leg. The turn angle is fixed for a leg, so we only
+    compute it once, and we only recompute the turn lead when our speed has
+    changed enough to matter.
+    """
+
+    def __init__(self, start, waypoint, next_waypoint=None, parameters=DEFAULT_PARAMETERS):
+        self.waypoint = waypoint
+        self.parameters = parameters
+        self.turn_angle = 0
+        if next_waypoint is not None:
+            inbound = get_heading_from_to(
+                start.lat, start.long, waypoint.lat, waypoint.long)
+            outbound = get_heading_from_to(
+                waypoint.lat, waypoint.long, next_waypoint.lat, next_waypoint.long)
+            self.turn_angle = abs((outbound - inbound + 540) % 360 - 180)
+        self.speed = None
+        self.lead = MIN_SWITCH_DISTANCE
+
+    def get_switch_distance(self, speed):
+        if self.speed is None or abs(speed - self.speed) > SPEED_TOLERANCE:
+            self.speed = speed
+            self.lead = max(MIN_SWITCH_DISTANCE,
+                            get_turn_lead(speed, self.turn_angle, self.parameters))
+        return self.lead
+
+
+class WayPoints:
+    def __init__(self, parameters=DEFAULT_PARAMETERS):
+        self.parameters = parameters
+        self.waypoints = []
+        self.previous = None
+        self.leg = None
+
+    def __len__(self):
+        return len(self.waypoints)
+
+    def __iter__(self):
+        return iter(list(self.waypoints))
+
+    def next(self):
+        return self.waypoints[0] if len(self.waypoints) > 0 else None
+
+    def add(self, lat, long, alt=None):
+        self.waypoints.append(Waypoint(lat, long, alt))
+        self.leg = None
+
+    def extend(self, points, replace=False):
+        """
+        Add a whole route's worth of (lat, long, alt) points in one go,
+        optionally replacing the current route.
+        """
+        waypoints = [Waypoint(*point) for point in points]
+        if replace:
+            self.clear()
+        self.waypoints.extend(waypoints)
+        self.leg = None
+
+    def clear(self):
+        self.waypoints = []
+        self.previous = None
+        self.leg = None
+
+    def remove(self, lat, long):
+        self.waypoints.remove(Waypoint(lat, long))
+        self.leg = None
+
+    def invalidate(self, lat, long, speed):
+        """
+        Switch to the next leg if we're close enough to the current
+        waypoint that we should start turning onto the next leg.
+        Returns whether we did.
+        """
+        waypoint = self.next()
+        if waypoint is None:
+            return False
+
+        if self.leg is None or self.leg.waypoint is not waypoint:
+            start = self.previous if self.previous is not None else Waypoint(lat, long)
+            next_waypoint = self.waypoints[1] if len(self.waypoints) > 1 else None
+            self.leg = Leg(start, waypoint, next_waypoint, self.parameters)
+
+        distance = get_distance_between_points(lat, long, waypoint.lat, waypoint.long)
+        if distance < self.leg.get_switch_distance(speed):
+            self.waypoints.remove(waypoint)
+            self.previous = waypoint if len(self.waypoints) > 0 else None
+            self.leg = None
+            return True
+        return False
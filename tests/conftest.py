@@ -0,0 +1,6 @@
+import sys
+from os.path import abspath, dirname, join
+
+# The API modules import each other by bare name, the way they're run.
+API = join(dirname(dirname(abspath(__file__))), 'api')
+sys.path.insert(0, API)
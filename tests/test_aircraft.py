@@ -0,0 +1,36 @@
+import json
+
+from stand_in import StandInSimConnection
+from aircraft import get_aircraft_profile
+
+
+def test_without_a_path_nothing_gets_stored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sim = StandInSimConnection(weight=3000)
+    profile = get_aircraft_profile(sim)
+    assert profile.total_weight == 3000
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stored_profiles_are_reused(tmp_path):
+    path = str(tmp_path / 'aircraft.json')
+    sim = StandInSimConnection(weight=3000)
+    get_aircraft_profile(sim, path)
+    with open(path) as file:
+        stored = json.load(file)['Stand-in aircraft']
+    assert 'total_weight' not in stored
+
+    # Design values come from the file from now on...
+    sim.values['DESIGN_SPEED_CLIMB'] = None
+    profile = get_aircraft_profile(sim, path)
+    assert profile.climb_speed == stored['climb_speed']
+
+
+def test_weight_is_always_read_live(tmp_path):
+    path = str(tmp_path / 'aircraft.json')
+    sim = StandInSimConnection(weight=3000)
+    assert get_aircraft_profile(sim, path).aircraft_class == 'light'
+    sim.values['TOTAL_WEIGHT'] = 6000
+    profile = get_aircraft_profile(sim, path)
+    assert profile.total_weight == 6000
+    assert profile.aircraft_class == 'heavy'
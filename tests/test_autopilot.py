@@ -0,0 +1,123 @@
+import io
+import json
+import contextlib
+import pytest
+
+pytest.importorskip('SimConnect')
+
+import aircraft
+from stand_in import StandInSimConnection
+from autopilot import AutoPilot
+from estimator import AlphaBetaEstimator
+from parameters import DEFAULT_PARAMETERS
+from constants import LEVEL_FLIGHT
+
+
+def quietly(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+@pytest.fixture
+def sim():
+    return StandInSimConnection()
+
+
+@pytest.fixture
+def auto_pilot(sim):
+    auto_pilot = quietly(AutoPilot, sim, None, 15)
+    quietly(auto_pilot.toggle, LEVEL_FLIGHT)
+    quietly(auto_pilot.toggle_auto_pilot)
+    return auto_pilot
+
+
+def get_sample(sim, auto_pilot):
+    return {name: sim.get(name) for name in auto_pilot.get_tick_variables()}
+
+
+def test_on_sample_runs_a_tick(sim, auto_pilot):
+    quietly(auto_pilot.on_sample, get_sample(sim, auto_pilot))
+    assert auto_pilot.metrics.summary()['tick']['count'] == 1
+
+
+def test_on_sample_skips_while_a_tick_is_running(sim, auto_pilot):
+    # e.g. the reader thread of a subscription we just replaced.
+    with auto_pilot.tick_lock:
+        quietly(auto_pilot.on_sample, get_sample(sim, auto_pilot))
+    assert auto_pilot.metrics.summary()['tick']['count'] == 0
+    quietly(auto_pilot.on_sample, get_sample(sim, auto_pilot))
+    assert auto_pilot.metrics.summary()['tick']['count'] == 1
+
+
+def test_navigation_only_bumps_the_version_for_whole_degrees(sim, auto_pilot):
+    version = auto_pilot.version
+    auto_pilot.steer(90.2)
+    assert auto_pilot.version == version + 1
+    for heading in [90.25, 90.3, 89.9, 90.1]:
+        auto_pilot.steer(heading)
+    assert auto_pilot.version == version + 1
+    assert auto_pilot.modes['HDG'] == 90.1
+    assert sim.get('AUTOPILOT_HEADING_LOCK_DIR') == 90.1
+    auto_pilot.steer(92)
+    assert auto_pilot.version == version + 2
+
+
+def test_waypoint_flight_doesnt_wake_long_polls(sim, auto_pilot):
+    quietly(auto_pilot.add_waypoint, 48.975, -123.5)
+    version = auto_pilot.version
+    for _ in range(60):
+        sim.step(15)
+        quietly(auto_pilot.on_sample, get_sample(sim, auto_pilot))
+    # We turn toward the waypoint, and drift a little while we do, so the
+    # target does move, but only by a degree every few navigation runs.
+    runs = auto_pilot.metrics.summary()['navigation']['count']
+    assert runs >= 20
+    assert auto_pilot.version - version <= runs / 3
+
+
+def test_enabling_loads_tuned_parameters(sim, tmp_path):
+    profiles = tmp_path / 'profiles.json'
+    profiles.write_text(json.dumps({'light': {'max_bank_max': 22, 'kick': 7}}))
+    auto_pilot = quietly(AutoPilot, sim, None, 15)
+    auto_pilot.profiles = str(profiles)
+    quietly(auto_pilot.toggle, LEVEL_FLIGHT)
+    assert auto_pilot.parameters == DEFAULT_PARAMETERS
+    quietly(auto_pilot.toggle_auto_pilot)
+    assert auto_pilot.aircraft.aircraft_class == 'light'
+    assert auto_pilot.parameters['max_bank_max'] == 22
+    assert auto_pilot.parameters['kick'] == 7
+    assert auto_pilot.parameters['max_dVS'] == DEFAULT_PARAMETERS['max_dVS']
+
+
+def test_flying_doesnt_store_aircraft_profiles(sim, monkeypatch):
+    def dump(*args, **kwargs):
+        raise AssertionError('stored an aircraft profile')
+
+    # As if we'd never flown this aircraft before.
+    monkeypatch.setattr(aircraft, 'load_profiles', lambda path: {})
+    monkeypatch.setattr(aircraft.json, 'dump', dump)
+    auto_pilot = quietly(AutoPilot, sim, None, 15)
+    quietly(auto_pilot.toggle, LEVEL_FLIGHT)
+    quietly(auto_pilot.toggle_auto_pilot)
+    for _ in range(5):
+        sim.step(15)
+        quietly(auto_pilot.on_sample, get_sample(sim, auto_pilot))
+    assert auto_pilot.aircraft is not None
+
+
+def test_subscription_reads_get_timed(sim, auto_pilot):
+    for _ in range(3):
+        quietly(sim.step, 15)
+    summary = auto_pilot.metrics.summary()
+    assert summary['tick']['count'] == 3
+    assert summary['read']['count'] == 3
+
+
+def test_use_estimator(sim, auto_pilot):
+    estimator = AlphaBetaEstimator()
+    estimator.state = 'stale'
+    auto_pilot.use_estimator(estimator)
+    assert estimator.state is None
+    quietly(sim.step, 15)
+    assert estimator.state is not None
+    assert auto_pilot.prev_state is estimator.state
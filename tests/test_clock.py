@@ -0,0 +1,104 @@
+import io
+import contextlib
+import pytest
+
+import clock
+from clock import SimRateClock, SimTimeClock, MAX_TIME_JUMP
+
+
+class FakePerfCounter:
+    def __init__(self):
+        self.now = 3500.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def real_time(monkeypatch):
+    counter = FakePerfCounter()
+    monkeypatch.setattr(clock, 'perf_counter', counter)
+    return counter
+
+
+def test_sim_rate_clock_follows_the_rate(real_time):
+    c = SimRateClock()
+    real_time.now += 1
+    assert c.now() == pytest.approx(1)
+    c.update({'SIMULATION_RATE': 4})
+    real_time.now += 1
+    assert c.now() == pytest.approx(5)
+    c.update({'SIMULATION_RATE': 0})
+    real_time.now += 1
+    assert c.now() == pytest.approx(9)
+
+
+def test_sim_time_clock_uses_real_time_until_the_first_sample(real_time):
+    c = SimTimeClock()
+    assert c.now() == real_time.now
+    assert not c.jumped
+
+
+def test_sim_time_clock_first_sample_is_a_jump(real_time):
+    c = SimTimeClock()
+    c.now()
+    c.update({'ABSOLUTE_TIME': 6.3e10, 'SIMULATION_RATE': 1})
+    assert c.jumped
+    assert c.now() == 6.3e10
+
+
+def test_sim_time_clock_extrapolates_between_samples(real_time):
+    c = SimTimeClock()
+    c.update({'ABSOLUTE_TIME': 1000, 'SIMULATION_RATE': 2})
+    c.jumped = False
+    real_time.now += 0.25
+    assert c.now() == pytest.approx(1000.5)
+    # A sample that's a little behind our extrapolation doesn't move us back.
+    c.update({'ABSOLUTE_TIME': 1000.4})
+    assert not c.jumped
+    assert c.now() == pytest.approx(1000.5)
+    real_time.now += 0.25
+    assert c.now() == pytest.approx(1000.9)
+
+
+@pytest.mark.parametrize('time', [400, 1000 + 2 * MAX_TIME_JUMP])
+def test_sim_time_clock_jumps(real_time, time):
+    c = SimTimeClock()
+    c.update({'ABSOLUTE_TIME': 1000})
+    real_time.now += 1
+    c.now()
+    c.jumped = False
+    c.update({'ABSOLUTE_TIME': time})
+    assert c.jumped
+    assert c.now() == time
+
+
+def test_sim_time_clock_allows_bigger_steps_at_higher_rates(real_time):
+    c = SimTimeClock()
+    c.update({'ABSOLUTE_TIME': 1000, 'SIMULATION_RATE': 4})
+    c.jumped = False
+    c.update({'ABSOLUTE_TIME': 1000 + 2 * MAX_TIME_JUMP})
+    assert not c.jumped
+
+
+def test_first_sample_does_not_kick_the_controllers():
+    pytest.importorskip('SimConnect')
+    from stand_in import StandInSimConnection
+    from autopilot import AutoPilot
+    from constants import PID_CONTROL, LEVEL_FLIGHT, HEADING_MODE
+
+    sim = StandInSimConnection()
+    sim.values['ABSOLUTE_TIME'] = 6.3e10
+    sim.values['PLANE_BANK_DEGREES'] = 0.2
+    with contextlib.redirect_stdout(io.StringIO()):
+        auto_pilot = AutoPilot(sim)
+        auto_pilot.use_clock(SimTimeClock())
+        auto_pilot.toggle(PID_CONTROL)
+        auto_pilot.toggle(LEVEL_FLIGHT)
+        auto_pilot.set_target(HEADING_MODE, 90)
+        auto_pilot.auto_pilot_enabled = True
+        auto_pilot.engage_controllers()
+        auto_pilot.process_sample({name: sim.get(name) for name in auto_pilot.get_tick_variables()})
+    # Rather than seeing 6e10 seconds go by, and going to full trim.
+    assert auto_pilot.prev_state.call_time == 6.3e10
+    assert abs(sim.values['AILERON_TRIM_PCT']) < 0.5
@@ -0,0 +1,89 @@
+import json
+import math
+import struct
+import pytest
+
+import encoding
+from encoding import JSON, MSGPACK, FLOAT64, EncodedCache, encode, negotiate, pack_float64
+
+OFFERED = [JSON, MSGPACK]
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, JSON),
+    ('', JSON),
+    ('text/html', JSON),
+    ('application/msgpack', MSGPACK),
+    ('application/x-msgpack', MSGPACK),
+    ('Application/MsgPack', MSGPACK),
+    ('*/*', JSON),
+    ('application/*', JSON),
+    ('application/json;q=0.5, application/msgpack', MSGPACK),
+    ('application/json, application/msgpack;q=0.9', JSON),
+    ('application/msgpack;q=0.9, application/json;q=0.9', MSGPACK),
+    ('application/msgpack;q=0, */*;q=0.1', JSON),
+    ('application/msgpack;q=0', JSON),
+    ('application/msgpack;q=oops, application/json;q=0.1', JSON),
+    ('text/html, application/msgpack;q=0.8, */*;q=0.5', MSGPACK),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept, OFFERED) == expected
+
+
+def test_negotiate_only_picks_what_we_offer():
+    assert negotiate('application/msgpack', [JSON]) == JSON
+    assert negotiate('application/x-float64', [FLOAT64, JSON]) == FLOAT64
+    assert negotiate('*/*', [FLOAT64, JSON]) == FLOAT64
+
+
+def test_pack_float64():
+    packed = pack_float64([1, 2.5, None, 'text', True])
+    values = struct.unpack('<5d', packed)
+    assert values[:2] == (1, 2.5)
+    assert math.isnan(values[2]) and math.isnan(values[3])
+    assert values[4] == 1
+
+
+def test_encode_json():
+    assert json.loads(encode({'a': [1, None]}, JSON)) == {'a': [1, None]}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = EncodedCache()
+    calls = []
+    original = encoding.encode
+
+    def counting_encode(data, content_type):
+        calls.append(content_type)
+        return original(data, content_type)
+
+    monkeypatch.setattr(encoding, 'encode', counting_encode)
+    cache.calls = calls
+    return cache
+
+
+def test_cache_compares_data(cache):
+    first = cache.encode({'a': 1}, JSON)
+    assert cache.encode({'a': 1}, JSON) is first
+    assert len(cache.calls) == 1
+    assert cache.encode({'a': 2}, JSON) != first
+    assert len(cache.calls) == 2
+
+
+def test_cache_compares_keys(cache):
+    first = cache.encode({'a': 1}, JSON, key=1)
+    # Same version, so same encoding, even though we didn't compare the data.
+    assert cache.encode({'a': 2}, JSON, key=1) is first
+    assert json.loads(cache.encode({'a': 2}, JSON, key=2)) == {'a': 2}
+    assert len(cache.calls) == 2
+
+
+def test_cache_per_content_type(cache):
+    values = [1.0, 2.0]
+    as_json = cache.encode(values, JSON, key=1)
+    as_floats = cache.encode(values, FLOAT64, key=1)
+    assert as_json != as_floats
+    assert cache.encode(values, JSON, key=1) is as_json
+    assert cache.encode(values, FLOAT64, key=1) is as_floats
+    assert len(cache.calls) == 2
@@ -0,0 +1,75 @@
+import io
+from types import SimpleNamespace
+import pytest
+
+import flightplan
+from flightplan import get_world_position, parse_world_position, parse_gpx, parse_pln, parse_geojson, write_pln
+
+
+def test_world_position_seconds_carry_into_minutes_and_degrees():
+    assert get_world_position(11.9999999, -0.9999999) == 'N12° 0\' 0.00",W1° 0\' 0.00",+000000.00'
+    assert get_world_position(47.4333333, 0) == 'N47° 26\' 0.00",E0° 0\' 0.00",+000000.00'
+
+
+def test_pln_round_trip():
+    waypoints = [SimpleNamespace(lat=47.431700, long=-122.308550, alt=433), SimpleNamespace(lat=-33.9999999, long=151.1, alt=None)]
+    out = io.StringIO()
+    write_pln(waypoints, out)
+    points = list(parse_pln(io.BytesIO(out.getvalue().encode('utf-8'))))
+    assert points[0] == pytest.approx((47.431700, -122.308550, 433), abs=1e-5)
+    assert points[1][:2] == pytest.approx((-34, 151.1), abs=1e-5)
+    assert parse_world_position(get_world_position(10.5, 20.25, 1000)) == pytest.approx((10.5, 20.25, 1000))
+
+
+def test_geojson_ignores_extra_position_values():
+    data = b'{"type":"LineString","coordinates":[[1,2,3,1700000000],[5,6],[7, 8, 0.5, 1, 2]]}'
+    points = list(parse_geojson(io.BytesIO(data)))
+    assert [p[:2] for p in points] == [(2, 1), (6, 5), (8, 7)]
+    assert points[0][2] == pytest.approx(3 * flightplan.FEET_PER_METER)
+    assert points[1][2] is None
+
+
+# iterparse reads ahead in chunks, so a container can hold the points of
+# one chunk that we haven't got to yet, but never the points we've handled.
+POINTS = 5000
+MAX_PENDING = 500
+
+
+def watch_containers(monkeypatch, tags):
+    containers = []
+    real_iterparse = flightplan.iterparse
+
+    def iterparse(stream, events):
+        for event, element in real_iterparse(stream, ('start', 'end')):
+            if event == 'start' and flightplan._local_name(element.tag) in tags:
+                containers.append(element)
+            if event in events:
+                yield event, element
+
+    monkeypatch.setattr(flightplan, 'iterparse', iterparse)
+    return containers
+
+
+def test_gpx_track_containers_do_not_grow(monkeypatch):
+    containers = watch_containers(monkeypatch, ('gpx', 'trk', 'trkseg'))
+    points = ''.join(f'<trkpt lat="{i / 1000}" lon="1"><ele>10</ele></trkpt>' for i in range(POINTS))
+    data = f'<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{points}</trkseg></trk></gpx>'
+    count = 0
+    for lat, long, alt in parse_gpx(io.BytesIO(data.encode('utf-8'))):
+        count += 1
+        assert all(len(c) < MAX_PENDING for c in containers)
+    assert count == POINTS
+    assert all(len(c) == 0 for c in containers)
+
+
+def test_pln_flight_plan_does_not_grow(monkeypatch):
+    containers = watch_containers(monkeypatch, ('FlightPlan.FlightPlan',))
+    out = io.StringIO()
+    write_pln([SimpleNamespace(lat=i / 1000, long=1, alt=0) for i in range(POINTS)], out)
+    count = 0
+    for point in parse_pln(io.BytesIO(out.getvalue().encode('utf-8'))):
+        count += 1
+        assert len(containers[0]) < MAX_PENDING
+    assert count == POINTS
+    # Only the title, plan type and route type are left.
+    assert len(containers[0]) == 3
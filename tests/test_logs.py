@@ -0,0 +1,104 @@
+import io
+from collections import deque
+from itertools import count
+import pytest
+
+import logs
+from logs import LOG_SIZE, log, get_entries, write_pending
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Start every test with an empty log, and no background writer.
+    monkeypatch.setattr(logs, 'entries', deque(maxlen=LOG_SIZE))
+    monkeypatch.setattr(logs, 'pending', deque(maxlen=LOG_SIZE))
+    monkeypatch.setattr(logs, 'sequence', count(1))
+    monkeypatch.setattr(logs, 'last_logged', {})
+    monkeypatch.setattr(logs, 'suppressed', {})
+    monkeypatch.setattr(logs, 'writer', object())
+    clock = FakeTime()
+    monkeypatch.setattr(logs.time, 'time', clock)
+    return clock
+
+
+def test_rate_limits_per_site(clock):
+    log('a', 'first')
+    log('a', 'second')
+    log('b', 'other site')
+    clock.now += 0.5
+    log('a', 'third')
+    clock.now += 0.5
+    log('a', 'fourth')
+    entries = get_entries()
+    assert [(e['site'], e['message']) for e in entries] == [
+        ('a', 'first'), ('b', 'other site'), ('a', 'fourth (2 suppressed)'),
+    ]
+    assert [e['suppressed'] for e in entries] == [0, 0, 2]
+
+
+def test_custom_interval(clock):
+    for i in range(3):
+        log('a', 'tick {i}', interval=0, i=i)
+    log('b', 'slow', interval=10)
+    clock.now += 5
+    log('b', 'slow', interval=10)
+    assert [e['message'] for e in get_entries()] == ['tick 0', 'tick 1', 'tick 2', 'slow']
+
+
+def test_fields(clock):
+    log('a', 'speed {speed:.1f}', speed=101.25, state=object())
+    log('b', 'missing {nope}', value=1)
+    first, second = get_entries()
+    assert first['message'] == 'speed 101.2'
+    assert first['fields']['speed'] == 101.25
+    assert isinstance(first['fields']['state'], str)
+    assert second['message'] == "missing {nope} {'value': 1}"
+
+
+def test_keeps_the_last_log_size_entries(clock):
+    for i in range(LOG_SIZE + 10):
+        log('a', '{i}', interval=0, i=i)
+    entries = get_entries()
+    assert len(entries) == LOG_SIZE
+    assert entries[0]['seq'] == 11
+    assert entries[-1]['seq'] == LOG_SIZE + 10
+    assert entries[-1]['message'] == str(LOG_SIZE + 9)
+
+
+@pytest.mark.parametrize('since, limit, expected', [
+    (0, LOG_SIZE, [1, 2, 3, 4, 5]),
+    (3, LOG_SIZE, [4, 5]),
+    (5, LOG_SIZE, []),
+    # A since from before a restart is simply ahead of everything we have.
+    (100, LOG_SIZE, []),
+    (0, 2, [4, 5]),
+    (1, 10, [2, 3, 4, 5]),
+    (0, 0, []),
+])
+def test_get_entries(clock, since, limit, expected):
+    for i in range(5):
+        log('a', '{i}', interval=0, i=i)
+    assert [e['seq'] for e in get_entries(since, limit)] == expected
+
+
+def test_write_pending(clock):
+    log('a', 'hello {name}', name='world')
+    log('b', 'again')
+    out = io.StringIO()
+    write_pending(out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith('[a] hello world')
+    # Written entries aren't written again, but stay in the log.
+    out = io.StringIO()
+    write_pending(out)
+    assert out.getvalue() == ''
+    assert len(get_entries()) == 2
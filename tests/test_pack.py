@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import pytest
+from os.path import join
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('osgeo')
+
+from conftest import API
+
+# The elevation modules import each other by bare name too, and the elevation
+# server has to win over the autopilot's server.py when pack.py imports it.
+# Once it has, we put things back, so other tests get the autopilot's server.
+ELEVATION = join(API, 'elevation')
+sys.path.insert(0, ELEVATION)
+api_server = sys.modules.pop('server', None)
+
+import pack
+from alos import (ALOS30m, ALOSTile, PackedTile, OVERVIEWS, PACKED_INDEX,
+                  get_tile_key, get_overview_path, make_overview)
+
+sys.path.remove(ELEVATION)
+sys.modules.pop('server')
+if api_server is not None:
+    sys.modules['server'] = api_server
+
+SIZE = 72
+COUNT = 3
+
+
+@pytest.fixture
+def tiles(tmp_path):
+    source = str(tmp_path / 'source')
+    target = str(tmp_path / 'target')
+    pack.write_synthetic_tiles(source, COUNT, size=SIZE)
+    return source, target
+
+
+def get_source_tiles(source):
+    return {get_tile_key(f): ALOSTile(join(source, f)) for f in sorted(os.listdir(source))}
+
+
+def check_packed(source, target):
+    originals = get_source_tiles(source)
+    with open(join(target, PACKED_INDEX)) as f:
+        index = json.load(f)['tiles']
+    assert sorted(index) == sorted(originals)
+
+    for key, original in originals.items():
+        entry = index[key]
+        tile = PackedTile(join(target, entry['file']), **entry)
+        assert np.array_equal(tile.grid, original.grid)
+
+        # Lookups at (and just inside the edges of) a few pixels
+        # have to agree with the GeoTIFF they came from.
+        lng, dx, _, lat, _, dy = entry['transform']
+        for row, col in [(0, 0), (SIZE - 1, SIZE - 1), (10, 50), (SIZE // 2, 3)]:
+            for fraction in [0.01, 0.5, 0.99]:
+                point_lat = lat + (row + fraction) * dy
+                point_lng = lng + (col + fraction) * dx
+                assert tile.lookup(point_lat, point_lng) == original.lookup(point_lat, point_lng)
+                assert tile.lookup(point_lat, point_lng) == int(original.grid[row, col])
+
+        for factor in OVERVIEWS:
+            level, f = tile.get_level(factor)
+            assert f == factor
+            assert np.array_equal(level, make_overview(original.grid, factor))
+            # Overviews keep the highest elevation in each block.
+            for r, c in [(0, 0), (level.shape[0] - 1, level.shape[1] - 1)]:
+                block = original.grid[r * f:(r + 1) * f, c * f:(c + 1) * f]
+                assert level[r, c] == block.max()
+
+    # And the dataset finds the right tile for a coordinate.
+    packed, unpacked = ALOS30m(target), ALOS30m(source)
+    locations = [(40.5, -119.5), (40.01, -118.99), (40.99, -117.01), (41.5, -119.5)]
+    assert packed.lookup_many(locations) == unpacked.lookup_many(locations)
+    assert packed.lookup(41.5, -119.5) is None
+
+
+def test_pack(tiles):
+    source, target = tiles
+    pack.pack(source, target, workers=2)
+    check_packed(source, target)
+
+
+def test_pack_tile_skips_packed_tiles(tiles):
+    source, target = tiles
+    os.makedirs(target)
+    tile_path = join(source, sorted(os.listdir(source))[0])
+    key, entry, size = pack.pack_tile(tile_path, target)
+    assert size > SIZE * SIZE * 2
+    assert pack.pack_tile(tile_path, target) == (key, entry, 0)
+
+
+def test_resume(tiles, capsys):
+    source, target = tiles
+    pack.pack(source, target, workers=2)
+    capsys.readouterr()
+
+    # Interrupt a run partway through one tile: its data got written,
+    # but it never got as far as writing its metadata (or the index).
+    key = get_tile_key(sorted(os.listdir(source))[1])
+    data_path = join(target, key + '.bin')
+    os.remove(join(target, key + '.json'))
+    os.remove(join(target, PACKED_INDEX))
+    with open(data_path, 'r+b') as f:
+        f.truncate(100)
+    os.remove(get_overview_path(data_path, OVERVIEWS[-1]))
+
+    pack.pack(source, target, workers=2)
+    assert f'Packed {COUNT} tiles ({COUNT - 1} already packed)' in capsys.readouterr().out
+    check_packed(source, target)
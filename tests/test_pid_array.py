@@ -0,0 +1,146 @@
+import math
+import random
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from simple_pid import PID
+from pid_array import PIDArray
+
+SIZE = 6
+
+# One configuration per controller, to cover every code path side by side.
+KP = [0.5, 1.2, 0.0, 2.0, 0.8, 0.3]
+KI = [0.0, 0.4, 1.0, 0.1, 0.25, 0.0]
+KD = [0.0, 0.05, 0.2, 0.0, 0.1, 1.5]
+SETPOINT = [0, 10, -3, 5.5, 100, 1]
+LOWER = [None, -5, -1, None, 0, -2]
+UPPER = [None, 5, 1, 20, None, 2]
+ON_MEASUREMENT = [False, True, False, True, False, False]
+DIFFERENTIAL_ON_MEASUREMENT = [True, False, True, True, False, False]
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_controllers(sample_time, clock):
+    scalars = [PID(KP[i], KI[i], KD[i], setpoint=SETPOINT[i], sample_time=sample_time,
+                   output_limits=(LOWER[i], UPPER[i]),
+                   proportional_on_measurement=ON_MEASUREMENT[i],
+                   differetial_on_measurement=DIFFERENTIAL_ON_MEASUREMENT[i])
+               for i in range(SIZE)]
+    array = PIDArray(SIZE, KP, KI, KD, setpoint=SETPOINT, sample_time=sample_time,
+                     output_limits=(LOWER, UPPER),
+                     proportional_on_measurement=ON_MEASUREMENT,
+                     differetial_on_measurement=DIFFERENTIAL_ON_MEASUREMENT)
+    for pid in scalars + [array]:
+        pid.time_fn = clock
+        pid.reset()
+    return scalars, array
+
+
+def assert_matches(scalar_outputs, array_outputs):
+    assert len(array_outputs) == len(scalar_outputs)
+    for expected, actual in zip(scalar_outputs, array_outputs):
+        if expected is None:
+            assert math.isnan(actual)
+        else:
+            assert actual == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+def assert_state_matches(scalars, array):
+    for i, pid in enumerate(scalars):
+        for expected, actual in zip(pid.components, array.components):
+            assert actual[i] == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize('sample_time', [None, 0.01, 0.05])
+@pytest.mark.parametrize('explicit_dt', [False, True])
+def test_matches_scalar_pid(sample_time, explicit_dt):
+    rng = random.Random(1)
+    clock = FakeTime()
+    scalars, array = make_controllers(sample_time, clock)
+
+    for step in range(300):
+        dt = rng.choice([0.005, 0.01, 0.02, 0.1])
+        clock.now += dt
+        inputs = [rng.uniform(-20, 120) for _ in range(SIZE)]
+
+        if step % 37 == 0:
+            # Switch a random set of controllers between manual and auto mode.
+            enabled = [rng.random() < 0.6 for _ in range(SIZE)]
+            last_output = [rng.uniform(-10, 10) for _ in range(SIZE)]
+            for i, pid in enumerate(scalars):
+                pid.set_auto_mode(enabled[i], last_output[i])
+            array.set_auto_mode(enabled, last_output)
+
+        if explicit_dt:
+            expected = [pid(inputs[i], dt) for i, pid in enumerate(scalars)]
+            actual = array(inputs, dt)
+        else:
+            expected = [pid(inputs[i]) for i, pid in enumerate(scalars)]
+            actual = array(inputs)
+        assert_matches(expected, actual)
+        assert_state_matches(scalars, array)
+
+
+def test_matches_scalar_pid_with_per_controller_dt():
+    rng = random.Random(2)
+    clock = FakeTime()
+    scalars, array = make_controllers(0.01, clock)
+
+    for _ in range(200):
+        dts = [rng.choice([0.005, 0.01, 0.03]) for _ in range(SIZE)]
+        inputs = [rng.uniform(-20, 120) for _ in range(SIZE)]
+        expected = [pid(inputs[i], dts[i]) for i, pid in enumerate(scalars)]
+        assert_matches(expected, array(inputs, dts))
+
+
+def test_matches_scalar_pid_after_changes():
+    rng = random.Random(3)
+    clock = FakeTime()
+    scalars, array = make_controllers(None, clock)
+
+    for step in range(200):
+        clock.now += 0.02
+        inputs = [rng.uniform(-20, 120) for _ in range(SIZE)]
+        if step == 50:
+            for pid in scalars:
+                pid.tunings = (1.5, 0.3, 0.1)
+            array.tunings = (1.5, 0.3, 0.1)
+        if step == 100:
+            for pid in scalars:
+                pid.output_limits = (-1, 1)
+            array.output_limits = (-1, 1)
+        if step == 150:
+            for i, pid in enumerate(scalars):
+                pid.setpoint = -SETPOINT[i]
+            array.setpoint = -np.array(SETPOINT, dtype=float)
+        expected = [pid(inputs[i]) for i, pid in enumerate(scalars)]
+        assert_matches(expected, array(inputs))
+
+
+def test_error_map():
+    clock = FakeTime()
+    scalars, array = make_controllers(None, clock)
+    for pid in scalars:
+        pid.error_map = lambda error: max(-1.0, min(1.0, error))
+    array.error_map = lambda error: np.clip(error, -1, 1)
+
+    for value in [0, 3, -7, 0.5, 12, -0.25]:
+        clock.now += 0.02
+        expected = [pid(value) for pid in scalars]
+        assert_matches(expected, array(value))
+
+
+def test_rejects_non_positive_dt():
+    _, array = make_controllers(None, FakeTime())
+    with pytest.raises(ValueError):
+        array(1, 0)
+    with pytest.raises(ValueError):
+        array(1, [0.01, 0.01, -0.01, 0.01, 0.01, 0.01])
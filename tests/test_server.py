@@ -0,0 +1,109 @@
+import io
+import time
+import contextlib
+from threading import Thread
+from http.client import HTTPConnection
+import pytest
+
+pytest.importorskip('SimConnect')
+
+import server
+from stand_in import StandInSimConnection
+from autopilot import AutoPilot
+from constants import LEVEL_FLIGHT
+
+
+def quietly(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+@pytest.fixture
+def auto_pilot(monkeypatch):
+    sim = StandInSimConnection()
+    auto_pilot = quietly(AutoPilot, sim)
+    monkeypatch.setattr(server, 'sim_connection', sim)
+    monkeypatch.setattr(server, 'auto_pilot', auto_pilot)
+    monkeypatch.setattr(server, 'parameter_cache', server.EncodedCache())
+    monkeypatch.setattr(server, 'LONG_POLL_TIMEOUT', 0.5)
+    return auto_pilot
+
+
+@pytest.fixture
+def port(auto_pilot):
+    web_server = server.APIServer(('127.0.0.1', 0), server.ProxyServer)
+    Thread(target=web_server.serve_forever, args=(0.05,), daemon=True).start()
+    yield web_server.server_address[1]
+    web_server.shutdown()
+    web_server.server_close()
+
+
+def get(port, path, headers={}):
+    connection = HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.getheader('ETag'), response.read()
+    finally:
+        connection.close()
+
+
+def test_wait_for_change(auto_pilot):
+    version = auto_pilot.version
+    start = time.perf_counter()
+    assert auto_pilot.wait_for_change(version, 0.2) == version
+    assert time.perf_counter() - start >= 0.2
+    # Any other version is a change, including one from before a restart.
+    assert auto_pilot.wait_for_change(version - 1, 10) == version
+    assert auto_pilot.wait_for_change(version + 100, 10) == version
+
+    Thread(target=lambda: (time.sleep(0.1), quietly(auto_pilot.toggle, LEVEL_FLIGHT))).start()
+    start = time.perf_counter()
+    assert auto_pilot.wait_for_change(version, 10) == version + 1
+    assert time.perf_counter() - start < 5
+
+
+def test_etag(auto_pilot, port):
+    status, etag, body = get(port, '/autopilot')
+    assert status == 200
+    assert etag == f'"{auto_pilot.version}"'
+    assert body
+    assert get(port, '/autopilot', {'If-None-Match': etag})[:2] == (304, etag)
+    assert get(port, '/autopilot', {'If-None-Match': 'W/' + etag})[0] == 304
+    assert get(port, '/autopilot', {'If-None-Match': '"other", ' + etag})[0] == 304
+    assert get(port, '/autopilot', {'If-None-Match': '*'})[0] == 304
+
+    quietly(auto_pilot.toggle, LEVEL_FLIGHT)
+    status, new_etag, _ = get(port, '/autopilot', {'If-None-Match': etag})
+    assert status == 200
+    assert new_etag != etag
+
+
+def test_long_poll(auto_pilot, port):
+    version = auto_pilot.version
+    start = time.perf_counter()
+    assert get(port, f'/autopilot?since={version}')[:2] == (304, f'"{version}"')
+    assert time.perf_counter() - start >= 0.5
+
+    # A client that saw a newer version than ours (we restarted) gets an answer right away.
+    start = time.perf_counter()
+    assert get(port, f'/autopilot?since={version + 10}')[0] == 200
+    assert time.perf_counter() - start < 0.5
+
+    Thread(target=lambda: (time.sleep(0.1), quietly(auto_pilot.toggle, LEVEL_FLIGHT))).start()
+    status, etag, _ = get(port, f'/autopilot?since={version}')
+    assert (status, etag) == (200, f'"{version + 1}"')
+
+
+@pytest.mark.parametrize('path', [
+    '/autopilot?since=abc',
+    '/autopilot/log?since=x',
+    '/autopilot/log?limit=x',
+    '/autopilot/log?limit=-1',
+])
+def test_bad_arguments(port, path):
+    assert get(port, path)[0] == 400
+
+
+def test_log_limit(port):
+    assert get(port, '/autopilot/log?limit=0')[2] == b'[]'
@@ -138,6 +138,10 @@ export class Autopilot {
   }
 
   async toggleTER() {
+    if (!this.vsh.classList.contains(`active`)) {
+      await this.toggleVSH();
+    }
+    await fetch(`${autopilotURL}?type=TER`, { method: `POST` });
     this.terrain.classList.toggle(`active`);
     this.follow_terrain = this.terrain.classList.contains(`active`);
     console.log(`AP: Follow terrain: ${this.follow_terrain}`);
@@ -198,8 +202,10 @@ export class Autopilot {
 async function updateElevationMap(lat, long, heading, altitude) {
   // get lat/long information for the next 12NM,
   // e.g. 1/5th of a degree, on the current heading.
+  // A degree of longitude gets shorter the further we are from
+  // the equator, so scale the east/west component to match.
   let a = rad(heading);
-  const [lat2, long2] = [lat + 0.2 * cos(a), long + 0.2 * sin(a)];
+  const [lat2, long2] = [lat + 0.2 * cos(a), long + (0.2 * sin(a)) / cos(rad(lat))];
   const points = [`${lat},${long}`];
   for (let s = 0.01, i = s; i < 1.0; i += s) {
     let x = (1 - i) * lat + i * lat2;
@@ -212,11 +218,11 @@ async function updateElevationMap(lat, long, heading, altitude) {
     `http://localhost:9000?locations=${points.join(`|`)}`
   ).then((r) => r.json());
 
-  makePath(response, altitude);
+  makePath(response);
   return points;
 }
 
-async function makePath(response, altitude) {
+async function makePath(response) {
   let minElevation = 50000;
   let maxElevation = -50000;
   response.results.forEach(({ elevation: e }) => {
@@ -225,17 +231,8 @@ async function makePath(response, altitude) {
     if (e > maxElevation) maxElevation = e | 0;
   });
 
-  // should we change target altitudes?
-  const targetElevation = maxElevation + 500;
-  if (maxElevation > altitude || maxElevation < altitude - 25) {
-    fetch(
-      `http://localhost:8080/autopilot?type=ALT&target=${targetElevation}`,
-      {
-        method: `POST`,
-      }
-    );
-  }
-
+  // The autopilot itself sets our target altitude, based on the
+  // terrain ahead, so all we do here is draw the elevation profile.
   const elevations = response.results.map(
     (v, x) => `L ${x} ${v.elevation / 0.3048}`
   );